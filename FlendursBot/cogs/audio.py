@@ -20,7 +20,9 @@ import inspect
 import subprocess
 import urllib.parse
 import datetime
+import wave
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
 
 __author__ = "tekulvw"
 __version__ = "0.1.1"
@@ -32,6 +34,11 @@ try:
 except:
     youtube_dl = None
 
+try:
+    import mutagen
+except ImportError:
+    mutagen = None
+
 try:
     if not discord.opus.is_loaded():
         discord.opus.load_opus('libopus-0.dll')
@@ -56,6 +63,36 @@ youtube_dl_options = {
     'encoding': 'utf-8'
 }
 
+# youtube-dl extractions allowed to run at the same time
+RESOLVER_WORKERS = 4
+
+# Songs allowed to be downloaded ahead of time at once, across all servers
+PREFETCH_DOWNLOADS = 2
+MAX_PREFETCH = 10
+
+# ffmpeg output options for the normalized cache: EBU R128 loudness as 48kHz
+# stereo 16 bit WAV, the PCM the voice connection encodes, so those songs are
+# played straight from the file without ffmpeg. The target is about what a
+# typical song sounds like at the default volume of 50.
+NORMALIZE_OPTIONS = ['-vn', '-af', 'loudnorm=I=-20:TP=-2:LRA=11',
+                     '-ar', '48000', '-ac', '2',
+                     '-c:a', 'pcm_s16le', '-f', 'wav']
+
+# Seconds without playback (or listeners) before leaving the voice channel
+IDLE_DISCONNECT = 300
+
+# Playlist entries are handed over in batches of this size while being listed
+PLAYLIST_BATCH = 25
+
+# A streamed song is cached in the background when its size (guessed from this
+# bitrate if youtube-dl doesn't know it) is at most this share of the cache
+STREAM_BITRATE = 160000
+STREAM_CACHE_SHARE = 0.25
+
+# Song info looked up by youtube-dl is kept this long (seconds) for this many songs
+METADATA_TTL = 7 * 24 * 60 * 60
+METADATA_MAX_ENTRIES = 5000
+
 
 class MaximumLength(Exception):
     def __init__(self, m):
@@ -247,39 +284,164 @@ class Playlist:
             return None
 
 
-class Downloader(threading.Thread):
+class MetadataCache:
+    """youtube-dl info of songs that were looked up before, by song id.
+
+    URLs are mapped to the song id they resolved to, so looking up a known URL
+    doesn't hit the extractor until the entry expires or is evicted as the
+    least recently used one. Jobs read and write it from the resolver's
+    threads; it is saved to disk a while after it changes."""
+
+    FIELDS = ("id", "title", "duration", "webpage_url", "thumbnail",
+              "view_count", "average_rating", "creator", "uploader")
+    TIMESTAMPED = re.compile(r'[?&#](?:t|start|end)=')
+
+    def __init__(self, path, loop, ttl=METADATA_TTL,
+                 max_entries=METADATA_MAX_ENTRIES, save_delay=60):
+        self.path = path
+        self.loop = loop
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # song id: info, LRU first
+        self._urls = {}  # url: song id
+        self._handle = None
+        self._load()
+
+    def _key(self, url):
+        match = re.search(r'(?:youtube\.com/.*[?&]v=|youtu\.be/)([\w-]{11})', url)
+        if match:
+            return "youtube:" + match.group(1)
+        return url
+
+    def get(self, url):
+        """Cached info for the URL or None"""
+        if self.TIMESTAMPED.search(url):
+            # The key drops the timestamp, youtube-dl has to read it
+            return None
+        with self._lock:
+            song_id = self._urls.get(self._key(url))
+            info = self._entries.get(song_id)
+            if info is None:
+                return None
+            if info["cached_at"] + self.ttl < time.time():
+                del self._entries[song_id]
+                return None
+            self._entries.move_to_end(song_id)
+            return dict(info)
+
+    def put(self, url, video):
+        """Stores the info youtube-dl returned for a single song"""
+        if video.get("id") is None or "entries" in video or \
+                video.get("start_time") or video.get("end_time"):
+            return  # Playlists and timestamped links aren't cached
+        info = {k: video[k] for k in self.FIELDS if k in video}
+        info["cached_at"] = time.time()
+        with self._lock:
+            self._entries[info["id"]] = info
+            self._entries.move_to_end(info["id"])
+            self._urls[self._key(url)] = info["id"]
+            self._urls[self._key(info.get("webpage_url") or url)] = info["id"]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self.loop.call_soon_threadsafe(self._changed)
+
+    def save(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        with self._lock:
+            live = set(self._entries)
+            data = {"songs": list(self._entries.values()),
+                    "urls": {u: i for u, i in self._urls.items() if i in live}}
+        dataIO.save_json(self.path, data)
+
+    def _load(self):
+        if not dataIO.is_valid_json(self.path):
+            return
+        data = dataIO.load_json(self.path)
+        expired = time.time() - self.ttl
+        for info in data.get("songs", []):
+            if info["cached_at"] > expired:
+                self._entries[info["id"]] = info
+        self._urls = {u: i for u, i in data.get("urls", {}).items()
+                      if i in self._entries}
+
+    def _changed(self):
+        if self._handle is None:
+            self._handle = self.loop.call_later(self.save_delay, self._snapshot)
+
+    def _snapshot(self):
+        self._handle = None
+        try:
+            self.save()
+        except Exception:
+            log.exception("Could not save the audio metadata cache")
+
+
+class Downloader:
+    """A single youtube-dl job. Jobs are run by the Resolver's thread pool,
+    awaiting one waits for it to finish and returns the Downloader."""
+
     def __init__(self, url, max_duration=None, download=False,
-                 cache_path="data/audio/cache", *args, **kwargs):
-        super().__init__(*args, **kwargs)
+                 cache_path="data/audio/cache", metadata=None, stream=False):
         self.url = url
         self.max_duration = max_duration
+        self._stream = stream
+        self.cache_path = cache_path
+        self.metadata = metadata
         self.done = threading.Event()
         self.song = None
         self._download = download
         self.hit_max_length = threading.Event()
         self._yt = None
         self.error = None
+        self.future = None
+
+    def __await__(self):
+        # Shielded so a cancelled waiter doesn't cancel the job for the others
+        yield from asyncio.shield(self.future)
+        return self
 
     def run(self):
         try:
             self.get_info()
             if self._download:
                 self.download()
+            elif self._stream:
+                self.resolve_stream()
         except youtube_dl.utils.DownloadError as e:
             self.error = str(e)
         except MaximumLength:
             self.hit_max_length.set()
         except OSError as e:
             log.warning("An operating system error occurred while downloading URL '{}':\n'{}'".format(self.url, str(e)))
+        except Exception as e:
+            log.exception("youtube-dl failed on URL '{}'".format(self.url))
+            self.error = str(e)
         self.done.set()
 
     def download(self):
         self.duration_check()
 
-        if not os.path.isfile('data/audio/cache' + self.song.id):
+        if not os.path.isfile(os.path.join(self.cache_path, self.song.id)):
+            if self._yt is None:
+                self._yt = youtube_dl.YoutubeDL(youtube_dl_options)
             video = self._yt.extract_info(self.url)
             self.song = Song(**video)
 
+    def resolve_stream(self):
+        """Looks up the direct media URL so ffmpeg can play the song while
+        it's being fetched"""
+        self.duration_check()
+
+        if self._yt is None:
+            self._yt = youtube_dl.YoutubeDL(youtube_dl_options)
+        video = self._yt.extract_info(self.url, download=False)
+        self.song = Song(**video)
+        self.song.stream_url = video.get("url")
+
     def duration_check(self):
         log.debug("duration {} for songid {}".format(self.song.duration,
                                                      self.song.id))
@@ -288,7 +450,20 @@ class Downloader(threading.Thread):
             raise MaximumLength("songid {} has duration {} > {}".format(
                 self.song.id, self.song.duration, self.max_duration))
 
+    def cached_info(self):
+        """Fills in the song from the metadata cache, returns True on a hit"""
+        if self.metadata is None or "[SEARCH:]" in self.url:
+            return False
+        info = self.metadata.get(self.url)
+        if info is None:
+            return False
+        del info["cached_at"]
+        self.song = Song(**info)
+        return True
+
     def get_info(self):
+        if self.cached_info():
+            return
         if self._yt is None:
             self._yt = youtube_dl.YoutubeDL(youtube_dl_options)
         if "[SEARCH:]" not in self.url:
@@ -304,9 +479,335 @@ class Downloader(threading.Thread):
                                           process=False)
 
         if(video is not None):
+            if self.metadata is not None:
+                self.metadata.put(self.url, video)
             self.song = Song(**video)
 
 
+class NormalizedSong:
+    """Reads the PCM of a normalized cache file for a stream player"""
+
+    def __init__(self, path):
+        self._wav = wave.open(path, "rb")
+        if (self._wav.getframerate(), self._wav.getnchannels(),
+                self._wav.getsampwidth()) != (48000, 2, 2):
+            self._wav.close()
+            raise wave.Error("not a normalized song")
+
+    @classmethod
+    def open(cls, path):
+        """The file's reader, or None if it wasn't normalized"""
+        try:
+            return cls(path)
+        except (wave.Error, EOFError, OSError):
+            return None
+
+    def read(self, size):
+        return self._wav.readframes(size // 4)  # 4 bytes per stereo frame
+
+    def close(self):
+        self._wav.close()
+
+
+class CacheIndex:
+    """Sizes of the files in the audio cache, least recently used first.
+
+    The folder is only listed once; afterwards files are added when a download
+    finishes and moved to the back when they're played."""
+
+    def __init__(self, path):
+        self.path = path
+        self.files = collections.OrderedDict()  # song id: size in bytes
+        self.size = 0
+        entries = []
+        for name in os.listdir(path):
+            try:
+                if name.endswith(".normalizing"):  # interrupted conversion
+                    os.remove(os.path.join(path, name))
+                    continue
+                stat = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self.files[name] = size
+            self.size += size
+
+    def add(self, song_id):
+        """Records a downloaded file, or marks a cached one as just used"""
+        if song_id in self.files:
+            self.files.move_to_end(song_id)
+            return
+        try:
+            size = os.path.getsize(os.path.join(self.path, song_id))
+        except OSError:
+            return
+        self.files[song_id] = size
+        self.size += size
+
+    touch = add
+
+    def update(self, song_id):
+        """Re-reads the size of a file that was rewritten"""
+        self.size -= self.files.pop(song_id, 0)
+        self.add(song_id)
+
+    def evict(self, limit, keep=()):
+        """Deletes least recently used files not in keep until the cache holds
+        at most limit bytes. Returns the number of bytes freed."""
+        freed = 0
+        for song_id in list(self.files):
+            if self.size <= limit:
+                break
+            if song_id in keep:
+                continue
+            try:
+                os.remove(os.path.join(self.path, song_id))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # A directory got in the cache, or the file is in use
+                continue
+            size = self.files.pop(song_id)
+            self.size -= size
+            freed += size
+        return freed
+
+
+class LocalLibrary:
+    """Index of the local playlists, every folder in path being one.
+
+    The index is saved to index_path. refresh() only stats the folders, so
+    just the ones that changed get listed again and only new or modified
+    files get their tags read. Durations need mutagen, without it they're
+    left as None."""
+
+    def __init__(self, path, index_path):
+        self.path = path
+        self.index_path = index_path
+        # name: {"mtime": float, "tracks": {filename: [size, mtime, duration]}}
+        self.playlists = {}
+        self._songlists = {}  # name: sorted filenames
+        self._search = []  # (lowercased "name/filename", "name/filename")
+        self._lock = threading.Lock()
+        if dataIO.is_valid_json(index_path):
+            self.playlists = dataIO.load_json(index_path).get("playlists", {})
+        self._build()
+
+    def refresh(self, force=False):
+        """Brings the index up to date with the disk, blocking. force lists
+        every folder and rereads every file. Returns True if it changed."""
+        with self._lock:
+            playlists = {}
+            changed = False
+            try:
+                names = os.listdir(self.path)
+            except OSError:
+                names = []
+            for name in names:
+                folder = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(folder)
+                except OSError:
+                    continue
+                if not os.path.isdir(folder):
+                    continue
+                old = self.playlists.get(name)
+                if old is not None and not force and old["mtime"] == stat.st_mtime:
+                    playlists[name] = old
+                    continue
+                old_tracks = old["tracks"] if old is not None and not force else {}
+                playlists[name] = {"mtime": stat.st_mtime,
+                                   "tracks": self._scan_folder(folder, old_tracks)}
+                changed = True
+            if set(playlists) != set(self.playlists):
+                changed = True
+            if changed:
+                self.playlists = playlists
+                self._build()
+                dataIO.save_json(self.index_path, {"playlists": playlists})
+            return changed
+
+    def _scan_folder(self, folder, old_tracks):
+        tracks = {}
+        for filename in os.listdir(folder):
+            path = os.path.join(folder, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path):
+                continue
+            old = old_tracks.get(filename)
+            if old is not None and old[:2] == [stat.st_size, stat.st_mtime]:
+                tracks[filename] = old
+            else:
+                tracks[filename] = [stat.st_size, stat.st_mtime,
+                                    self._read_duration(path)]
+        return tracks
+
+    def _read_duration(self, path):
+        if mutagen is None:
+            return None
+        try:
+            tags = mutagen.File(path)
+        except Exception:
+            return None
+        if tags is None or tags.info is None:
+            return None
+        return int(tags.info.length)
+
+    def _build(self):
+        songlists = {}
+        search = []
+        for name, playlist in self.playlists.items():
+            songlists[name] = sorted(playlist["tracks"])
+            for filename in songlists[name]:
+                path = os.path.join(name, filename)
+                search.append((path.lower(), path))
+        search.sort()
+        self._songlists = songlists
+        self._search = search
+
+    def songlist(self, name):
+        return self._songlists.get(name, [])
+
+    def duration(self, filename):
+        """Duration in seconds of a "playlist/file" track, or None"""
+        name, song = os.path.split(filename)
+        try:
+            return self.playlists[name]["tracks"][song][2]
+        except (KeyError, IndexError):
+            return None
+
+    def search(self, query, limit=None):
+        """"playlist/file" paths containing query, ignoring case"""
+        query = query.lower()
+        results = []
+        for lowered, path in self._search:
+            if query in lowered:
+                results.append(path)
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+
+
+class StatusMessage:
+    """A message that's edited to show progress, at most once every
+    interval seconds so long jobs don't hit the rate limits"""
+
+    def __init__(self, bot, channel, interval=2):
+        self.bot = bot
+        self.channel = channel
+        self.interval = interval
+        self.message = None
+        self._text = None
+        self._last_edit = 0
+        self._task = None
+
+    async def start(self, text):
+        self.message = await self.bot.send_message(self.channel, text)
+        self._last_edit = time.time()
+
+    def update(self, text):
+        self._text = text
+        if self._task is None or self._task.done():
+            self._task = self.bot.loop.create_task(self._edit_later())
+
+    async def finish(self, text):
+        if self._task is not None:
+            self._task.cancel()
+        await self._edit(text)
+
+    async def _edit_later(self):
+        await asyncio.sleep(max(self._last_edit + self.interval - time.time(), 0))
+        await self._edit(self._text)
+
+    async def _edit(self, text):
+        self._last_edit = time.time()
+        try:
+            if self.message is None:
+                self.message = await self.bot.send_message(self.channel, text)
+            else:
+                self.message = await self.bot.edit_message(self.message, text)
+        except discord.HTTPException:
+            log.debug("couldn't update status message in {}".format(self.channel))
+
+
+class Resolver:
+    """Runs Downloader jobs on a bounded thread pool.
+
+    Requests for a URL that is already being resolved get the running job
+    instead of a new one."""
+
+    def __init__(self, loop, metadata=None, on_download=None,
+                 max_workers=RESOLVER_WORKERS):
+        self.loop = loop
+        self.metadata = metadata
+        self.on_download = on_download  # called with finished download jobs
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = {}  # (url, max_duration, download, stream): Downloader
+
+    def resolve(self, url, max_duration=None, download=False, stream=False):
+        key = (url, max_duration, download, stream)
+        if key in self._pending:
+            return self._pending[key]
+        d = Downloader(url, max_duration, download=download,
+                       metadata=self.metadata, stream=stream)
+        if not download and not stream and d.cached_info():
+            # Known song, no need for a thread
+            d.done.set()
+            d.future = asyncio.Future(loop=self.loop)
+            d.future.set_result(None)
+            return d
+        d.future = self.loop.run_in_executor(self.executor, d.run)
+        d.future.add_done_callback(lambda f: self._finished(key, d))
+        self._pending[key] = d
+        return d
+
+    def expand(self, url, entry_url, on_entries=None, batch=PLAYLIST_BATCH):
+        """Lists a playlist on the pool. Its entries are read lazily, page by
+        page, and batches of the URLs entry_url() makes of them are passed to
+        on_entries on the event loop as they come in. Awaiting the returned
+        job gives the job, with every URL in job.playlist."""
+        d = Downloader(url)
+        d.playlist = []
+
+        def run():
+            d.run()
+            entries = getattr(d.song, "entries", None)
+            if d.error is not None or entries is None:
+                return
+            pending = []
+            try:
+                for entry in entries:
+                    song_url = entry_url(entry)
+                    if song_url is None:
+                        continue
+                    d.playlist.append(song_url)
+                    pending.append(song_url)
+                    if on_entries is not None and len(pending) >= batch:
+                        self.loop.call_soon_threadsafe(on_entries, pending)
+                        pending = []
+            except Exception as e:
+                log.exception("Couldn't list playlist '{}'".format(url))
+                d.error = str(e)
+            if on_entries is not None and pending:
+                self.loop.call_soon_threadsafe(on_entries, pending)
+
+        d.future = self.loop.run_in_executor(self.executor, run)
+        return d
+
+    def _finished(self, key, d):
+        self._pending.pop(key, None)
+        if d._download and d.error is None and d.song is not None and \
+                self.on_download is not None:
+            self.on_download(d)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
 class Audio:
     """Music Streaming."""
 
@@ -314,17 +815,34 @@ class Audio:
         self.bot = bot
         self.queue = {}  # add deque's, repeat
         self.downloaders = {}  # sid: object
+        self.metadata = MetadataCache("data/audio/metadata.json", bot.loop)
+        self.resolver = Resolver(bot.loop, self.metadata, self._downloaded)
         self.settings = dataIO.load_json("data/audio/settings.json")
         self.settings_path = "data/audio/settings.json"
         self.server_specific_setting_keys = ["VOLUME", "VOTE_ENABLED",
                                              "VOTE_THRESHOLD", "NOPPL_DISCONNECT",
-                                             "NOTIFY", "NOTIFY_CHANNEL", "TIMER_DISCONNECT"]
+                                             "NOTIFY", "NOTIFY_CHANNEL", "TIMER_DISCONNECT",
+                                             "PREFETCH", "STREAM"]
         self.cache_path = "data/audio/cache"
+        self.cache_index = CacheIndex(self.cache_path)
         self.local_playlist_path = "data/audio/localtracks"
+        self.local_library = LocalLibrary(self.local_playlist_path,
+                                          "data/audio/localtracks.json")
         self._old_game = False
 
         self.skip_votes = {}
 
+        self.queue_wakeups = set()  # sids with something new for queue_manager
+        self.queue_tasks = {}  # sid: task running queue_manager
+        self.idle_timers = {}  # sid: handle of the pending idle disconnect
+        self.transcode_queue = asyncio.Queue(loop=bot.loop)  # song ids
+        self.transcode_task = None
+
+        self.prefetchers = {}  # sid: (urls in the window, task)
+        self.prefetched = {}  # sid: ids of the songs in the window
+        self.prefetch_slots = asyncio.Semaphore(PREFETCH_DOWNLOADS,
+                                                loop=bot.loop)
+
         self.connect_timers = {}
 
         if player == "ffmpeg":
@@ -346,28 +864,32 @@ class Audio:
             self._setup_queue(server)
         queued_song = QueuedSong(url, channel)
         self.queue[server.id][QueueKey.QUEUE].append(queued_song)
+        self._wake(server.id)
 
     def _add_to_temp_queue(self, server, url, channel):
         if server.id not in self.queue:
             self._setup_queue(server)
         queued_song = QueuedSong(url, channel)
         self.queue[server.id][QueueKey.TEMP_QUEUE].append(queued_song)
+        self._wake(server.id)
 
     def _addleft_to_queue(self, server, url, channel):
         if server.id not in self.queue:
-            self._setup_queue()
+            self._setup_queue(server)
         queued_song = QueuedSong(url, channel)
         self.queue[server.id][QueueKey.QUEUE].appendleft(queued_song)
+        self._wake(server.id)
 
     def _cache_desired_files(self):
+        """Songs being downloaded or prefetched"""
         filelist = []
-        for server in self.downloaders:
-            song = self.downloaders[server].song
+        for downloader in self.downloaders.values():
             try:
-                filelist.append(song.id)
+                filelist.append(downloader.song.id)
             except AttributeError:
                 pass
-        shuffle(filelist)
+        for song_ids in self.prefetched.values():
+            filelist.extend(song_ids)
         return filelist
 
     def _cache_max(self):
@@ -379,10 +901,10 @@ class Audio:
         return max([60, 48 * math.log(x) * x**0.3])  # log is not log10
 
     def _cache_required_files(self):
-        queue = copy.deepcopy(self.queue)
+        """Songs playing right now"""
         filelist = []
-        for server in queue:
-            now_playing = queue[server].get(QueueKey.NOW_PLAYING)
+        for server_queue in self.queue.values():
+            now_playing = server_queue.get(QueueKey.NOW_PLAYING)
             try:
                 filelist.append(now_playing.id)
             except AttributeError:
@@ -390,23 +912,32 @@ class Audio:
         return filelist
 
     def _cache_size(self):
-        songs = os.listdir(self.cache_path)
-        size = sum(map(lambda s: os.path.getsize(
-            os.path.join(self.cache_path, s)) / 10**6, songs))
-        return size
+        return self.cache_index.size / 10**6
 
     def _cache_too_large(self):
         if self._cache_size() > self._cache_max():
             return True
         return False
 
+    def _cache_stream(self, url, song):
+        """Caches a streamed song in the background if it's small enough"""
+        size = getattr(song, "filesize", None)
+        if size is None and song.duration:
+            size = song.duration * STREAM_BITRATE / 8
+        if size is None or size > self._cache_max() * 10**6 * STREAM_CACHE_SHARE:
+            log.debug("not caching streamed song id {}".format(song.id))
+            return
+        self.bot.loop.create_task(self._download_in_slot(url))
+
     def _clear_queue(self, server):
+        self._cancel_prefetch(server)
         if server.id not in self.queue:
             return
         self.queue[server.id][QueueKey.QUEUE] = deque()
         self.queue[server.id][QueueKey.TEMP_QUEUE] = deque()
 
-    async def _create_ffmpeg_player(self, server, filename, local=False, start_time=None, end_time=None):
+    async def _create_ffmpeg_player(self, server, filename, local=False, start_time=None, end_time=None,
+                                    stream=False):
         """This function will guarantee we have a valid voice client,
             even if one doesn't exist previously."""
         voice_channel_id = self.queue[server.id][QueueKey.VOICE_CHANNEL_ID]
@@ -432,15 +963,26 @@ class Audio:
 
         # Okay if we reach here we definitively have a working voice_client
 
-        if local:
+        if stream:
+            song_filename = filename
+        elif local:
             song_filename = os.path.join(self.local_playlist_path, filename)
         else:
             song_filename = os.path.join(self.cache_path, filename)
 
+        # Normalized cache files are already PCM at the level they play at,
+        # only songs that seek need ffmpeg
+        normalized = None
+        if not stream and not local and not start_time and not end_time:
+            normalized = NormalizedSong.open(song_filename)
+
         use_avconv = self.settings["AVCONV"]
         options = '-b:a 64k -bufsize 64k'
         before_options = ''
 
+        if stream and not use_avconv:
+            # Picks the stream back up when the connection drops
+            before_options += '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 '
         if start_time:
             before_options += '-ss {}'.format(start_time)
         if end_time:
@@ -456,8 +998,22 @@ class Audio:
 
         log.debug("making player on sid {}".format(server.id))
 
+        # The player thread wakes the queue up when the song ends or is skipped
+        def after():
+            if normalized is not None:
+                normalized.close()
+            self.bot.loop.call_soon_threadsafe(self._player_finished, server.id)
+
+        if normalized is not None:
+            # Played at unity gain, which skips the per sample volume step
+            voice_client.audio_player = voice_client.create_stream_player(
+                normalized, after=after)
+            voice_client.audio_player.normalized = True
+            return voice_client
+
         voice_client.audio_player = voice_client.create_ffmpeg_player(
-            song_filename, use_avconv=use_avconv, options=options, before_options=before_options)
+            song_filename, use_avconv=use_avconv, options=options,
+            before_options=before_options, after=after)
 
         # Set initial volume
         vol = self.get_server_settings(server)['VOLUME'] / 100
@@ -487,21 +1043,17 @@ class Audio:
 
         voice_client = self.voice_client(server)
 
+        self._cancel_idle_timer(server.id)
         await voice_client.disconnect()
 
     async def _download_all(self, queued_song_list, channel):
         """
         Doesn't actually download, just get's info for uses like queue_list
         """
-        downloaders = []
-        for queued_song in queued_song_list:
-            d = Downloader(queued_song.url)
-            d.start()
-            downloaders.append(d)
-
-        while any([d.is_alive() for d in downloaders]):
-            await asyncio.sleep(0.1)
-            
+        downloaders = [self.resolver.resolve(queued_song.url)
+                       for queued_song in queued_song_list]
+        downloaders = await asyncio.gather(*downloaders)
+
         songs = [d.song for d in downloaders if d.song is not None and d.error is None]
            
         invalid_downloads = [d for d in downloaders if d.error is not None]
@@ -512,68 +1064,27 @@ class Audio:
 
         return songs
 
-    async def _download_next(self, server, curr_dl, next_dl):
-        """Checks to see if we need to download the next, and does.
-
-        Both curr_dl and next_dl should already be started."""
-        if curr_dl.song is None:
-            # Only happens when the downloader thread hasn't initialized fully
-            #   There's no reason to wait if we can't compare
-            return
-
-        max_length = self.settings["MAX_LENGTH"]
-
-        while next_dl.is_alive():
-            await asyncio.sleep(0.5)
-            
-        error = next_dl.error
-        if(error is not None):
-            raise YouTubeDlError(error)
-
-        if curr_dl.song.id != next_dl.song.id:
-            log.debug("downloader ID's mismatch on sid {}".format(server.id) +
-                      " gonna start dl-ing the next thing on the queue"
-                      " id {}".format(next_dl.song.id))
-            try:
-                next_dl.duration_check()
-            except MaximumLength:
-                return
-            self.downloaders[server.id] = Downloader(next_dl.url, max_length,
-                                                     download=True)
-            self.downloaders[server.id].start()
+    def _dump_cache(self, limit=0):
+        """Deletes the least recently played songs until the cache is down to
+        limit MB. Playing and prefetched songs are kept."""
+        keep = set(self._cache_required_files() + self._cache_desired_files())
+        log.debug("kept cache files:\n\t{}".format(keep))
 
-    def _dump_cache(self, ignore_desired=False):
-        reqd = self._cache_required_files()
-        log.debug("required cache files:\n\t{}".format(reqd))
-
-        opt = self._cache_desired_files()
-        log.debug("desired cache files:\n\t{}".format(opt))
-
-        prev_size = self._cache_size()
-
-        for file in os.listdir(self.cache_path):
-            if file not in reqd:
-                if ignore_desired or file not in opt:
-                    try:
-                        os.remove(os.path.join(self.cache_path, file))
-                    except OSError:
-                        # A directory got in the cache?
-                        pass
-                    except WindowsError:
-                        # Removing a file in use, reqd failed
-                        pass
-
-        post_size = self._cache_size()
-        dumped = prev_size - post_size
-
-        if not ignore_desired and self._cache_too_large():
-            log.debug("must dump desired files")
-            return dumped + self._dump_cache(ignore_desired=True)
+        dumped = self.cache_index.evict(limit * 10**6, keep) / 10**6
 
         log.debug("dumped {} MB of audio files".format(dumped))
 
         return dumped
 
+    def _downloaded(self, downloader):
+        self.cache_index.add(downloader.song.id)
+        if self.settings["NORMALIZE"] and not self.settings["AVCONV"]:
+            self.transcode_queue.put_nowait(downloader.song.id)
+        if self._cache_too_large():
+            log.debug("cache too large ({} > {}), dumping".format(
+                self._cache_size(), self._cache_max()))
+            self._dump_cache(self._cache_max())
+
     # TODO: _enable_controls()
 
     # returns list of active voice channels
@@ -640,48 +1151,44 @@ class Audio:
         if server.id not in self.downloaders:  # We don't have a downloader
             log.debug("sid {} not in downloaders, making one".format(
                 server.id))
-            self.downloaders[server.id] = Downloader(url, max_length)
+            self.downloaders[server.id] = self.resolver.resolve(url, max_length)
 
         if self.downloaders[server.id].url != url:  # Our downloader is old
-            # I'm praying to Jeezus that we don't accidentally lose a running
-            #   Downloader
             log.debug("sid {} in downloaders but wrong url".format(server.id))
-            self.downloaders[server.id] = Downloader(url, max_length)
+            self.downloaders[server.id] = self.resolver.resolve(url, max_length)
 
-        try:
-            # We're assuming we have the right thing in our downloader object
-            self.downloaders[server.id].start()
-            log.debug("starting our downloader for sid {}".format(server.id))
-        except RuntimeError:
-            # Queue manager already started it for us, isn't that nice?
-            pass
+        # Getting info w/o download, the queue manager may have started it already
+        downloader = await self.downloaders[server.id]
 
-        # Getting info w/o download
-        self.downloaders[server.id].done.wait()
-        
         # Youtube-DL threw an exception.
-        error = self.downloaders[server.id].error
+        error = downloader.error
         if(error is not None):
             raise YouTubeDlError(error)
 
         # This will throw a maxlength exception if required
-        self.downloaders[server.id].duration_check()
-        song = self.downloaders[server.id].song
+        downloader.duration_check()
+        song = downloader.song
 
         log.debug("sid {} wants to play songid {}".format(server.id, song.id))
 
         # Now we check to see if we have a cache hit
         cache_location = os.path.join(self.cache_path, song.id)
-        if not os.path.exists(cache_location):
+        if not os.path.exists(cache_location) and \
+                self.get_server_settings(server)["STREAM"]:
+            log.debug("streaming song id {}".format(song.id))
+            self.downloaders[server.id] = self.resolver.resolve(
+                url, max_length, stream=True)
+            downloader = await self.downloaders[server.id]
+            if downloader.error is not None:
+                raise YouTubeDlError(downloader.error)
+            song = downloader.song
+            self._cache_stream(url, song)
+        elif not os.path.exists(cache_location):
             log.debug("cache miss on song id {}".format(song.id))
-            self.downloaders[server.id] = Downloader(url, max_length,
-                                                     download=True)
-            self.downloaders[server.id].start()
-
-            while self.downloaders[server.id].is_alive():
-                await asyncio.sleep(0.5)
-
-            song = self.downloaders[server.id].song
+            self.downloaders[server.id] = self.resolver.resolve(
+                url, max_length, download=True)
+            downloader = await self.downloaders[server.id]
+            song = downloader.song
         else:
             log.debug("cache hit on song id {}".format(song.id))
 
@@ -710,12 +1217,14 @@ class Audio:
             self.connect_timers[server.id] = time.time() + 300
             raise ConnectTimeout("We timed out connecting to a voice channel,"
                                  " please try again in 10 minutes.")
+        self._check_idle(server)
+
+    async def _refresh_local_library(self, force=False):
+        return await self.bot.loop.run_in_executor(
+            None, self.local_library.refresh, force)
 
     def _list_local_playlists(self):
-        ret = []
-        for thing in os.listdir(self.local_playlist_path):
-            if os.path.isdir(os.path.join(self.local_playlist_path, thing)):
-                ret.append(thing)
+        ret = sorted(self.local_library.playlists)
         log.debug("local playlists:\n\t{}".format(ret))
         return ret
 
@@ -757,14 +1266,17 @@ class Audio:
         return Playlist(**kwargs)
 
     def _local_playlist_songlist(self, name):
-        dirpath = os.path.join(self.local_playlist_path, name)
-        return sorted(os.listdir(dirpath))
+        return self.local_library.songlist(name)
 
     def _make_local_song(self, filename):
         # filename should be playlist_folder/file_name
         folder, song = os.path.split(filename)
+        kwargs = {}
+        duration = self.local_library.duration(filename)
+        if duration is not None:
+            kwargs["duration"] = duration
         return Song(name=song, id=filename, title=song, url=filename,
-                    webpage_url=filename)
+                    webpage_url=filename, **kwargs)
 
     def _make_playlist(self, author, url, songlist):
         try:
@@ -810,60 +1322,80 @@ class Audio:
 
     # TODO: _next_songs_in_queue
 
-    async def _parse_playlist(self, url):
+    async def _parse_playlist(self, url, on_entries=None):
+        """Returns the song URLs of a playlist. on_entries, if given, gets
+        batches of them while the playlist is still being listed."""
         if self._match_sc_playlist(url):
-            return await self._parse_sc_playlist(url)
+            entry_url = self._sc_entry_url
         elif self._match_yt_playlist(url):
-            return await self._parse_yt_playlist(url)
-        raise InvalidPlaylist("The given URL is neither a Soundcloud or"
-                              " YouTube playlist.")
-
-    async def _parse_sc_playlist(self, url):
-        playlist = []
-        d = Downloader(url)
-        d.start()
+            entry_url = self._yt_entry_url
+        else:
+            raise InvalidPlaylist("The given URL is neither a Soundcloud or"
+                                  " YouTube playlist.")
 
-        while d.is_alive():
-            await asyncio.sleep(0.5)
+        d = await self.resolver.expand(url, entry_url, on_entries)
 
         error = d.error
         if(error is not None):
             raise YouTubeDlError(error)
+        if not hasattr(d.song, "entries"):
+            raise InvalidPlaylist("The given URL is not a playlist.")
 
-        for entry in d.song.entries:
-            if entry["url"][4] != "s":
-                song_url = "https{}".format(entry["url"][4:])
-                playlist.append(song_url)
-            else:
-                playlist.append(entry.url)
-
-        return playlist
+        log.debug("song list:\n\t{}".format(d.playlist))
 
-    async def _parse_yt_playlist(self, url):
-        d = Downloader(url)
-        d.start()
-        playlist = []
+        return d.playlist
 
-        while d.is_alive():
-            await asyncio.sleep(0.5)
+    def _sc_entry_url(self, entry):
+        if entry["url"][4] != "s":
+            return "https{}".format(entry["url"][4:])
+        return entry["url"]
 
-        error = d.error
-        if(error is not None):
-            raise YouTubeDlError(error)
+    def _yt_entry_url(self, entry):
+        try:
+            return "https://www.youtube.com/watch?v={}".format(entry['id'])
+        except (KeyError, TypeError):
+            return None
 
-        for entry in d.song.entries:
-            try:
-                song_url = "https://www.youtube.com/watch?v={}".format(
-                    entry['id'])
-                playlist.append(song_url)
-            except AttributeError:
-                pass
-            except TypeError:
-                pass
+    async def _queue_playlist_url(self, server, url, channel):
+        """Queues a YouTube or Soundcloud playlist while it's being listed, so
+        the first songs play before the rest of the playlist is known."""
+        if server.id not in self.queue:
+            self._setup_queue(server)
+        queue = self.queue[server.id][QueueKey.QUEUE]
+        status = StatusMessage(self.bot, channel)
+        queued = []
 
-        log.debug("song list:\n\t{}".format(playlist))
+        def on_entries(urls):
+            # Stop adding if the queue was cleared or replaced meanwhile
+            if self.queue.get(server.id, {}).get(QueueKey.QUEUE) is not queue:
+                return
+            queue.extend(QueuedSong(song_url, channel) for song_url in urls)
+            queued.extend(urls)
+            self._wake(server.id)
+            status.update("Queued {} songs from the playlist so far..."
+                          "".format(len(queued)))
 
-        return playlist
+        await status.start("Loading the playlist...")
+        try:
+            songlist = await self._parse_playlist(url, on_entries)
+        except InvalidPlaylist:
+            await status.finish("That playlist URL is invalid.")
+            return
+        except YouTubeDlError as e:
+            await status.finish("An error occurred while enumerating the"
+                                " playlist:\n'{}'".format(str(e)))
+            return
+        await status.finish("Queued {} songs from the playlist.".format(
+            len(songlist)))
+
+    def _is_playlist_url(self, url):
+        """True for links to a whole playlist rather than a song in one"""
+        if self._match_yt_playlist(url):
+            if "://" not in url:
+                # Without a scheme urlparse reads the host as part of the path
+                url = "//" + url
+            return urlparse(url).path.startswith("/playlist")
+        return self._match_sc_url(url) and "/sets/" in url
 
     async def _play(self, sid, url, channel):
         """Returns the song object of what's playing"""
@@ -892,21 +1424,27 @@ class Audio:
                 await self.bot.send_message(channel, message)
                 return
             local = False
+            stream_url = getattr(song, "stream_url", None)
+            if stream_url is None:
+                self.cache_index.touch(song.id)
         else:  # Assume local
             try:
                 song = self._make_local_song(url)
                 local = True
+                stream_url = None
             except FileNotFoundError:
                 raise
 
         song.song_start_time = datetime.datetime.now()
-        voice_client = await self._create_ffmpeg_player(server, song.id,
+        voice_client = await self._create_ffmpeg_player(server, stream_url or song.id,
                                                         local=local,
                                                         start_time=song.start_time,
-                                                        end_time=song.end_time)
+                                                        end_time=song.end_time,
+                                                        stream=stream_url is not None)
         # That ^ creates the audio_player property
 
         voice_client.audio_player.start()
+        self._check_idle(server)
         log.debug("starting player on sid {}".format(server.id))
 
         return song
@@ -954,8 +1492,7 @@ class Audio:
 
     def _player_count(self):
         count = 0
-        queue = copy.deepcopy(self.queue)
-        for sid in queue:
+        for sid in list(self.queue):
             server = self.bot.get_server(sid)
             try:
                 vc = self.voice_client(server)
@@ -965,6 +1502,71 @@ class Audio:
                 pass
         return count
 
+    def _prefetch(self, server):
+        """Makes sure the next PREFETCH songs in the queue are being cached.
+        Nothing is restarted if those songs didn't change."""
+        count = self.get_server_settings(server)["PREFETCH"]
+        window = (self._get_queue_tempqueue(server, count) +
+                  self._get_queue(server, count))[:count]
+        urls = tuple(queued_song.url for queued_song in window)
+        prefetcher = self.prefetchers.get(server.id)
+        if prefetcher is not None and prefetcher[0] == urls and \
+                not prefetcher[1].done():
+            return
+        self._cancel_prefetch(server)
+        if window:
+            task = self.bot.loop.create_task(
+                self._prefetch_window(server, window))
+            self.prefetchers[server.id] = (urls, task)
+
+    def _cancel_prefetch(self, server):
+        """Stops waiting on the server's prefetches. Downloads that already
+        started finish in the background and keep their slot until then."""
+        prefetcher = self.prefetchers.pop(server.id, None)
+        if prefetcher is not None:
+            prefetcher[1].cancel()
+        self.prefetched.pop(server.id, None)
+
+    async def _prefetch_window(self, server, window):
+        max_length = self.settings["MAX_LENGTH"]
+        song_ids = self.prefetched[server.id] = set()
+        for queued_song in window:
+            url = queued_song.url
+            if not self._valid_playable_url(url) and "[SEARCH:]" not in url:
+                continue  # Local song
+            info = await self.resolver.resolve(url, max_length)
+            if info.error is not None:
+                for key in (QueueKey.TEMP_QUEUE, QueueKey.QUEUE):
+                    try:
+                        self.queue[server.id][key].remove(queued_song)
+                        break
+                    except (KeyError, ValueError):
+                        pass
+                message = ("I'm unable to play '{}' because of an "
+                           "error:\n'{}'".format(self._clean_url(url), info.error))
+                message = escape(message, mass_mentions=True)
+                await self.bot.send_message(queued_song.channel, message)
+                continue
+            try:
+                info.duration_check()
+            except (AttributeError, MaximumLength):
+                continue
+            song_ids.add(info.song.id)
+            if info.song.id in self.cache_index.files:
+                continue
+            log.debug("prefetching songid {} for sid {}".format(
+                info.song.id, server.id))
+            await self._download_in_slot(url)
+
+    async def _download_in_slot(self, url):
+        """Downloads a song once one of the PREFETCH_DOWNLOADS slots is free.
+        The slot is held until the download is done, even if we stop waiting."""
+        await self.prefetch_slots.acquire()
+        job = self.resolver.resolve(url, self.settings["MAX_LENGTH"],
+                                    download=True)
+        job.future.add_done_callback(lambda f: self.prefetch_slots.release())
+        await job
+
     def _playlist_exists(self, server, name):
         return self._playlist_exists_local(server, name) or \
             self._playlist_exists_global(name)
@@ -1019,9 +1621,11 @@ class Audio:
 
     def _shuffle_queue(self, server):
         shuffle(self.queue[server.id][QueueKey.QUEUE])
+        self._wake(server.id)  # Prefetches the new upcoming songs
 
     def _shuffle_temp_queue(self, server):
         shuffle(self.queue[server.id][QueueKey.TEMP_QUEUE])
+        self._wake(server.id)
 
     def _server_count(self):
         return max([1, len(self.bot.servers)])
@@ -1032,6 +1636,7 @@ class Audio:
         else:
             self._setup_queue(server)
         self.queue[server.id][QueueKey.QUEUE].extend(songlist)
+        self._wake(server.id)
 
     def _set_queue_channel(self, server, channel):
         if server.id not in self.queue:
@@ -1070,6 +1675,7 @@ class Audio:
                                  QueueKey.NOW_PLAYING: None, QueueKey.NOW_PLAYING_CHANNEL: None}
 
     def _stop(self, server):
+        self._cancel_prefetch(server)
         self._setup_queue(server)
         self._stop_player(server)
         self._stop_downloader(server)
@@ -1154,6 +1760,8 @@ class Audio:
         self.settings["MAX_CACHE"] = size
         await self.bot.say("Max cache size set to {} MB.".format(size))
         self.save_settings()
+        if self._cache_too_large():
+            self._dump_cache(self._cache_max())
 
     @audioset.command(name="emptydisconnect", pass_context=True)
     @checks.mod_or_permissions(manage_messages=True)
@@ -1185,6 +1793,28 @@ class Audio:
         await self.bot.say("Maximum length is now {} seconds.".format(length))
         self.save_settings()
 
+    @audioset.command(name="normalize")
+    @checks.is_owner()
+    async def audioset_normalize(self):
+        """Toggles converting downloaded songs to loudness normalized PCM
+
+        Normalized songs play without ffmpeg and at a fixed loudness, the
+        volume setting doesn't apply to them. They take about 11 MB of
+        cache per minute."""
+        if self.settings["AVCONV"]:
+            await self.bot.say("Normalizing needs ffmpeg, you're using avconv.")
+            return
+        self.settings["NORMALIZE"] = not self.settings["NORMALIZE"]
+        if self.settings["NORMALIZE"]:
+            await self.bot.say("Downloaded songs will be converted to loudness"
+                               " normalized PCM in the background. They play"
+                               " at a fixed loudness, ignoring the volume"
+                               " setting. Songs that are already cached stay"
+                               " as they are.")
+        else:
+            await self.bot.say("Downloaded songs will be cached as they are.")
+        self.save_settings()
+
     @checks.mod_or_permissions(manage_messages=True)
     @audioset.command(name="notifychannel", pass_context=True)
     async def audioset_notifychannel(self, ctx, channel: discord.Channel):
@@ -1225,6 +1855,28 @@ class Audio:
             await self.bot.say("Player toggled. You're now using ffmpeg.")
         self.save_settings()
 
+    @audioset.command(name="prefetch", pass_context=True, no_pm=True)
+    @checks.mod_or_permissions(manage_messages=True)
+    async def audioset_prefetch(self, ctx, songs: int):
+        """Number of upcoming songs downloaded ahead of time. 0 to disable."""
+        server = ctx.message.server
+        if songs < 0:
+            await self.bot.say("Can't be less than zero.")
+            return
+        elif songs > MAX_PREFETCH:
+            songs = MAX_PREFETCH
+
+        self.set_server_setting(server, "PREFETCH", songs)
+        self.save_settings()
+        if songs == 0:
+            self._cancel_prefetch(server)
+            await self.bot.say("Upcoming songs won't be downloaded ahead of"
+                               " time anymore.")
+        else:
+            self._wake(server.id)
+            await self.bot.say("The next {} song(s) will be downloaded ahead"
+                               " of time.".format(songs))
+
     @audioset.command(name="status")
     @checks.is_owner()  # cause effect is cross-server
     async def audioset_status(self):
@@ -1241,6 +1893,23 @@ class Audio:
                                " status")
         self.save_settings()
 
+    @audioset.command(name="stream", pass_context=True, no_pm=True)
+    @checks.mod_or_permissions(manage_messages=True)
+    async def audioset_stream(self, ctx):
+        """Toggles streaming songs instead of downloading them first"""
+        server = ctx.message.server
+        settings = self.get_server_settings(server.id)
+        stream = settings.get("STREAM", False)
+        self.set_server_setting(server, "STREAM", not stream)
+        if not stream:
+            await self.bot.say("Songs that aren't cached will now start"
+                               " playing right away while they stream in."
+                               " Songs small enough are cached in the"
+                               " background.")
+        else:
+            await self.bot.say("Songs will be downloaded before they play.")
+        self.save_settings()
+
     @audioset.command(name="timerdisconnect", pass_context=True)
     @checks.mod_or_permissions(manage_messages=True)
     async def audioset_timerdisconnect(self, ctx):
@@ -1277,9 +1946,9 @@ class Audio:
                 msg += ("\nWarning: volume levels above 100 may result in"
                         " clipping")
 
-            # Set volume of playing audio
+            # Set volume of playing audio, normalized songs keep their level
             vc = self.voice_client(server)
-            if vc:
+            if vc and not getattr(vc.audio_player, "normalized", False):
                 vc.audio_player.volume = percent / 100
 
             self.save_settings()
@@ -1436,9 +2105,9 @@ class Audio:
             await self.bot.say("I'm already downloading a file!")
             return
 
-        lists = self._list_local_playlists()
+        await self._refresh_local_library()
 
-        if not any(map(lambda l: os.path.split(l)[1] == name, lists)):
+        if name not in self.local_library.playlists:
             await self.bot.say("Local playlist not found.")
             return
 
@@ -1447,6 +2116,7 @@ class Audio:
     @local.command(name="list", no_pm=True)
     async def list_local(self):
         """Lists local playlists"""
+        await self._refresh_local_library()
         playlists = ", ".join(self._list_local_playlists())
         if playlists:
             playlists = "Available local playlists:\n\n" + playlists
@@ -1455,6 +2125,34 @@ class Audio:
         else:
             await self.bot.say("There are no playlists.")
 
+    @local.command(name="search", no_pm=True)
+    async def local_search(self, *, query):
+        """Searches the local playlists for tracks"""
+        await self._refresh_local_library()
+        results = self.local_library.search(query, limit=50)
+        if not results:
+            await self.bot.say("No local tracks found.")
+            return
+        lines = []
+        for path in results:
+            duration = self.local_library.duration(path)
+            if duration is not None:
+                path += " ({})".format(datetime.timedelta(seconds=duration))
+            lines.append(path)
+        msg = "Local tracks matching '{}':\n\n{}".format(query, "\n".join(lines))
+        for page in pagify(escape(msg, mass_mentions=True)):
+            await self.bot.say(page)
+
+    @local.command(name="rescan")
+    @checks.is_owner()
+    async def local_rescan(self):
+        """Rereads every local playlist and track from disk"""
+        await self.bot.type()
+        await self._refresh_local_library(force=True)
+        tracks = sum(len(p["tracks"]) for p in self.local_library.playlists.values())
+        await self.bot.say("Found {} local tracks in {} playlists.".format(
+            tracks, len(self.local_library.playlists)))
+
     @commands.command(pass_context=True, no_pm=True)
     async def pause(self, ctx):
         """Pauses the current song, `[p]resume` to continue."""
@@ -1533,6 +2231,12 @@ class Audio:
             url = url.replace("/", "&#47")
             url = "[SEARCH:]" + url
 
+        if self._is_playlist_url(url):
+            self._stop_player(server)
+            self._clear_queue(server)
+            await self._queue_playlist_url(server, url, channel)
+            return
+
         if "[SEARCH:]" not in url and "youtube" in url:
             parsed_url = urllib.parse.urlparse(url)
             query = urllib.parse.parse_qs(parsed_url.query)
@@ -1613,18 +2317,26 @@ class Audio:
             return
 
         if self._valid_playable_url(url):
+            status = StatusMessage(self.bot, ctx.message.channel)
+            found = []
+
+            def on_entries(urls):
+                found.extend(urls)
+                status.update("Enumerating song list... {} tracks so far."
+                              "".format(len(found)))
+
             try:
-                await self.bot.say("Enumerating song list... This could take"
+                await status.start("Enumerating song list... This could take"
                                    " a few moments.")
-                songlist = await self._parse_playlist(url)
+                songlist = await self._parse_playlist(url, on_entries)
             except InvalidPlaylist:
-                await self.bot.say("That playlist URL is invalid.")
+                await status.finish("That playlist URL is invalid.")
                 return
             except YouTubeDlError as e:
-                await self.bot.say("An error occurred while enumerating the playlist:\n"
-                                   "'{}'".format(str(e)))
+                await status.finish("An error occurred while enumerating the playlist:\n"
+                                    "'{}'".format(str(e)))
                 return
-				
+
             playlist = self._make_playlist(author, url, songlist)
             # Returns a Playlist object
 
@@ -1632,7 +2344,7 @@ class Audio:
             playlist.server = server
 
             self._save_playlist(server, name, playlist)
-            await self.bot.say("Playlist '{}' saved. Tracks: {}".format(
+            await status.finish("Playlist '{}' saved. Tracks: {}".format(
                 name, len(songlist)))
         else:
             await self.bot.say("That URL is not a valid Soundcloud or YouTube"
@@ -1850,7 +2562,9 @@ class Audio:
         queued_song_list = self._get_queue(server, 10)
         tempqueued_song_list = self._get_queue_tempqueue(server, 10)
 
-        await self.bot.say("Gathering information...")
+        if not all(self.metadata.get(q.url) for q in
+                   queued_song_list + tempqueued_song_list):
+            await self.bot.say("Gathering information...")
 
         queue_song_list = await self._download_all(queued_song_list, channel)
         tempqueue_song_list = await self._download_all(tempqueued_song_list, channel)
@@ -2139,65 +2853,91 @@ class Audio:
             return False
         return True
 
-    async def cache_manager(self):
-        while self == self.bot.get_cog("Audio"):
-            if self._cache_too_large():
-                # Our cache is too big, dumping
-                log.debug("cache too large ({} > {}), dumping".format(
-                    self._cache_size(), self._cache_max()))
-                self._dump_cache()
-            await asyncio.sleep(5)  # No need to run this every half second
-
-    async def cache_scheduler(self):
-        await asyncio.sleep(30)  # Extra careful
-
-        self.bot.loop.create_task(self.cache_manager())
-
     def currently_downloading(self, server):
         if server.id in self.downloaders:
-            if self.downloaders[server.id].is_alive():
+            if not self.downloaders[server.id].done.is_set():
                 return True
         return False
 
-    async def disconnect_timer(self):
-        stop_times = {}
-        while self == self.bot.get_cog('Audio'):
-            for vc in self.bot.voice_clients:
-                server = vc.server
-                if not hasattr(vc, 'audio_player') and \
-                        (server not in stop_times or
-                         stop_times[server] is None):
-                    log.debug("putting sid {} in stop loop, no player".format(
-                        server.id))
-                    stop_times[server] = int(time.time())
-
-                if hasattr(vc, 'audio_player'):
-                    if vc.audio_player.is_done():
-                        if server not in stop_times or stop_times[server] is None:
-                            log.debug("putting sid {} in stop loop".format(server.id))
-                            stop_times[server] = int(time.time())
-
-                    noppl_disconnect = self.get_server_settings(server)
-                    noppl_disconnect = noppl_disconnect.get("NOPPL_DISCONNECT", True)
-                    if noppl_disconnect and len(vc.channel.voice_members) == 1:
-                        if server not in stop_times or stop_times[server] is None:
-                            log.debug("putting sid {} in stop loop".format(server.id))
-                            stop_times[server] = int(time.time())
-                    elif not vc.audio_player.is_done():
-                        stop_times[server] = None
-
-            for server in stop_times:
-                if stop_times[server] and \
-                        int(time.time()) - stop_times[server] > 300:
-                    # 5 min not playing to d/c
-                    timer_disconnect = self.get_server_settings(server)
-                    timer_disconnect = timer_disconnect.get("TIMER_DISCONNECT", True)
-                    if timer_disconnect:
-                        log.debug("dcing from sid {} after 300s".format(server.id))
-                        self._clear_queue(server)
-                        await self._stop_and_disconnect(server)
-                        stop_times[server] = None
-            await asyncio.sleep(5)
+    def _player_finished(self, sid):
+        self._wake(sid)
+        server = self.bot.get_server(sid)
+        if server is not None:
+            self._check_idle(server)
+
+    def _is_idle(self, server):
+        vc = self.voice_client(server)
+        if vc is None:
+            return False
+        if not hasattr(vc, 'audio_player') or vc.audio_player.is_done():
+            return True
+        # Read directly, get_server_settings writes the settings file
+        noppl_disconnect = self.settings["SERVERS"].get(server.id, {}).get(
+            "NOPPL_DISCONNECT", True)
+        return noppl_disconnect and len(vc.channel.voice_members) == 1
+
+    def _check_idle(self, server):
+        """Starts the disconnect timer when nothing is playing or nobody is
+        listening, and stops it otherwise"""
+        if self._is_idle(server):
+            if server.id not in self.idle_timers:
+                log.debug("putting sid {} in stop loop".format(server.id))
+                self.idle_timers[server.id] = self.bot.loop.call_later(
+                    IDLE_DISCONNECT, self._idle_timeout, server.id)
+        else:
+            self._cancel_idle_timer(server.id)
+
+    def _cancel_idle_timer(self, sid):
+        handle = self.idle_timers.pop(sid, None)
+        if handle is not None:
+            handle.cancel()
+
+    def _idle_timeout(self, sid):
+        self.idle_timers.pop(sid, None)
+        server = self.bot.get_server(sid)
+        if server is None or not self._is_idle(server):
+            return
+        if self.settings["SERVERS"].get(sid, {}).get("TIMER_DISCONNECT", True):
+            log.debug("dcing from sid {} after {}s".format(sid, IDLE_DISCONNECT))
+            self._clear_queue(server)
+            self.bot.loop.create_task(self._stop_and_disconnect(server))
+
+    async def transcode_worker(self):
+        """Rewrites downloaded songs as loudness normalized PCM, one at a
+        time so it doesn't compete with the players for CPU"""
+        while True:
+            song_id = await self.transcode_queue.get()
+            path = os.path.join(self.cache_path, song_id)
+            if not os.path.isfile(path):
+                continue
+            temp_path = path + ".normalizing"
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    "ffmpeg", "-y", "-loglevel", "error", "-i", path,
+                    *(NORMALIZE_OPTIONS + [temp_path]),
+                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                    loop=self.bot.loop)
+                _, stderr = await process.communicate()
+            except OSError:
+                log.exception("Couldn't run ffmpeg to normalize {}".format(song_id))
+                continue
+            try:
+                if process.returncode != 0:
+                    log.warning("Normalizing {} failed:\n{}".format(
+                        song_id, stderr.decode(errors="replace")))
+                    os.remove(temp_path)
+                    continue
+                # Players reading the old file keep it open until they're done
+                os.replace(temp_path, path)
+            except OSError:
+                # File in use on Windows, or already evicted
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                continue
+            self.cache_index.update(song_id)
+            log.debug("normalized song id {}".format(song_id))
 
     def get_server_settings(self, server):
         try:
@@ -2265,7 +3005,6 @@ class Audio:
             notify_channel = self.settings["SERVERS"][server.id]["NOTIFY_CHANNEL"]
         if self.get_server_settings(server)["NOTIFY"] is False:
             notify_channel = None
-        max_length = self.settings["MAX_LENGTH"]
 
         # This is a reference, or should be at least
         temp_queue = self.queue[server.id][QueueKey.TEMP_QUEUE]
@@ -2292,7 +3031,8 @@ class Audio:
                     url = queued_song.url
                     channel = queued_song.channel
                     song = await self._play(sid, url, channel)
-                    await self.display_now_playing(server, song, notify_channel)
+                    if song is not None:
+                        await self.display_now_playing(server, song, notify_channel)
                 except MaximumLength:
                     return
             elif len(queue) > 0:  # We're in the normal queue
@@ -2302,7 +3042,8 @@ class Audio:
                 log.debug("calling _play on the normal queue")
                 try:
                     song = await self._play(sid, url, channel)
-                    await self.display_now_playing(server, song, notify_channel)
+                    if song is not None:
+                        await self.display_now_playing(server, song, notify_channel)
                 except MaximumLength:
                     return
                 if repeat and last_song:
@@ -2313,38 +3054,12 @@ class Audio:
             self._set_queue_nowplaying(server, song, channel)
             log.debug("set now_playing for sid {}".format(server.id))
             self.bot.loop.create_task(self._update_bot_status())
+            # Prefetch the next song, or move on if this one couldn't play
+            self._wake(server.id)
 
-        elif server.id in self.downloaders:
-            # We're playing but we might be able to download a new song
-            curr_dl = self.downloaders.get(server.id)
-            if len(temp_queue) > 0:
-                queued_next_song = temp_queue.peekleft()
-                next_url = queued_next_song.url
-                next_channel = queued_next_song.channel
-                next_dl = Downloader(next_url, max_length)
-            elif len(queue) > 0:
-                queued_next_song = queue.peekleft()
-                next_url = queued_next_song.url
-                next_channel = queued_next_song.channel	
-                next_dl = Downloader(next_url, max_length)
-            else:
-                next_dl = None
-
-            if next_dl is not None:
-                try:
-                    # Download next song
-                    next_dl.start()
-                    await self._download_next(server, curr_dl, next_dl)
-                except YouTubeDlError as e:
-                    if len(temp_queue) > 0:
-                        temp_queue.popleft()
-                    elif len(queue) > 0:
-                        queue.popleft()
-                    clean_url = self._clean_url(next_url)
-                    message = ("I'm unable to play '{}' because of an "
-                              "error:\n'{}'".format(clean_url, str(e)))
-                    message = escape(message, mass_mentions=True)
-                    await self.bot.send_message(next_channel, message)
+        else:
+            # We're playing, cache what comes next
+            self._prefetch(server)
 
     async def display_now_playing(self, server, song, notify_channel:int):
         channel = discord.utils.get(server.channels, id=notify_channel)
@@ -2387,33 +3102,29 @@ class Audio:
 
         await self.bot.send_message(channel, "**Now Playing:**", embed=em)
 
-    async def queue_scheduler(self):
-        while self == self.bot.get_cog('Audio'):
-            tasks = []
-            queue = copy.deepcopy(self.queue)
-            for sid in queue:
-                if len(queue[sid][QueueKey.QUEUE]) == 0 and \
-                        len(queue[sid][QueueKey.TEMP_QUEUE]) == 0:
-                    continue
-                # log.debug("scheduler found a non-empty queue"
-                #           " for sid: {}".format(sid))
-                tasks.append(
-                    self.bot.loop.create_task(self.queue_manager(sid)))
-            completed = [t.done() for t in tasks]
-            while not all(completed):
-                completed = [t.done() for t in tasks]
-                await asyncio.sleep(0.5)
-            await asyncio.sleep(1)
-
-    async def reload_monitor(self):
-        while self == self.bot.get_cog('Audio'):
-            await asyncio.sleep(0.5)
-
-        for vc in self.bot.voice_clients:
+    def _wake(self, sid):
+        """Has queue_manager look at the server's queue again. Wakeups that
+        arrive while it's busy are merged into one more run."""
+        self.queue_wakeups.add(sid)
+        task = self.queue_tasks.get(sid)
+        if task is None or task.done():
+            self.queue_tasks[sid] = self.bot.loop.create_task(
+                self.queue_runner(sid))
+
+    async def queue_runner(self, sid):
+        while sid in self.queue_wakeups:
+            self.queue_wakeups.discard(sid)
+            if sid not in self.queue:
+                break
+            if len(self.queue[sid][QueueKey.QUEUE]) == 0 and \
+                    len(self.queue[sid][QueueKey.TEMP_QUEUE]) == 0:
+                continue
             try:
-                vc.audio_player.stop()
-            except:
-                pass
+                await self.queue_manager(sid)
+            except Exception:
+                log.exception("queue_manager failed on sid {}".format(sid))
+                break
+        self.queue_tasks.pop(sid, None)
 
     def save_settings(self):
         dataIO.save_json('data/audio/settings.json', self.settings)
@@ -2442,6 +3153,9 @@ class Audio:
                 # Either the server ID or member ID already isn't in there
         if after is None:
             return
+        if self.voice_connected(server):
+            # Someone joined or left, maybe nobody is listening anymore
+            self._check_idle(server)
         if server.id not in self.queue:
             return
         if after != server.me:
@@ -2464,8 +3178,20 @@ class Audio:
                 vc.audio_player.resume()
 
     def __unload(self):
+        for task in self.queue_tasks.values():
+            task.cancel()
+        for handle in self.idle_timers.values():
+            handle.cancel()
+        if self.transcode_task is not None:
+            self.transcode_task.cancel()
         for vc in self.bot.voice_clients:
+            try:
+                vc.audio_player.stop()
+            except AttributeError:
+                pass
             self.bot.loop.create_task(vc.disconnect())
+        self.resolver.shutdown()
+        self.metadata.save()
 
 
 def check_folders():
@@ -2481,6 +3207,7 @@ def check_files():
     default = {"VOLUME": 50, "MAX_LENGTH": 3700, "VOTE_ENABLED": True,
                "MAX_CACHE": 0, "SOUNDCLOUD_CLIENT_ID": None,
                "TITLE_STATUS": True, "AVCONV": False, "VOTE_THRESHOLD": 50,
+               "PREFETCH": 2, "STREAM": False, "NORMALIZE": False,
                "SERVERS": {}}
     settings_path = "data/audio/settings.json"
 
@@ -2551,7 +3278,4 @@ def setup(bot):
     n = Audio(bot, player=player)  # Praise 26
     bot.add_cog(n)
     bot.add_listener(n.voice_state_update, 'on_voice_state_update')
-    bot.loop.create_task(n.queue_scheduler())
-    bot.loop.create_task(n.disconnect_timer())
-    bot.loop.create_task(n.reload_monitor())
-    bot.loop.create_task(n.cache_scheduler())
+    n.transcode_task = bot.loop.create_task(n.transcode_worker())
@@ -4,6 +4,7 @@
 
 # STD Library
 import asyncio
+import functools
 import gettext
 import logging
 import logging.handlers
@@ -17,7 +18,11 @@ from datetime import datetime, timedelta
 # Discord imports
 import discord
 from .utils import checks
+from .utils import games
+from .utils import simulator
+from .utils.cooldowns import cooldowns
 from .utils.dataIO import dataIO
+from .utils.games import main_deck
 from discord.ext import commands
 from __main__ import send_cmd_help
 
@@ -150,15 +155,6 @@ new_user = {"Chips":         100,
 
 # -------------------------------------------------------------------------------------------------
 
-# Deck used for blackjack, and a dictionary to correspond values of the cards.
-main_deck = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'Jack', 'Queen', 'King', 'Ace'] * 4
-
-bj_values = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9': 9, '10': 10, 'Jack': 10,
-             'Queen': 10, 'King': 10}
-
-war_values = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9': 9, '10': 10, 'Jack': 11,
-              'Queen': 12, 'King': 13, 'Ace': 14}
-
 c_games = ("Blackjack", "Coin", "Allin", "Cups", "Dice", "Hi-Lo", "War")
 
 threshold_msg = ("```Your winnings exceeded the threshold set on this server. "
@@ -994,8 +990,7 @@ class Casino(CasinoBank):
         super().withdraw_chips(user, bet)
         settings["Players"][user.id]["Played"]["Hi-Lo"] += 1
         await self.bot.say(_("The dice hit the table and slowly fall into place..."))
-        die_one = random.randint(1, 6)
-        die_two = random.randint(1, 6)
+        die_one, die_two = games.roll_dice()
         result = die_one + die_two
         outcome = self.hl_outcome(result)
         await asyncio.sleep(2)
@@ -1008,12 +1003,11 @@ class Casino(CasinoBank):
                       "{} ({})!").format(result, outcome[0]))
             settings["Players"][user.id]["Won"]["Hi-Lo"] += 1
 
-            # Check for a 7 to give a 12x multiplier
+            # Check for a 7 to give a 6x multiplier
+            amount = games.hilo_payout(bet, settings["Games"]["Hi-Lo"]["Multiplier"],
+                                       games.hilo_result(result))
             if outcome[0] == _("Seven"):
-                amount = bet * 6
                 msg += _("\n**BONUS!** 6x multiplier for Seven!")
-            else:
-                amount = int(round(bet * settings["Games"]["Hi-Lo"]["Multiplier"]))
 
             # Check if a threshold is set and withold chips if amount is exceeded
             if self.threshold_check(settings, amount):
@@ -1052,13 +1046,13 @@ class Casino(CasinoBank):
         else:  # Run the game when the checks return None
             super().withdraw_chips(user, bet)
             settings["Players"][user.id]["Played"]["Cups"] += 1
-            outcome = random.randint(1, 4)
+            outcome = games.cups_outcome()
             await self.bot.say(_("The cups start shuffling along the table..."))
             await asyncio.sleep(3)
 
             # Begin game logic to determine a win or loss
             if cup == outcome:
-                amount = int(round(bet * settings["Games"]["Cups"]["Multiplier"]))
+                amount = games.payout(bet, settings["Games"]["Cups"]["Multiplier"])
                 settings["Players"][user.id]["Won"]["Cups"] += 1
                 msg = _("Congratulations! The coin was under cup {}!").format(outcome)
 
@@ -1106,7 +1100,7 @@ class Casino(CasinoBank):
 
             # Begin game logic to determine a win or loss
             if choice == outcome:
-                amount = int(round(bet * settings["Games"]["Coin"]["Multiplier"]))
+                amount = games.payout(bet, settings["Games"]["Coin"]["Multiplier"])
                 msg = _("Congratulations! The coin landed on {}!").format(outcome)
                 settings["Players"][user.id]["Won"]["Coin"] += 1
 
@@ -1148,15 +1142,14 @@ class Casino(CasinoBank):
             settings["Players"][user.id]["Played"]["Dice"] += 1
             await self.bot.say(_("The dice strike the back of the table and begin to tumble into "
                                  "place..."))
-            die_one = random.randint(1, 6)
-            die_two = random.randint(1, 6)
+            die_one, die_two = games.roll_dice()
             outcome = die_one + die_two
             await asyncio.sleep(2)
 
             # Begin game logic to determine a win or loss
             msg = _("The dice landed on {} and {} \n").format(die_one, die_two)
-            if outcome in (2, 7, 11, 12):
-                amount = int(round(bet * settings["Games"]["Dice"]["Multiplier"]))
+            if games.dice_wins(outcome):
+                amount = games.payout(bet, settings["Games"]["Dice"]["Multiplier"])
                 settings["Players"][user.id]["Won"]["Dice"] += 1
 
                 msg += _("Congratulations! The dice landed on {}.").format(outcome)
@@ -1248,7 +1241,7 @@ class Casino(CasinoBank):
             settings["Players"][user.id]["Played"]["Allin"] += 1
             amount = int(round(multiplier * settings["Players"][user.id]["Chips"]))
             balance = super().chip_balance(user)
-            outcome = random.randint(0, multiplier + 1)
+            outcome = games.allin_outcome(multiplier)
             super().withdraw_chips(user, balance)
             await self.bot.say(_("You put all your chips into the machine and pull the lever..."))
             await asyncio.sleep(3)
@@ -1283,6 +1276,7 @@ class Casino(CasinoBank):
         for player in settings["Players"]:
             for cd in settings["Players"][player]["Cooldowns"]:
                 settings["Players"][player]["Cooldowns"][cd] = 0
+        cooldowns.clear("Casino", server.id)
 
         super().save_system()
         await self.bot.say(_("Cooldowns have been reset for all users on this server."))
@@ -2017,6 +2011,36 @@ class Casino(CasinoBank):
 
         await self.bot.say(msg)
 
+    @setcasino.command(name="simulate", pass_context=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def _simulate_setcasino(self, ctx, game, rounds: int=1000000, bet: int=None,
+                                  multiplier: int=None):
+        """Simulates a game with the current settings to show its house edge
+
+        Bet defaults to the minimum bet of the game. For Allin the bet is the
+        player's balance and the multiplier, the one given to allin, is required."""
+        author = ctx.message.author
+        settings = super().check_server_settings(author.server)
+        game = game.title()
+
+        if game not in c_games:
+            msg = _("This game does not exist. Please pick from: {}").format(", ".join(c_games))
+        elif not simulator.numpyAvailable:
+            msg = _("The simulator requires numpy. Run 'pip3 install numpy'.")
+        elif not 0 < rounds <= 50000000:
+            msg = _("Rounds need to be between 1 and 50,000,000.")
+        elif game == "Allin" and multiplier is None:
+            msg = _("Allin needs the multiplier you would pass to the allin command, "
+                    "e.g. {}setcasino simulate allin 1000000 500 2").format(ctx.prefix)
+        else:
+            await self.bot.say(_("Simulating {:,} rounds of {}...").format(rounds, game))
+            task = functools.partial(simulator.simulate_casino, game, settings, rounds, bet,
+                                     allin_multiplier=multiplier)
+            result = await self.bot.loop.run_in_executor(None, task)
+            msg = "```\n{}```".format(simulator.format_result(result))
+
+        await self.bot.say(msg)
+
     async def table_split(self, user, headers, data, sort):
         groups = [data[i:i + 12] for i in range(0, len(data), 12)]
         pages = len(groups)
@@ -2306,71 +2330,12 @@ class Casino(CasinoBank):
                 msg = (_("Your bet needs to be exactly {}.").format(mi))
             return msg
 
-    @staticmethod
-    def war_draw(deck):
-        player_card = random.choice(deck)
-        deck.remove(player_card)
-        dealer_card = random.choice(deck)
-        pc = war_values[player_card]
-        dc = war_values[dealer_card]
-        return player_card, dealer_card, pc, dc
-
-    @staticmethod
-    def burn_three(deck):
-        burn_cards = random.sample(deck, 3)
-
-        for x in burn_cards:
-            deck.remove(x)
-
-        player_card = random.choice(deck)
-        deck.remove(player_card)
-        dealer_card = random.choice(deck)
-        pc = war_values[player_card]
-        dc = war_values[dealer_card]
-
-        return player_card, dealer_card, pc, dc
-
-    @staticmethod
-    def draw_two(deck):
-        hand = random.sample(deck, 2)
-        deck.remove(hand[0])
-        deck.remove(hand[1])
-        return hand
-
-    @staticmethod
-    def draw_card(hand, deck):
-        card = random.choice(deck)
-        deck.remove(card)
-        hand.append(card)
-        return hand
-
-    @staticmethod
-    def count_hand(hand):
-        count = sum([bj_values[x] for x in hand if x in bj_values])
-
-        for x in hand:
-            if x == 'Ace' and count + 11 > 21:
-                count += 1
-            elif x == 'Ace':
-                count += 11
-
-        return count
-
-    @classmethod
-    def dealer(cls, deck):
-        dh = cls.draw_two(deck)
-        count = cls.count_hand(dh)
-
-        # forces hit if ace in first two cards without 21
-        if 'Ace' in dh and count != 21:
-            dh = cls.draw_card(dh, deck)
-            count = cls.count_hand(dh)
-
-        # defines maximum hit score X
-        while count < 17:
-            cls.draw_card(dh, deck)
-            count = cls.count_hand(dh)
-        return dh
+    war_draw = staticmethod(games.war_draw)
+    burn_three = staticmethod(games.burn_three)
+    draw_two = staticmethod(games.draw_two)
+    draw_card = staticmethod(games.draw_card)
+    count_hand = staticmethod(games.count_hand)
+    dealer = staticmethod(games.dealer_hand)
 
     def war_results(self, settings, user, outcome, player_card, dealer_card, amount):
         chip_name = settings["System Config"]["Chip Name"]
@@ -2407,12 +2372,13 @@ class Casino(CasinoBank):
         chip_name = settings["System Config"]["Chip Name"]
         dc = self.count_hand(dh)
         pc = self.count_hand(ph)
+        result = games.blackjack_result(pc, dc)
         msg = (_("======**{}**======\nYour hand: {}\nYour score: {}\nDealer's hand: {}\nDealer's "
                  "score: {}\n").format(user.name, ", ".join(ph), pc, ", ".join(dh), dc))
 
-        if dc > 21 >= pc or dc < pc <= 21:
+        if result == "Win":
             settings["Players"][user.id]["Won"]["Blackjack"] += 1
-            total = int(round(amount * settings["Games"]["Blackjack"]["Multiplier"]))
+            total = games.payout(amount, settings["Games"]["Blackjack"]["Multiplier"])
             # Check if a threshold is set and withold chips if amount is exceeded
             if self.threshold_check(settings, total):
                 settings["Players"][user.id]["Pending"] = total
@@ -2424,14 +2390,14 @@ class Casino(CasinoBank):
                 msg += (_("**\*\*\*\*\*\*Winner!\*\*\*\*\*\***\n```Python\nYou just "
                           "won {} {} chips.```").format(total, chip_name))
                 super().deposit_chips(user, total)
-        elif pc > 21:
+        elif result == "Bust":
             msg += _("======BUST!======")
-        elif dc == pc <= 21:
+        elif result == "Push":
             msg += (_("======Pushed======\nReturned {} {} chips to your "
                       "account.").format(amount, chip_name))
             amount = int(round(amount))
             super().deposit_chips(user, amount)
-        elif pc < dc <= 21:
+        else:
             msg += _("======House Wins!======").format(user.name)
         # Save results and return appropriate outcome message.
         super().save_system()
@@ -2522,7 +2488,6 @@ class Casino(CasinoBank):
         return cooldowns
 
     def check_cooldowns(self, user, method, settings, triggered=False, brief=False):
-        user_time = settings["Players"][user.id]["Cooldowns"][method]
         user_membership = settings["Players"][user.id]["Membership"]
 
         try:
@@ -2540,15 +2505,11 @@ class Casino(CasinoBank):
             reduction = 0
             base = settings["System Config"]["Transfer Cooldown"]
 
-        # Begin cooldown logic calculation
-        if user_time == 0:  # For new accounts
-            if triggered:
-                settings["Players"][user.id]["Cooldowns"][method] = datetime.utcnow().isoformat()
-                super().save_system()
-            return None
-        elif int((datetime.utcnow() - parser.parse(user_time)).total_seconds()) + reduction < base:
-            diff = int((datetime.utcnow() - parser.parse(user_time)).total_seconds())
-            seconds = base - diff - reduction
+        # Cooldowns live in the shared cooldown service, not in casino.json
+        self.import_cooldown(settings, user, method, base)
+        seconds = int(cooldowns.remaining("Casino", user.server.id, user.id, method,
+                                          base - reduction))
+        if seconds > 0:
             if brief:
                 remaining = self.time_format(seconds, True)
                 msg = remaining
@@ -2558,10 +2519,19 @@ class Casino(CasinoBank):
             return msg
         else:
             if triggered:
-                settings["Players"][user.id]["Cooldowns"][method] = datetime.utcnow().isoformat()
-                super().save_system()
+                cooldowns.trigger("Casino", user.server.id, user.id, method, base)
             return None
 
+    @staticmethod
+    def import_cooldown(settings, user, method, base):
+        """Moves a cooldown stored by an older version into the cooldown service"""
+        user_time = settings["Players"][user.id]["Cooldowns"].get(method, 0)
+        if user_time:
+            start = (parser.parse(user_time) - datetime(1970, 1, 1)).total_seconds()
+            if not cooldowns.last_used("Casino", user.server.id, user.id, method):
+                cooldowns.trigger("Casino", user.server.id, user.id, method, base, now=start)
+            settings["Players"][user.id]["Cooldowns"][method] = 0
+
     def access_calculator(self, settings, user):
         user_membership = settings["Players"][user.id]["Membership"]
 
@@ -2619,6 +2589,7 @@ class Casino(CasinoBank):
     def __unload(self):
         self.cycle_task.cancel()
         super().save_system()
+        cooldowns.save()
 
 
 def check_folders():
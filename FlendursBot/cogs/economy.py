@@ -1,15 +1,18 @@
 import discord
 from discord.ext import commands
 from cogs.utils.dataIO import dataIO
-from collections import namedtuple, defaultdict, deque
+from collections import namedtuple, defaultdict
 from datetime import datetime
 from copy import deepcopy
 from .utils import checks
 from cogs.utils.chat_formatting import pagify, box
+from cogs.utils import simulator
+from cogs.utils.cooldowns import cooldowns
+from cogs.utils.games import slot_rows, slot_payout_key
 from enum import Enum
 from __main__ import send_cmd_help
+import functools
 import os
-import time
 import logging
 import random
 
@@ -295,8 +298,6 @@ class Economy:
             default_settings = self.settings
             self.settings = {}
         self.settings = defaultdict(default_settings.copy, self.settings)
-        self.payday_register = defaultdict(dict)
-        self.slot_register = defaultdict(dict)
 
     @commands.group(name="bank", pass_context=True)
     async def _bank(self, ctx):
@@ -418,33 +419,20 @@ class Economy:
         server = author.server
         id = author.id
         if self.bank.account_exists(author):
-            if id in self.payday_register[server.id]:
-                seconds = abs(self.payday_register[server.id][
-                              id] - int(time.perf_counter()))
-                if seconds >= self.settings[server.id]["PAYDAY_TIME"]:
-                    self.bank.deposit_credits(author, self.settings[
-                                              server.id]["PAYDAY_CREDITS"])
-                    self.payday_register[server.id][
-                        id] = int(time.perf_counter())
-                    await self.bot.say(
-                        "{} Here, take some credits. Enjoy! (+{}"
-                        " credits!)".format(
-                            author.mention,
-                            str(self.settings[server.id]["PAYDAY_CREDITS"])))
-                else:
-                    dtime = self.display_time(
-                        self.settings[server.id]["PAYDAY_TIME"] - seconds)
-                    await self.bot.say(
-                        "{} Too soon. For your next payday you have to"
-                        " wait {}.".format(author.mention, dtime))
-            else:
-                self.payday_register[server.id][id] = int(time.perf_counter())
+            remaining = cooldowns.check("Economy", server.id, id, "Payday",
+                                        self.settings[server.id]["PAYDAY_TIME"])
+            if not remaining:
                 self.bank.deposit_credits(author, self.settings[
                                           server.id]["PAYDAY_CREDITS"])
                 await self.bot.say(
                     "{} Here, take some credits. Enjoy! (+{} credits!)".format(
                         author.mention,
                         str(self.settings[server.id]["PAYDAY_CREDITS"])))
+            else:
+                dtime = self.display_time(int(remaining) or 1)
+                await self.bot.say(
+                    "{} Too soon. For your next payday you have to"
+                    " wait {}.".format(author.mention, dtime))
         else:
             await self.bot.say("{} You need an account to receive credits."
                                " Type `{}bank register` to open one.".format(
@@ -539,12 +527,9 @@ class Economy:
         settings = self.settings[server.id]
         valid_bid = settings["SLOT_MIN"] <= bid and bid <= settings["SLOT_MAX"]
         slot_time = settings["SLOT_TIME"]
-        last_slot = self.slot_register.get(author.id)
-        now = datetime.utcnow()
         try:
-            if last_slot:
-                if (now - last_slot).seconds < slot_time:
-                    raise OnCooldown()
+            if cooldowns.remaining("Economy", server.id, author.id, "Slot", slot_time):
+                raise OnCooldown()
             if not valid_bid:
                 raise InvalidBid()
             if not self.bank.can_spend(author, bid):
@@ -566,16 +551,10 @@ class Economy:
                                          settings["SLOT_MAX"]))
 
     async def slot_machine(self, author, bid):
-        default_reel = deque(SMReel)
-        reels = []
-        self.slot_register[author.id] = datetime.utcnow()
-        for i in range(3):
-            default_reel.rotate(random.randint(-999, 999)) # weeeeee
-            new_reel = deque(default_reel, maxlen=3) # we need only 3 symbols
-            reels.append(new_reel)                   # for each reel
-        rows = ((reels[0][0], reels[1][0], reels[2][0]),
-                (reels[0][1], reels[1][1], reels[2][1]),
-                (reels[0][2], reels[1][2], reels[2][2]))
+        cooldowns.trigger("Economy", author.server.id, author.id, "Slot",
+                          self.settings[author.server.id]["SLOT_TIME"])
+        offsets = [random.randint(-999, 999) for i in range(3)] # weeeeee
+        rows = slot_rows(list(SMReel), offsets)
 
         slot = "~~\n~~" # Mobile friendly
         for i, row in enumerate(rows): # Let's build the slot to show
@@ -584,21 +563,7 @@ class Economy:
                 sign = ">"
             slot += "{}{} {} {}\n".format(sign, *[c.value for c in row])
 
-        payout = PAYOUTS.get(rows[1])
-        if not payout:
-            # Checks for two-consecutive-symbols special rewards
-            payout = PAYOUTS.get((rows[1][0], rows[1][1]),
-                     PAYOUTS.get((rows[1][1], rows[1][2]))
-                                )
-        if not payout:
-            # Still nothing. Let's check for 3 generic same symbols
-            # or 2 consecutive symbols
-            has_three = rows[1][0] == rows[1][1] == rows[1][2]
-            has_two = (rows[1][0] == rows[1][1]) or (rows[1][1] == rows[1][2])
-            if has_three:
-                payout = PAYOUTS["3 symbols"]
-            elif has_two:
-                payout = PAYOUTS["2 symbols"]
+        payout = PAYOUTS.get(slot_payout_key(rows[1], PAYOUTS))
 
         if payout:
             then = self.bank.get_balance(author)
@@ -645,6 +610,20 @@ class Economy:
         await self.bot.say("Maximum bid is now {} credits.".format(bid))
         dataIO.save_json(self.file_path, self.settings)
 
+    @economyset.command(pass_context=True)
+    async def slotodds(self, ctx, bid: int, rounds: int=1000000):
+        """Simulates the slot machine to show its house edge for a bid"""
+        if not simulator.numpyAvailable:
+            await self.bot.say("The simulator requires numpy. Run 'pip3 install numpy'.")
+            return
+        if not 0 < rounds <= 50000000:
+            await self.bot.say("Rounds need to be between 1 and 50,000,000.")
+            return
+        task = functools.partial(simulator.simulate_slots, rounds, bid,
+                                 list(SMReel), PAYOUTS)
+        result = await self.bot.loop.run_in_executor(None, task)
+        await self.bot.say(box(simulator.format_result(result)))
+
     @economyset.command(pass_context=True)
     async def slottime(self, ctx, seconds: int):
         """Seconds between each slots use"""
@@ -703,6 +682,9 @@ class Economy:
                 result.append("{} {}".format(value, name))
         return ', '.join(result[:granularity])
 
+    def __unload(self):
+        cooldowns.save()
+
 
 def check_folders():
     if not os.path.exists("data/economy"):
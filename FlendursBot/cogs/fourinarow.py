@@ -1,5 +1,6 @@
 from .utils.dataIO import fileIO
 from .utils import checks
+from .utils import connectfour
 from __main__ import send_cmd_help
 from __main__ import settings as bot_settings
 # Sys.
@@ -8,6 +9,7 @@ from discord.ext import commands
 from operator import itemgetter, attrgetter
 from copy import deepcopy
 import random
+import functools
 import os
 import sys
 import time
@@ -51,6 +53,9 @@ class FourInARow:
         self.TOKENS = self.settings["TOKENS"]
         self.EMPTY = self.settings["ICONS"][0][0]
         self.PREFIXES = bot_settings.prefixes
+        self.boardMessages = {}# Channel id: board message that gets edited on every move.
+        self.boardCache = {}# Channel id: {"cells": board copy, "rows": emoji row strings}.
+        self.tokenEmojis = None
 
     @commands.group(name="4row", pass_context=True)
     async def _4row(self, ctx):
@@ -128,8 +133,8 @@ class FourInARow:
                 return
             elif self.ingame_check(ctx, user.id):
                 await self.start_game(ctx, user.id)
-                await self.delete_message(ctx)           
                 await self.draw_board(ctx, "\n` Game started\nIf it's your turn use '{}mytoken [number 1/{}]`".format(self.PREFIXES[0], BOARDWIDTH[BOARDSIZE]))
+                await self.bot_turn(ctx)
         else:
             await self.bot.say( "{} ` No game to start.`".format(user.mention))                
 
@@ -177,7 +182,6 @@ class FourInARow:
                         if differenceLastActivity >= gameVoteUnlocks:
                             CH_VOTES_STP["votes"] += 1
                             CH_VOTES_STP["voteIds"].append(user.id)
-                            await self.delete_message(ctx)
                             await self.draw_board(ctx, "\n` Votes to stop this game: {}/{}`".format(CH_VOTES_STP["votes"], minVotesToUnlock))
                             # Save vote.
                             self.game["CHANNELS"][ctx.message.channel.id]["VOTES_STP"] = CH_VOTES_STP
@@ -263,8 +267,7 @@ class FourInARow:
     async def board(self, ctx):
         """Displays the play field."""
         user = ctx.message.author
-        await self.delete_message(ctx)
-        await self.draw_board(ctx, "")
+        await self.draw_board(ctx, "", newMsg=True)
 
     @_4row.command(pass_context=True)
     async def score(self, ctx):
@@ -397,7 +400,6 @@ class FourInARow:
             inQue = CH_GAME["inQue"]
             BOARDWIDTH = self.settings["BOARDWIDTH"]
             BOARDSIZE = CH_GAME["boardSize"]
-            CH_PLAYERS = CH_GAME["PLAYERS"]
             skipIds = CH_GAME["skipIds"]
             data = True
         except Exception as e:
@@ -408,7 +410,6 @@ class FourInARow:
                 if await self.my_turn(ctx, user.id) == True:
                     tokenRow = None
                     freePos = None
-                    stopGame = False
                     tokenRow = int(someToken)
                     tokenRow -= 1 # Index = 0/BOARDWIDTH
                     # Check if token is in range.
@@ -418,37 +419,7 @@ class FourInARow:
                         if freePos == -1:
                             await self.bot.say("\n{} ` Try another row.`".format(user.mention))
                         else:
-                            await self.make_move(ctx, user, tokenRow, freePos)
-                            commentList = ["\n ` Take your time.`", 
-                                                "\n `This game is driven by the Red-DiscordBot`"]
-                            comment = random.choice(commentList)
-                            if len(CH_PLAYERS["IDS"]) >= 1:
-                                for usr in range (len(CH_PLAYERS["IDS"])):
-                                    if self.board_full(ctx):
-                                        comment = ("\n{} ` It's a tie!     `".format(user.mention))
-                                        self.game["CHANNELS"][ctx.message.channel.id]["winner"] = "draw"# Needed for update_score.
-                                        await self.update_score(ctx)# Update score of all players.
-                                        stopGame = True
-                                    elif self.is_winner(ctx, self.TOKENS[CH_PLAYERS["TOKENS"][usr]][0]):
-                                        comment = ("\n{} ` Owns this game with his {}'s`{}".format(user.mention, 
-                                                                                                                                self.TOKENS[CH_PLAYERS["TOKENS"][usr]][0], 
-                                                                                                                                self.TOKENS[CH_PLAYERS["TOKENS"][usr]][1]))
-                                        self.game["CHANNELS"][ctx.message.channel.id]["winner"] = user.id# Needed for update_score.
-                                        await self.update_score(ctx)# Update score of all players.
-                                        stopGame = True
-                                if not stopGame:
-                                    self.next_turn(ctx, user)                                        
-                                fileIO(GAMES, "save", self.game)
-                            await self.delete_message(ctx)
-                            await self.draw_board(ctx, comment)
-                            # If game needs to be stopped by above conditions.
-                            if stopGame == True:
-                                comment = "\n{} `Congratulations, you owned the game with your {}'s`{}".format(user.mention,
-                                                                                                                                                    self.TOKENS[CH_PLAYERS["TOKENS"][usr]][0], 
-                                                                                                                                                    self.TOKENS[CH_PLAYERS["TOKENS"][usr]][1])
-                                await self.draw_board(ctx, comment, True)# Dm board to user.
-                                await self.bot.say("` Game ended`")
-                                await self.stop_game(ctx)
+                            await self.play_move(ctx, user, tokenRow, freePos)
                     else:
                         await self.bot.say("{} ` '{}mytoken [number 1/{}]'`".format(user.mention, self.PREFIXES[0], BOARDWIDTH[BOARDSIZE]))
                 else:
@@ -473,7 +444,6 @@ class FourInARow:
                     logger.info(e)
                     data = False
                 if data and inQue == "yes" and user.id in self.game["CHANNELS"][ctx.message.channel.id]["PLAYERS"]["IDS"]:
-                    await self.delete_message(ctx)
                     await self.draw_board(ctx, msg)
                 else:
                     await self.bot.say("{}".format(msg))
@@ -656,6 +626,7 @@ class FourInARow:
     @checks.admin_or_permissions(manage_server=True)
     async def _botdifficulty(self, ctx, difficulty : str):
         """Changes the default l33tnes of the bot.
+        EASY/NOVICE/HARD search 3/6/12 moves ahead, with 0.5/1/2 seconds to think.
         Admin/owner restricted."""
         user= ctx.message.author
         if difficulty in self.settings["BOT_SETTINGS"]["DIFFICULTY"]:
@@ -970,6 +941,8 @@ class FourInARow:
             logger.info(e)
             logger.info("Error deleting {} from games. It seems that this game is already deleted elsewhere, check code and JSON)".format(ctx.message.channel.id))
             await self.dump_data()
+        self.boardMessages.pop(ctx.message.channel.id, None)
+        self.boardCache.pop(ctx.message.channel.id, None)
         fileIO(GAMES, "save", self.game)
         fileIO(PLAYERS, "save", self.players)
 
@@ -1135,6 +1108,46 @@ class FourInARow:
         self.game["CHANNELS"][ctx.message.channel.id]["PLAYERS"] = CH_PLAYERS
         fileIO(GAMES, "save", self.game)
 
+    # Place a token for user, check for a winner and pass the turn on.
+    async def play_move(self, ctx, user, tokenRow, freePos):
+        CH_PLAYERS = self.game["CHANNELS"][ctx.message.channel.id]["PLAYERS"]
+        stopGame = False
+        await self.make_move(ctx, user, tokenRow, freePos)
+        commentList = ["\n ` Take your time.`", 
+                            "\n `This game is driven by the Red-DiscordBot`"]
+        comment = random.choice(commentList)
+        if len(CH_PLAYERS["IDS"]) >= 1:
+            for usr in range (len(CH_PLAYERS["IDS"])):
+                if self.board_full(ctx):
+                    comment = ("\n{} ` It's a tie!     `".format(user.mention))
+                    self.game["CHANNELS"][ctx.message.channel.id]["winner"] = "draw"# Needed for update_score.
+                    await self.update_score(ctx)# Update score of all players.
+                    stopGame = True
+                    break
+                elif self.is_winner(ctx, self.TOKENS[CH_PLAYERS["TOKENS"][usr]][0]):
+                    comment = ("\n{} ` Owns this game with his {}'s`{}".format(user.mention, 
+                                                                                                            self.TOKENS[CH_PLAYERS["TOKENS"][usr]][0], 
+                                                                                                            self.TOKENS[CH_PLAYERS["TOKENS"][usr]][1]))
+                    self.game["CHANNELS"][ctx.message.channel.id]["winner"] = user.id# Needed for update_score.
+                    await self.update_score(ctx)# Update score of all players.
+                    stopGame = True
+                    break
+            if not stopGame:
+                self.next_turn(ctx, user)                                        
+            fileIO(GAMES, "save", self.game)
+        await self.draw_board(ctx, comment)
+        # If game needs to be stopped by above conditions.
+        if stopGame == True:
+            if user.id != ctx.message.server.me.id:
+                comment = "\n{} `Congratulations, you owned the game with your {}'s`{}".format(user.mention,
+                                                                                                                                self.TOKENS[CH_PLAYERS["TOKENS"][usr]][0], 
+                                                                                                                                self.TOKENS[CH_PLAYERS["TOKENS"][usr]][1])
+                await self.draw_board(ctx, comment, True)# Dm board to user.
+            await self.bot.say("` Game ended`")
+            await self.stop_game(ctx)
+        else:
+            await self.bot_turn(ctx)
+
     # Returns an unused index of an araay.
     def get_unused(self, arrayAvailable, arrayUsed):
         output = []
@@ -1175,28 +1188,8 @@ class FourInARow:
         BOARD_SIZE = self.game["CHANNELS"][ctx.message.channel.id]["boardSize"]
         BOARDHEIGHT = self.settings["BOARDHEIGHT"][BOARD_SIZE]   
         BOARDWIDTH = self.settings["BOARDWIDTH"][BOARD_SIZE]   
-
-        # Check horizontal.
-        for x in range(BOARDHEIGHT - 3):
-            for y in range(BOARDWIDTH):
-                if board[x][y] == tile and board[x+1][y] == tile and board[x+2][y] == tile and board[x+3][y] == tile:
-                    return True
-        # Check vertical.
-        for x in range(BOARDHEIGHT):
-            for y in range(BOARDWIDTH - 3):
-                if board[x][y] == tile and board[x][y+1] == tile and board[x][y+2] == tile and board[x][y+3] == tile:
-                    return True
-        # Check / diagonal.
-        for x in range(BOARDHEIGHT - 3):
-            for y in range(3, BOARDWIDTH):
-                if board[x][y] == tile and board[x+1][y-1] == tile and board[x+2][y-2] == tile and board[x+3][y-3] == tile:
-                    return True
-        # Check \ diagonal.
-        for x in range(BOARDHEIGHT - 3):
-            for y in range(BOARDWIDTH - 3):
-                if board[x][y] == tile and board[x+1][y+1] == tile and board[x+2][y+2] == tile and board[x+3][y+3] == tile:
-                    return True
-        return False
+        position = connectfour.Position.from_rows(board, self.EMPTY, tile, BOARDWIDTH, BOARDHEIGHT)
+        return connectfour.has_won(position.current, BOARDHEIGHT)
 
     # Retuns a list of top scores.
     async def get_rankings(self, ctx, userId=None):
@@ -1304,7 +1297,7 @@ class FourInARow:
         return msg
 
     # Draw the board to chat.
-    async def draw_board(self, ctx, comment, DM=False):
+    async def draw_board(self, ctx, comment, DM=False, newMsg=False):
         user = ctx.message.author
         try: # Get exitsing game data.
             CH_GAME = self.game["CHANNELS"][ctx.message.channel.id]
@@ -1350,25 +1343,7 @@ class FourInARow:
                         slots["MSG"][usr] = userComment                        
                 else:
                     slots["MSG"][usr] = userComment     
-        tokensWidth = []
-        tokensHeight = []
-        tokenDef = None
-        msgBoard = '\n'
-        # Build up a board, note: Display index of tokens != game index of tokens (x=y, y=x).
-        for w in range(self.settings["BOARDWIDTH"][BOARD_SIZE]):
-            msgBoard = msgBoard+emoji.emojize(self.BOARD_HEADER[w])
-        msgBoard = msgBoard+'\n'
-        for x in range(self.settings["BOARDHEIGHT"][BOARD_SIZE]):#6 = default
-            for y in range(self.settings["BOARDWIDTH"][BOARD_SIZE]):#7 = default
-                for z in range(len(self.TOKENS)):
-                    if board[x][y] == self.TOKENS[z][0]:
-                        tokenDef = emoji.emojize(self.TOKENS[z][1], use_aliases=True)# User Token.
-                    elif board[x][y] == self.EMPTY:
-                        tokenDef = emoji.emojize(self.ICONS[0][1], use_aliases=True)# Black.
-                tokensWidth.append(tokenDef)
-                msgBoard = (msgBoard+tokenDef)
-            tokensHeight.append(tokensWidth)    
-            msgBoard = (msgBoard+'\n')
+        msgBoard = self.render_board(ctx.message.channel.id, board, BOARD_SIZE)
         # Set-up user name/slot display.
         playerIs = ''
         if inQue == 'yes': # Draw slots.
@@ -1418,7 +1393,50 @@ class FourInARow:
         if DM:
             await self.bot.send_message(ctx.message.author, "{}\n{}\n**{}**\n{}{}\n\n".format('<@'+mentionPlayer+'>', msgBoard, turnUserMsg, playerIs, comment))
         elif not DM:
-            await self.bot.send_message(ctx.message.channel, "{}\n{}\n**{}**\n{}{}\n\n".format('<@'+mentionPlayer+'>', msgBoard, turnUserMsg, playerIs, comment))
+            await self.post_board(ctx, "{}\n{}\n**{}**\n{}{}\n\n".format('<@'+mentionPlayer+'>', msgBoard, turnUserMsg, playerIs, comment), newMsg)
+
+    # Build the emoji board, only rows that changed since the last draw in this channel are rebuilt.
+    def render_board(self, channelId, board, BOARD_SIZE):
+        BOARDHEIGHT = self.settings["BOARDHEIGHT"][BOARD_SIZE]
+        BOARDWIDTH = self.settings["BOARDWIDTH"][BOARD_SIZE]
+        if self.tokenEmojis is None:
+            self.tokenEmojis = {token[0]: emoji.emojize(token[1], use_aliases=True) for token in self.TOKENS}
+            self.tokenEmojis[self.EMPTY] = emoji.emojize(self.ICONS[0][1], use_aliases=True)# Black.
+        empty = self.tokenEmojis[self.EMPTY]
+        cache = self.boardCache.get(channelId)
+        if cache is None or cache["size"] != BOARD_SIZE:
+            # Note: Display index of tokens != game index of tokens (x=y, y=x).
+            header = ''.join(emoji.emojize(self.BOARD_HEADER[w]) for w in range(BOARDWIDTH))
+            cache = {"size": BOARD_SIZE, "header": header, "cells": [[None] * BOARDWIDTH for x in range(BOARDHEIGHT)], "rows": [""] * BOARDHEIGHT}
+            self.boardCache[channelId] = cache
+        for x in range(BOARDHEIGHT):
+            row = board[x][:BOARDWIDTH]
+            if row != cache["cells"][x]:
+                cache["cells"][x] = list(row)
+                cache["rows"][x] = ''.join(self.tokenEmojis.get(cell, empty) for cell in row)
+        return '\n' + cache["header"] + '\n' + '\n'.join(cache["rows"]) + '\n'
+
+    # Edit the board message of the channel, or post a new one when there is none (or newMsg is set).
+    async def post_board(self, ctx, content, newMsg=False):
+        channel = ctx.message.channel
+        boardMsg = self.boardMessages.get(channel.id)
+        if boardMsg is not None and not newMsg:
+            try:
+                self.boardMessages[channel.id] = await self.bot.edit_message(boardMsg, content)
+                return
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                logger.info(e)
+        if boardMsg is not None:
+            del self.boardMessages[channel.id]
+            try:
+                await self.bot.delete_message(boardMsg)
+            except discord.HTTPException:
+                pass
+        else:
+            await self.delete_message(ctx)
+        self.boardMessages[channel.id] = await self.bot.send_message(channel, content)
 
     # Shift an array.
     def shift(self, seq, n):
@@ -1447,6 +1465,8 @@ class FourInARow:
         author = ctx.message.author
         message = ctx.message
         cmdmsg = message
+        boardMsg = self.boardMessages.get(ctx.message.channel.id)
+        boardMsgId = boardMsg.id if boardMsg is not None else None
         if number > 0 and number < 10000:
             while True:
                 new = False
@@ -1459,7 +1479,7 @@ class FourInARow:
                                 logger,info(e)
                                 logger.info("I need more permissions @ {} to delete messages other than my own.".format(ctx.message.channel))
                         return         
-                    if x.author.id == user.id:
+                    if x.author.id == user.id and x.id != boardMsgId:
                         await self.bot.delete_message(x)
                         number -= 1
                     new = True
@@ -1472,103 +1492,36 @@ class FourInARow:
     # Bot Player Specific Functions
     #----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
        
-    # The bot needs cheats.
-    def bot_move(self, ctx):
+    # Let the bot play when it has the turn.
+    async def bot_turn(self, ctx):
         CH_GAME = self.game["CHANNELS"][ctx.message.channel.id]
-        board = CH_GAME["board"] 
-        BOARD_SIZE = CH_GAME["boardSize"]
-        BOARDHEIGHT = self.settings["BOARDHEIGHT"][BOARD_SIZE]
-        BOARDWIDTH = self.settings["BOARDWIDTH"][BOARD_SIZE]
-        DIFFICULTY = CH_GAME["botDifficulty"]
+        bot = ctx.message.server.me
+        if not self.bot_can_move(CH_GAME, bot):
+            return
+        column = await self.bot_move(ctx)
+        # The game may have been stopped or replaced while the bot was searching.
+        if self.game["CHANNELS"].get(ctx.message.channel.id) is not CH_GAME or not self.bot_can_move(CH_GAME, bot):
+            return
+        if column is not None:
+            await self.play_move(ctx, bot, column, self.lowest_empty_space(ctx, column))
 
-        return
+    def bot_can_move(self, CH_GAME, bot):
+        return CH_GAME["inQue"] == "no" and CH_GAME["turnIds"][0] == bot.id and bot.id not in CH_GAME["skipIds"]
 
-        botTokenAssigned = self.players["PLAYERS"][ctx.message.server.me.id]["tokenAssinged"]
-        botToken = self.TOKENS[botTokenAssigned][0]
-        potentialMoves = self.potential_moves(ctx, botToken, DIFFICULTY)
-        print("potentialMoves")
-        print(potentialMoves)
-        # Get the best fitness from the potential moves.
-        bestMoveFitness = -1
-        for i in range(BOARDWIDTH):
-            print(i)
-            if potentialMoves[i] > bestMoveFitness and self.valididate_move(ctx, i):
-                bestMoveFitness = potentialMoves[i]
-        print("bestmovefitness:")
-        print(bestMoveFitness)
-        # Find all potential moves that have this best fitness.
-        bestMoves = []
-        for i in range(len(potentialMoves)):
-            if potentialMoves[i] >= bestMoveFitness and self.valididate_move(ctx, i):
-                bestMoves.append(i)
-        print("bestmoves/random")
-        print(bestMoves)
-        if bestMoves != []:
-            return random.choice(bestMoves)
-
-    # Cheats (bot and admins only), figure out the best move to make.
-    def potential_moves(self, ctx, tile, lookAhead):
+    # The bot needs cheats, search the board in an executor so the event loop keeps running.
+    async def bot_move(self, ctx):
         CH_GAME = self.game["CHANNELS"][ctx.message.channel.id]
-        board = CH_GAME["board"]
-        BOARD_SIZE = CH_GAME["boardSize"]
-        BOARDHEIGHT = self.settings["BOARDHEIGHT"][BOARD_SIZE]
-        BOARDWIDTH = self.settings["BOARDWIDTH"][BOARD_SIZE]
-        enemyTokens = []
-
-        potentialMoves = [0] * BOARDWIDTH
-
-        if lookAhead == 0 or self.board_full(ctx):
-            return [0] * BOARDWIDTH           
-        for t in range(len(CH_GAME["PLAYERS"]["IDS"])):
-            enemyTokens.append(self.TOKENS[CH_GAME["PLAYERS"]["TOKENS"][t]][0])
-            enemys = t
-        print("ensmys/enemy tokens")
-        print(enemys)
-        print(enemyTokens)
-        # Two player test.
-        # needs some kind of deep copy of ctx to check posibility's, or duplicate game functions to only check on a board.
-
-        for firstMove in range(BOARDWIDTH):      
-            if not self.valididate_move(ctx, firstMove):
-                print("{} - not valid".format(firstMove))
-                continue
-            if self.is_winner(ctx, enemyTokens[0]):                
-                potentialMoves[firstMove] = 1# Winning move gets a perfect fitness.
-                print("{} - lowest_empty_space".format(firstMove))
-                print(self.lowest_empty_space(ctx, firstMove))
-                break# Don't bother calculating other moves.
-            else:# No winning move, check another player.
-                if self.board_full(ctx):
-                    potentialMoves[firstMove] = 0         
-                else:
-                    print("Check enemy")
-                    for counterMove in range(BOARDWIDTH): # Check counterMoves.
-                        ctx2 = ctx#
-                        if not self.valididate_move(ctx2, counterMove):
-                            print("{} - not valid Enemy".format(counterMove))
-                            continue
-                        if self.is_winner(ctx2, enemyTokens[1]):
-                            potentialMoves[counterMove] = 1# Winning enemy move gets a worst fitness.
-                            print("{} - lowest_empty_space Enemy".format(counterMove))
-                            print(self.lowest_empty_space(ctx2, counterMove))
-                            break# Don't bother calculating other moves.
-                        else:
-                            # Make a recursive call to potential_moves()                        
-                            results = self.potential_moves(ctx2, enemyTokens[1], lookAhead - 1)
-                            print(results)
-                            potentialMoves[firstMove] += (sum(results) / BOARDWIDTH) / BOARDWIDTH
-        return potentialMoves
-
-    # Validate move (bot), check if there is an empty space within the given column.
-    def valididate_move(self, ctx, column):
-        CH_GAME = self.game["CHANNELS"][ctx.message.channel.id]
-        board = CH_GAME["board"]
+        CH_PLAYERS = CH_GAME["PLAYERS"]
+        board = CH_GAME["board"] 
         BOARD_SIZE = CH_GAME["boardSize"]
         BOARDHEIGHT = self.settings["BOARDHEIGHT"][BOARD_SIZE]
         BOARDWIDTH = self.settings["BOARDWIDTH"][BOARD_SIZE]
-        if column < 0 or column > (BOARDHEIGHT) or board[column][0] != self.EMPTY:
-            return False
-        return True
+        DIFFICULTY = CH_GAME["botDifficulty"]
+        # All other players count as a single opponent.
+        botToken = self.TOKENS[CH_PLAYERS["TOKENS"][CH_PLAYERS["IDS"].index(ctx.message.server.me.id)]][0]
+        position = connectfour.Position.from_rows(board, self.EMPTY, botToken, BOARDWIDTH, BOARDHEIGHT)
+        depth, timeBudget = connectfour.search_limits(DIFFICULTY)
+        return await self.bot.loop.run_in_executor(None, functools.partial(connectfour.best_move, position, depth, timeBudget))
 
     #----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
     # Development Commands
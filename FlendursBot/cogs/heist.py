@@ -3,6 +3,7 @@
 # Standard Library
 import asyncio
 import bisect
+import functools
 import os
 import random
 import string
@@ -15,11 +16,19 @@ import discord
 from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
+from .utils import games
+from .utils import simulator
+from .utils.cooldowns import cooldowns
 from __main__ import send_cmd_help
 
 # Third party library requirement
 from tabulate import tabulate
 
+# Vaults regain 4% of their maximum every 2 minutes, computed when they are read.
+VAULT_REGEN = 0.04 / 120
+# Target properties that can be changed with heist edittarget
+TARGET_KEYS = ("Crew", "Vault", "Vault Max", "Success")
+
 
 # Thanks stack overflow http://stackoverflow.com/questions/21872366/plural-string-formatting
 class PluralDict(dict):
@@ -41,9 +50,8 @@ class Heist:
         self.bot = bot
         self.file_path = "data/JumperCogs/heist/heist.json"
         self.system = dataIO.load_json(self.file_path)
-        self.version = "2.4.02"
-        self.patch = 2.42
-        self.cycle_task = bot.loop.create_task(self.vault_updater())
+        self.version = "2.4.04"
+        self.patch = 2.44
 
     @commands.group(pass_context=True, no_pm=True)
     async def heist(self, ctx):
@@ -100,7 +108,7 @@ class Heist:
             target_names = [x for x in settings["Targets"]]
             crews = [int(subdict["Crew"]) for subdict in settings["Targets"].values()]
             success = [str(subdict["Success"]) + "%" for subdict in settings["Targets"].values()]
-            vaults = [subdict["Vault"] for subdict in settings["Targets"].values()]
+            vaults = [self.vault_balance(subdict) for subdict in settings["Targets"].values()]
             data = list(zip(target_names, crews, vaults, success))
             table_data = sorted(data, key=itemgetter(1), reverse=True)
             table = tabulate(table_data, headers=["Target", "Max Crew", t_vault, "Success Rate"])
@@ -249,7 +257,9 @@ class Heist:
                                                     success.content)
                    )
             target_fmt = {"Crew": int(crew.content), "Vault": int(vault.content),
-                          "Vault Max": int(vault_max.content), "Success": int(success.content)}
+                          "Vault Max": int(vault_max.content), "Success": int(success.content),
+                          "Vault Updated": time.time(),
+                          "Vault Rate": int(vault_max.content) * VAULT_REGEN}
             settings["Targets"][string.capwords(name.content)] = target_fmt
             self.save_system()
             await self.bot.say(msg)
@@ -265,7 +275,7 @@ class Heist:
         if target not in settings["Targets"]:
             return await self.bot.say("That target does not exist.")
 
-        keys = [x for x in settings["Targets"][target]]
+        keys = [x for x in settings["Targets"][target] if x in TARGET_KEYS]
         keys.append("Name")
         check = lambda m: m.content.title() in keys
 
@@ -309,6 +319,14 @@ class Heist:
             self.save_system()
             await self.bot.say("Changed {}'s {} to {}.".format(target, response.content,
                                                                choice.content))
+        elif response.content.title() in ["Vault", "Vault Max"]:
+            info = settings["Targets"][target]
+            self.set_vault(info, self.vault_balance(info))
+            info[response.content.title()] = int(choice.content)
+            info["Vault Rate"] = info["Vault Max"] * VAULT_REGEN
+            self.save_system()
+            await self.bot.say("Changed {}'s {} to {}.".format(target, response.content,
+                                                               choice.content))
         else:
             settings["Targets"][target][response.content.title()] = int(choice.content)
             self.save_system()
@@ -381,7 +399,6 @@ class Heist:
         server = ctx.message.server
         settings = self.check_server_settings(server)
         self.account_check(settings, author)
-        player_time = settings["Players"][author.id]["Time Served"]
         base_time = settings["Players"][author.id]["Sentence"]
         oob = settings["Players"][author.id]["OOB"]
 
@@ -394,7 +411,7 @@ class Heist:
                                "*in* {0}.".format(t_jail))
             return
 
-        remaining = self.cooldown_calculator(player_time, base_time)
+        remaining = self.cooldown_calculator(server, author, "Sentence", base_time)
         if remaining != "No Cooldown":
             await self.bot.say("You still have time on your {}. You still need to wait:\n"
                                "```{}```".format(t_sentence, remaining))
@@ -419,11 +436,10 @@ class Heist:
         author = ctx.message.author
         settings = self.check_server_settings(author.server)
         self.account_check(settings, author)
-        player_time = settings["Players"][author.id]["Death Timer"]
         base_time = settings["Config"]["Death Timer"]
 
         if settings["Players"][author.id]["Status"] == "Dead":
-            remainder = self.cooldown_calculator(player_time, base_time)
+            remainder = self.cooldown_calculator(author.server, author, "Death", base_time)
             if remainder == "No Cooldown":
                 settings["Players"][author.id]["Death Timer"] = 0
                 settings["Players"][author.id]["Status"] = "Free"
@@ -451,13 +467,11 @@ class Heist:
 
         # Sentence Time Remaining
         sentence = path["Sentence"]
-        time_served = path["Time Served"]
-        jail_fmt = self.cooldown_calculator(time_served, sentence)
+        jail_fmt = self.cooldown_calculator(author.server, author, "Sentence", sentence)
 
         # Death Time Remaining
-        death_timer = path["Death Timer"]
         base_death_timer = settings["Config"]["Death Timer"]
-        death_fmt = self.cooldown_calculator(death_timer, base_death_timer)
+        death_fmt = self.cooldown_calculator(author.server, author, "Death", base_death_timer)
 
         rank = self.criminal_level(path["Criminal Level"])
 
@@ -691,6 +705,29 @@ class Heist:
             msg = "Need a number higher than 0."
         await self.bot.say(msg)
 
+    @setheist.command(name="simulate", pass_context=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def _simulate_setheist(self, ctx, crew: int, rounds: int=100000):
+        """Simulates heists with a crew size to show payouts against the costs"""
+        server = ctx.message.server
+        settings = self.check_server_settings(server)
+
+        if not settings["Targets"]:
+            msg = "There are no targets to simulate."
+        elif not simulator.numpyAvailable:
+            msg = "The simulator requires numpy. Run 'pip3 install numpy'."
+        elif crew <= 0 or not 0 < rounds <= 50000000:
+            msg = "Crew needs to be higher than 0 and rounds between 1 and 50,000,000."
+        else:
+            target = self.heist_target(settings, crew)
+            info = settings["Targets"][target]
+            task = functools.partial(simulator.simulate_heist, rounds, crew, info["Success"],
+                                     info["Crew"], self.vault_balance(info),
+                                     settings["Config"]["Heist Cost"])
+            result = await self.bot.loop.run_in_executor(None, task)
+            msg = "Target: {}\n```\n{}```".format(target, simulator.format_result(result))
+        await self.bot.say(msg)
+
     async def show_results(self, settings, results):
         t_heist = settings["Theme"]["Heist"]
         for result in results:
@@ -699,26 +736,6 @@ class Heist:
         await self.bot.say("The {} is now over. Distributing player spoils...".format(t_heist))
         await asyncio.sleep(5)
 
-    async def vault_updater(self):
-        await self.bot.wait_until_ready()
-        try:
-            await asyncio.sleep(20)  # Start-up Time
-            while True:
-                servers = [x.id for x in self.bot.servers if x.id in self.system["Servers"]]
-                for server in servers:
-                    for target in self.system["Servers"][server]["Targets"]:
-                        vault = self.system["Servers"][server]["Targets"][target]["Vault"]
-                        vault_max = self.system["Servers"][server]["Targets"][target]["Vault Max"]
-                        if vault < vault_max:
-                            increment = min(vault + int(vault_max * 0.04), vault_max)
-                            self.system["Servers"][server]["Targets"][target]["Vault"] = increment
-                        else:
-                            pass
-                self.save_system()
-                await asyncio.sleep(120)  # task runs every 120 seconds
-        except asyncio.CancelledError:
-            pass
-
     async def heist_game(self, settings, server, t_heist, t_crew, t_vault):
         crew = len(settings["Crew"])
         target = self.heist_target(settings, crew)
@@ -739,15 +756,14 @@ class Heist:
                    "C\n{}```".format(t_vault, t))
         else:
             msg = "No one made it out safe."
-        settings["Config"]["Alert Time"] = int(time.perf_counter())
+        cooldowns.trigger("Heist", server.id, None, "Police", settings["Config"]["Police Alert"])
         self.reset_heist(settings)
         self.save_system()
         await self.bot.say(msg)
 
     def __unload(self):
-        self.cycle_task.cancel()
-        self.shutdown_save()
         self.save_system()
+        cooldowns.save()
 
     def theme_loader(self, settings, theme_name):
         keys = ["Jail", "OOB", "Police", "Bail", "Crew", "Sentence", "Heist", "Vault"]
@@ -768,11 +784,11 @@ class Heist:
     def calculate_credits(self, settings, players, target):
         names = [player.name for player in players]
         bonuses = [subdict["Bonus"] for subdict in settings["Crew"].values()]
-        vault = settings["Targets"][target]["Vault"]
-        credits_stolen = int(int(vault) * 0.75 / len(settings["Crew"]))
+        vault = self.vault_balance(settings["Targets"][target])
+        credits_stolen = games.heist_split(vault, len(settings["Crew"]))
         stolen_data = [credits_stolen] * len(settings["Crew"])
         total_winnings = [x + y for x, y in zip(stolen_data, bonuses)]
-        settings["Targets"][target]["Vault"] -= credits_stolen * len(settings["Crew"])
+        self.set_vault(settings["Targets"][target], vault - credits_stolen * len(settings["Crew"]))
         credit_data = list(zip(names, stolen_data, bonuses, total_winnings))
         deposits = list(zip(players, total_winnings))
         self.award_credits(deposits)
@@ -781,28 +797,39 @@ class Heist:
     def save_system(self):
         dataIO.save_json(self.file_path, self.system)
 
+    @staticmethod
+    def vault_balance(target, now=None):
+        """Current vault of a target, regenerated since it was last written"""
+        vault = target["Vault"]
+        vault_max = target["Vault Max"]
+        if vault >= vault_max:
+            return vault
+        if now is None:
+            now = time.time()
+        elapsed = max(now - target["Vault Updated"], 0)
+        return min(int(vault + elapsed * target["Vault Rate"]), vault_max)
+
+    @staticmethod
+    def set_vault(target, amount, now=None):
+        target["Vault"] = amount
+        target["Vault Updated"] = time.time() if now is None else now
+
     def calculate_success(self, settings, target):
         success_rate = settings["Targets"][target]["Success"]
-        bonus = self.calculate_bonus(settings, target)
-        success_chance = int(success_rate) + bonus
-        return success_chance
+        max_crew = settings["Targets"][target]["Crew"]
+        return games.heist_success_chance(success_rate, len(settings["Crew"]), max_crew)
 
     @staticmethod
     def calculate_bonus(settings, target):
         max_crew = settings["Targets"][target]["Crew"]
-        crew = len(settings["Crew"])
-        percent = int(100 * crew / max_crew)
-        breakpoints = [20, 40, 60, 80, 100]
-        bonus_amounts = [0, 1, 2, 3, 4, 5]
-        return bonus_amounts[bisect.bisect_left(breakpoints, percent)]
+        return games.heist_bonus(len(settings["Crew"]), max_crew)
 
     def game_outcomes(self, settings, players, target):
         success_rate = self.calculate_success(settings, target)
         good_out, bad_out = self.get_theme(settings)
         results = []
         for player in players:
-            chance = random.randint(1, 100)
-            if chance <= success_rate:
+            if games.heist_player_succeeds(success_rate):
                 good_thing = random.choice(good_out)
                 good_out.remove(good_thing)
                 settings["Crew"][player.id] = {"Name": player.name, "Bonus": good_thing[1]}
@@ -861,7 +888,7 @@ class Heist:
             settings["Players"][user.id]["Status"] = "Apprehended"
             settings["Players"][user.id]["Bail Cost"] = bail
             settings["Players"][user.id]["Sentence"] = sentence
-            settings["Players"][user.id]["Time Served"] = int(time.perf_counter())
+            cooldowns.trigger("Heist", user.server.id, user.id, "Sentence", sentence)
             settings["Players"][user.id]["OOB"] = False
             settings["Players"][user.id]["Total Jail"] += 1
             settings["Players"][user.id]["Criminal Level"] += 1
@@ -884,7 +911,8 @@ class Heist:
         settings["Players"][user.id]["Status"] = "Dead"
         settings["Players"][user.id]["Deaths"] += 1
         settings["Players"][user.id]["Jail Counter"] = 0
-        settings["Players"][user.id]["Death Timer"] = int(time.perf_counter())
+        cooldowns.trigger("Heist", user.server.id, user.id, "Death",
+                          settings["Config"]["Death Timer"])
         if settings["Config"]["Hardcore"]:
             self.hardcore_handler(user)
 
@@ -897,6 +925,7 @@ class Heist:
         settings["Players"][user.id]["Sentence"] = 0
         settings["Players"][user.id]["Time Served"] = 0
         settings["Players"][user.id]["OOB"] = False
+        cooldowns.clear("Heist", user.server.id, user.id)
         self.save_system()
 
     def reset_heist(self, settings):
@@ -923,7 +952,7 @@ class Heist:
         t_crew = settings["Theme"]["Crew"]
         t_heist = settings["Theme"]["Heist"]
 
-        alert, patrol_time = self.police_alert(settings)
+        alert, patrol_time = self.police_alert(settings, author.server)
         if not list(settings["Targets"]):
             msg = ("Oh no! There are no targets! To start creating a target, use "
                    "{}heist createtarget.".format(prefix))
@@ -938,8 +967,7 @@ class Heist:
         elif settings["Players"][author.id]["Status"] == "Apprehended":
             bail = settings["Players"][author.id]["Bail Cost"]
             sentence_raw = settings["Players"][author.id]["Sentence"]
-            time_served = settings["Players"][author.id]["Time Served"]
-            remaining = self.cooldown_calculator(sentence_raw, time_served)
+            remaining = self.cooldown_calculator(author.server, author, "Sentence", sentence_raw)
             sentence = self.time_format(sentence_raw)
             if remaining == "No Cooldown":
                 msg = ("Looks like your {} is over, but you're still in {}! Get released "
@@ -950,9 +978,8 @@ class Heist:
                        "{5}.".format(t_jail, t_sentence, sentence, remaining, bail, t_bail))
             return "Failed", msg
         elif settings["Players"][author.id]["Status"] == "Dead":
-            death_time = settings["Players"][author.id]["Death Timer"]
             base_timer = settings["Config"]["Death Timer"]
-            remaining = self.cooldown_calculator(death_time, base_timer)
+            remaining = self.cooldown_calculator(author.server, author, "Death", base_timer)
             if remaining == "No Cooldown":
                 msg = ("Looks like you are still dead, but you can revive at anytime by using the "
                        "command {}heist revive .".format(prefix))
@@ -972,47 +999,18 @@ class Heist:
         else:
             return "Success", "Success"
 
-    def police_alert(self, settings):
+    def police_alert(self, settings, server):
         police_time = settings["Config"]["Police Alert"]
-        alert_time = settings["Config"]["Alert Time"]
-        if settings["Config"]["Alert Time"] == 0:
-            return "Clear", None
-        elif abs(alert_time - int(time.perf_counter())) >= police_time:
-            settings["Config"]["Alert Time"] = 0
-            self.save_system()
+        seconds = int(cooldowns.remaining("Heist", server.id, None, "Police", police_time))
+        if seconds <= 0:
             return "Clear", None
         else:
-            s = abs(alert_time - int(time.perf_counter()))
-            seconds = abs(s - police_time)
             remaining = self.time_format(seconds)
             return "Hot", remaining
 
-    def shutdown_save(self):
-        for server in self.system["Servers"]:
-            death_time = self.system["Servers"][server]["Config"]["Death Timer"]
-            for player in self.system["Servers"][server]["Players"]:
-                player_death = self.system["Servers"][server]["Players"][player]["Death Timer"]
-                player_sentence = self.system["Servers"][server]["Players"][player]["Time Served"]
-                sentence = self.system["Servers"][server]["Players"][player]["Sentence"]
-
-                if player_death > 0:
-                    s = abs(player_death - int(time.perf_counter()))
-                    seconds = abs(s - death_time)
-                    self.system["Servers"][server]["Players"][player]["Death Timer"] = seconds
-
-                if player_sentence > 0:
-                    s = abs(player_sentence - int(time.perf_counter()))
-                    seconds = abs(s - sentence)
-                    self.system["Servers"][server]["Players"][player]["Time Served"] = seconds
-
-    def cooldown_calculator(self, player_time, base_time):
-        if abs(player_time - int(time.perf_counter())) >= base_time:
-            return "No Cooldown"
-        else:
-            s = abs(player_time - int(time.perf_counter()))
-            seconds = abs(s - base_time)
-            time_remaining = self.time_format(seconds)
-            return time_remaining
+    def cooldown_calculator(self, server, user, action, base_time):
+        seconds = int(cooldowns.remaining("Heist", server.id, user.id, action, base_time))
+        return self.time_format(seconds)
 
     @staticmethod
     def time_format(seconds):
@@ -1088,18 +1086,45 @@ class Heist:
 
         self.save_system()
 
-    def heist_patcher(self, path):
+    def patch_243(self, path):
+        # Vaults are now regenerated lazily from the time they were last written.
+        for target in path["Targets"].values():
+            target["Vault Updated"] = time.time()
+            target["Vault Rate"] = target["Vault Max"] * VAULT_REGEN
+
+        self.save_system()
+
+    def patch_244(self, path, server):
+        # Jail, death and police timers moved to the cooldown service. The old
+        # timestamps did not survive restarts, so running timers start over.
+        for player_id, player in path["Players"].items():
+            if player["Status"] == "Apprehended" and player["Sentence"]:
+                cooldowns.trigger("Heist", server.id, player_id, "Sentence", player["Sentence"])
+            elif player["Status"] == "Dead":
+                cooldowns.trigger("Heist", server.id, player_id, "Death",
+                                  path["Config"]["Death Timer"])
+        path["Config"]["Alert Time"] = 0
+
+        self.save_system()
+
+    def heist_patcher(self, path, server):
 
         if path["Config"]["Version"] < 2.221:
             self.patch_2220(path)
 
+        if path["Config"]["Version"] < 2.43:
+            self.patch_243(path)
+
+        if path["Config"]["Version"] < 2.44:
+            self.patch_244(path, server)
+
     def check_server_settings(self, server):
         if server.id not in self.system["Servers"]:
             default = {"Config": {"Heist Start": False, "Heist Planned": False, "Heist Cost": 100,
                                   "Wait Time": 20, "Hardcore": False, "Police Alert": 60,
                                   "Alert Time": 0, "Sentence Base": 600, "Bail Base": 500,
                                   "Death Timer": 86400, "Theme": "Heist", "Crew Output": "None",
-                                  "Version": 2.42},
+                                  "Version": 2.44},
                        "Theme": {"Jail": "jail", "OOB": "out on bail", "Police": "Police",
                                  "Bail": "bail", "Crew": "crew", "Sentence": "sentence",
                                  "Heist": "heist", "Vault": "vault"},
@@ -1117,11 +1142,11 @@ class Heist:
 
             try:
                 if path["Config"]["Version"] < self.patch:
-                    self.heist_patcher(path)
+                    self.heist_patcher(path, server)
                     path["Config"]["Version"] = self.patch
             except KeyError:
                 path["Config"]["Version"] = 0
-                self.heist_patcher(path)
+                self.heist_patcher(path, server)
                 path["Config"]["Version"] = self.patch
 
             return path
@@ -1148,6 +1173,7 @@ class Heist:
         if settings["Players"][user.id]["Status"] == "Dead":
             settings["Players"][user.id]["Death Timer"] = 0
             settings["Players"][user.id]["Status"] = "Free"
+            cooldowns.clear("Heist", server.id, user.id, "Death")
             self.save_system()
             msg = ("{} casted :trident: `resurrection` :trident: on {} and returned them "
                    "to the living.".format(author.name, user.name))
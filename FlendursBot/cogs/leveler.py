@@ -7,6 +7,7 @@ import platform, asyncio, string, operator, random, textwrap
 import os, re, aiohttp
 import math
 from .utils.dataIO import fileIO
+from .utils.cooldowns import cooldowns
 from cogs.utils import checks
 try:
     import pymongo
@@ -71,6 +72,7 @@ class Leveler:
 
     def __unload(self):
         self.session.close()
+        cooldowns.save()
 
     def pop_database(self):
         if os.path.exists("data/leveler/users"):
@@ -346,7 +348,6 @@ class Leveler:
         if user:
             await self._create_user(user, server)
         org_userinfo = db.users.find_one({'user_id':org_user.id})
-        curr_time = time.time()
 
         if server.id in self.settings["disabled_servers"]:
             await self.bot.say("**Leveler commands for this server are disabled!**")
@@ -357,23 +358,21 @@ class Leveler:
         if user and user.bot:
             await self.bot.say("**You can't give a rep to a bot!**")
             return
-        if "rep_block" not in org_userinfo:
-            org_userinfo["rep_block"] = 0
+        # rep_block from older versions is moved to the cooldown service once
+        if org_userinfo.get("rep_block") and cooldowns.last_used("Leveler", None, org_user.id, "rep") is None:
+            cooldowns.trigger("Leveler", None, org_user.id, "rep", 43200, now=float(org_userinfo["rep_block"]))
 
-        delta = float(curr_time) - float(org_userinfo["rep_block"])
-        if user and delta >= 43200.0 and delta>0:
+        seconds = cooldowns.remaining("Leveler", None, org_user.id, "rep", 43200)
+        if user and not seconds:
             userinfo = db.users.find_one({'user_id':user.id})
-            db.users.update_one({'user_id':org_user.id}, {'$set':{
-                    "rep_block": curr_time,
-                }})
+            cooldowns.trigger("Leveler", None, org_user.id, "rep", 43200)
             db.users.update_one({'user_id':user.id}, {'$set':{
                     "rep":  userinfo["rep"] + 1,
                 }})
             await self.bot.say("**You have just given {} a reputation point!**".format(self._is_mention(user)))
         else:
             # calulate time left
-            seconds = 43200 - delta
-            if seconds < 0:
+            if not seconds:
                 await self.bot.say("**You can give a rep!**")
                 return
 
@@ -3207,9 +3206,11 @@ class Leveler:
             channel = message.channel
             server = message.server
             user = message.author
+            # users still on the chat cooldown are skipped before touching the database
+            if cooldowns.remaining("Leveler", None, user.id, "chat", 120):
+                return
             # creates user if doesn't exist, bots are not logged.
             await self._create_user(user, server)
-            curr_time = time.time()
             userinfo = db.users.find_one({'user_id':user.id})
 
             if not server or server.id in self.settings["disabled_servers"]:
@@ -3217,11 +3218,7 @@ class Leveler:
             if user.bot:
                 return
 
-            # check if chat_block exists
-            if "chat_block" not in userinfo:
-                userinfo["chat_block"] = 0
-
-            if float(curr_time) - float(userinfo["chat_block"]) >= 120 and not any(text.startswith(x) for x in prefix):
+            if not any(text.startswith(x) for x in prefix):
                 channeldb = db.channels.find_one({'server_id': server.id})
                 if channeldb:
                     chan = channeldb['channels']
@@ -3229,6 +3226,7 @@ class Leveler:
                         return
                     else:
                         pass
+                cooldowns.trigger("Leveler", None, user.id, "chat", 120)
                 await self._process_exp(message, userinfo, random.randint(15, 20))
                 await self._give_chat_credit(user, server)
 
@@ -3244,15 +3242,13 @@ class Leveler:
             db.users.update_one({'user_id': user.id}, {'$set': {
                 "servers.{}.level".format(server.id): userinfo["servers"][server.id]["level"],
                 "servers.{}.current_exp".format(server.id): userinfo["servers"][server.id]["current_exp"] + exp - required,
-                "chat_block": time.time(),
                 "total_exp": userinfo["total_exp"] + exp  # add to total exp
                 }})
             await self._handle_levelup(user, userinfo, server, channel)
         else:
             db.users.update_one({'user_id': user.id}, {'$set': {
                 "servers.{}.current_exp".format(server.id): userinfo["servers"][server.id]["current_exp"] + exp,
-                "total_exp": userinfo["total_exp"] + exp,  # add to total exp
-                "chat_block": time.time()
+                "total_exp": userinfo["total_exp"] + exp  # add to total exp
                 }})
 
     async def _handle_levelup(self, user, userinfo, server, channel):
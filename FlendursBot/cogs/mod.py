@@ -2,14 +2,21 @@ import discord
 from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
+from .utils.wordfilter import WordFilter
+from .utils.ratelimit import RateLimiter
+from .utils.casestore import CaseStore
+from .utils.bulk import run_bulk
+from .utils.timers import timers
 from __main__ import send_cmd_help, settings
-from datetime import datetime
-from collections import deque, defaultdict, OrderedDict
+from datetime import datetime, timedelta
+from collections import defaultdict
 from cogs.utils.chat_formatting import escape_mass_mentions, box, pagify
 import os
 import re
 import logging
 import asyncio
+import heapq
+import time
 
 
 ACTIONS_REPR = {
@@ -35,8 +42,13 @@ ACTIONS_CASES = {
 default_settings = {
     "ban_mention_spam"  : False,
     "delete_repeats"    : False,
+    "repeats_threshold" : 3,
+    "repeats_window"    : 300,
     "mod-log"           : None,
-    "respect_hierarchy" : False
+    "respect_hierarchy" : False,
+    "mute_role"         : None,
+    "filter_whole_words": False,
+    "filter_normalize"  : False
 }
 
 
@@ -45,6 +57,30 @@ for act, enabled in ACTIONS_CASES.items():
     default_settings[act] = enabled
 
 
+# Longest time allowed between repeated messages for them to count
+MAX_REPEATS_WINDOW = 3600
+
+# Discord refuses to bulk delete messages older than this. The margin keeps
+# messages from aging past it while a purge is running
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(hours=1)
+
+# Names and nicknames remembered per user, and seconds to wait before
+# writing changes to them to disk
+NAME_HISTORY = 20
+NAMES_SAVE_DELAY = 30
+
+# Units for tempban durations, e.g. 1d12h
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 60 * 60 * 24,
+                  "w": 60 * 60 * 24 * 7}
+
+# Seconds between edits of a progress message
+PROGRESS_INTERVAL = 2
+
+# What the flood limits count. Duplicates are identical messages from anyone
+FLOOD_KINDS = ("messages", "mentions", "attachments", "duplicates")
+FLOOD_ACTIONS = ("delete", "kick", "ban")
+
+
 class ModError(Exception):
     pass
 
@@ -73,20 +109,136 @@ class TempCache:
     """
     def __init__(self, bot):
         self.bot = bot
-        self._cache = []
+        self._cache = {}  # (user id, server id, action): expiry
+        self._heap = []  # (expiry, key), may hold stale items
+        self._handle = None
 
     def add(self, user, server, action, seconds=1):
         tmp = (user.id, server.id, action)
-        self._cache.append(tmp)
+        expiry = self.bot.loop.time() + seconds
+        if self._cache.get(tmp, 0) >= expiry:
+            return
+        self._cache[tmp] = expiry
+        heapq.heappush(self._heap, (expiry, tmp))
+        if self._heap[0][1] is tmp:
+            self._schedule()
 
-        async def delete_value():
-            await asyncio.sleep(seconds)
-            self._cache.remove(tmp)
+    def check(self, user, server, action):
+        expiry = self._cache.get((user.id, server.id, action))
+        return expiry is not None and expiry > self.bot.loop.time()
+
+    def _schedule(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._heap:
+            self._handle = self.bot.loop.call_at(self._heap[0][0], self._reap)
+
+    def _reap(self):
+        self._handle = None
+        now = self.bot.loop.time()
+        while self._heap and self._heap[0][0] <= now:
+            expiry, tmp = heapq.heappop(self._heap)
+            # Added again for longer since, that has its own heap item
+            if self._cache.get(tmp) == expiry:
+                del self._cache[tmp]
+        self._schedule()
+
+
+class RepeatTracker:
+    """
+    Counts how many times in a row each member sent the same message.
+    Only a hash of the last message is kept per member, in two generations
+    that swap every max_age seconds, so members that stopped talking are
+    forgotten without keeping track of who spoke last
+    """
+    def __init__(self, max_age=MAX_REPEATS_WINDOW):
+        self.max_age = max_age
+        self._current = {}  # (server id, author id): (hash, count, timestamp)
+        self._previous = {}
+        self._rotated = time.time()
+
+    def check(self, server, author, content, threshold, window, now=None):
+        """Records the message and returns True if it's the threshold-th
+        identical one in a row, each sent within window seconds of the last"""
+        if now is None:
+            now = time.time()
+        if now - self._rotated >= self.max_age:
+            self._previous, self._current = self._current, {}
+            self._rotated = now
+        key = (server.id, author.id)
+        digest = hash(content)
+        last = self._current.get(key) or self._previous.get(key)
+        if last is not None and last[0] == digest and now - last[2] <= window:
+            count = last[1] + 1
+        else:
+            count = 1
+        self._current[key] = (digest, count, now)
+        return count >= threshold
 
-        self.bot.loop.create_task(delete_value())
 
-    def check(self, user, server, action):
-        return (user.id, server.id, action) in self._cache
+class Purger:
+    """
+    Deletes messages as they're handed to it. Recent ones are bulk deleted
+    100 at a time, each batch in the background while the caller keeps
+    fetching; older ones, or all of them without bulk, are deleted one by one
+    by a second task. discord.py waits out the rate limits from the response
+    headers, so there are no fixed sleeps.
+    """
+    def __init__(self, bot, bulk=True):
+        self.bot = bot
+        self.bulk = bulk
+        self.count = 0
+        self._cutoff = datetime.utcnow() - BULK_DELETE_MAX_AGE
+        self._batch = []
+        self._bulk_task = None
+        self._singles = asyncio.Queue(loop=bot.loop)
+        self._singles_task = bot.loop.create_task(self._delete_singles())
+
+    async def add(self, message):
+        self.count += 1
+        if not self.bulk or message.timestamp < self._cutoff:
+            self._singles.put_nowait(message)
+            return
+        self._batch.append(message)
+        if len(self._batch) == 100:
+            await self._flush()
+
+    async def finish(self):
+        """Waits until everything is deleted, returns the number of messages"""
+        await self._flush()
+        if self._bulk_task is not None:
+            await self._bulk_task
+        self._singles.put_nowait(None)
+        await self._singles_task
+        return self.count
+
+    async def _flush(self):
+        batch, self._batch = self._batch, []
+        if self._bulk_task is not None:
+            await self._bulk_task
+            self._bulk_task = None
+        if len(batch) == 1:
+            self._singles.put_nowait(batch[0])
+        elif batch:
+            self._bulk_task = self.bot.loop.create_task(self._delete_bulk(batch))
+
+    async def _delete_bulk(self, batch):
+        try:
+            await self.bot.delete_messages(batch)
+        except discord.HTTPException:
+            for message in batch:
+                self._singles.put_nowait(message)
+
+    async def _delete_singles(self):
+        while True:
+            message = await self._singles.get()
+            if message is None:
+                return
+            try:
+                await self.bot.delete_message(message)
+            except:
+                pass
 
 
 class Mod:
@@ -96,12 +248,19 @@ class Mod:
         self.bot = bot
         self.ignore_list = dataIO.load_json("data/mod/ignorelist.json")
         self.filter = dataIO.load_json("data/mod/filter.json")
+        self._filters = {}  # server id: compiled WordFilter
         self.past_names = dataIO.load_json("data/mod/past_names.json")
         self.past_nicknames = dataIO.load_json("data/mod/past_nicknames.json")
+        self._names_changed = set()  # files with unsaved name changes
+        self._names_handle = None
+        timers.register("Mod", self.tempban_expired, loop=bot.loop)
         settings = dataIO.load_json("data/mod/settings.json")
         self.settings = defaultdict(lambda: default_settings.copy(), settings)
-        self.cache = OrderedDict()
-        self.cases = dataIO.load_json("data/mod/modlog.json")
+        self.repeats = RepeatTracker()
+        self.floods = {kind: RateLimiter() for kind in FLOOD_KINDS}
+        self.flood_punished = set()  # (server id, user id) being kicked/banned
+        self.case_store = CaseStore("data/mod/cases",
+                                     legacy_path="data/mod/modlog.json")
         self.last_case = defaultdict(dict)
         self.temp_cache = TempCache(bot)
         perms_cache = dataIO.load_json("data/mod/perms_cache.json")
@@ -184,24 +343,108 @@ class Mod:
         dataIO.save_json("data/mod/settings.json", self.settings)
 
     @modset.command(pass_context=True, no_pm=True)
-    async def deleterepeats(self, ctx):
-        """Enables auto deletion of repeated messages"""
+    async def deleterepeats(self, ctx, repeats: int=None, seconds: int=None):
+        """Enables auto deletion of repeated messages
+
+        A message is deleted when it's the same as the author's previous
+        ones, each sent less than [seconds] apart, [repeats] times in a row.
+        Defaults to 3 times and 300 seconds. Without arguments it toggles."""
         server = ctx.message.server
-        if not self.settings[server.id]["delete_repeats"]:
-            self.settings[server.id]["delete_repeats"] = True
-            await self.bot.say("Messages repeated up to 3 times will "
-                               "be deleted.")
+        settings = self.settings[server.id]
+        if repeats is not None or not settings["delete_repeats"]:
+            if repeats is not None:
+                settings["repeats_threshold"] = max(repeats, 2)
+            if seconds is not None:
+                settings["repeats_window"] = min(max(seconds, 1),
+                                                 MAX_REPEATS_WINDOW)
+            settings["delete_repeats"] = True
+            await self.bot.say("Messages repeated {} times, less than {} "
+                               "seconds apart, will be deleted.".format(
+                                   settings.get("repeats_threshold", 3),
+                                   settings.get("repeats_window", 300)))
         else:
             self.settings[server.id]["delete_repeats"] = False
             await self.bot.say("Repeated messages will be ignored.")
         dataIO.save_json("data/mod/settings.json", self.settings)
 
+    @modset.command(pass_context=True, no_pm=True)
+    async def flood(self, ctx, kind: str, limit: int=0, seconds: int=10,
+                    action: str="delete"):
+        """Acts on members going over a rate limit
+
+        kind: messages, mentions, attachments or duplicates (the same
+        message sent by anyone). action: delete, kick or ban.
+        Example: flood mentions 15 10 ban
+        A limit of 0 disables it."""
+        server = ctx.message.server
+        kind = kind.lower()
+        action = action.lower()
+        if kind not in FLOOD_KINDS or action not in FLOOD_ACTIONS:
+            await send_cmd_help(ctx)
+            return
+        floods = self.settings[server.id].setdefault("floods", {})
+        if limit <= 0:
+            floods.pop(kind, None)
+            await self.bot.say("The {} limit is disabled.".format(kind))
+        else:
+            seconds = max(seconds, 1)
+            floods[kind] = {"limit": limit, "seconds": seconds,
+                            "action": action}
+            await self.bot.say("Going over {} {} in {} seconds will {} "
+                               "the member's messages.".format(
+                                   limit, kind, seconds,
+                                   "delete" if action == "delete" else
+                                   action + " the author of"))
+        dataIO.save_json("data/mod/settings.json", self.settings)
+
+    @modset.command(pass_context=True, no_pm=True)
+    async def muterole(self, ctx, *, role_name: str=None):
+        """Makes server mutes give a role instead of editing every channel
+
+        The role is created if it doesn't exist, and is denied sending
+        messages in every text channel. Run it again after adding channels.
+        Without a role name, server mutes go back to channel overwrites."""
+        server = ctx.message.server
+        if role_name is None:
+            self.settings[server.id]["mute_role"] = None
+            dataIO.save_json("data/mod/settings.json", self.settings)
+            await self.bot.say("Server mutes will edit each channel's "
+                               "permissions.")
+            return
+        role = discord.utils.get(server.roles, name=role_name)
+        try:
+            if role is None:
+                role = await self.bot.create_role(
+                    server, name=role_name, permissions=discord.Permissions.none())
+        except discord.Forbidden:
+            await self.bot.say("I need the manage roles permission to do that.")
+            return
+        changes = []
+        for channel in server.channels:
+            if channel.type != discord.ChannelType.text:
+                continue
+            overwrites = channel.overwrites_for(role)
+            if overwrites.send_messages is False:
+                continue
+            overwrites.send_messages = False
+            overwrites.add_reactions = False
+            changes.append((channel, overwrites))
+        result, status = await self.apply_overwrites(role, changes, "Setting up")
+        if result.failed:
+            await self.report(status, "I couldn't set up the role in every "
+                                      "channel. I need the manage roles "
+                                      "permission in all of them.")
+            return
+        self.settings[server.id]["mute_role"] = role.id
+        dataIO.save_json("data/mod/settings.json", self.settings)
+        await self.report(status, "Server mutes will give the {} role."
+                                  "".format(role.name))
+
     @modset.command(pass_context=True, no_pm=True)
     async def resetcases(self, ctx):
         """Resets modlog's cases"""
         server = ctx.message.server
-        self.cases[server.id] = {}
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        self.case_store.reset(server.id)
         await self.bot.say("Cases have been reset.")
 
     @modset.command(pass_context=True, no_pm=True)
@@ -382,6 +625,73 @@ class Mod:
         except Exception as e:
             print(e)
 
+    @commands.command(no_pm=True, pass_context=True)
+    @checks.admin_or_permissions(ban_members=True)
+    async def tempban(self, ctx, user: discord.Member, duration: str, *, reason: str = None):
+        """Bans user and unbans them after a while.
+
+        Duration is a combination of numbers and units: s, m, h, d, w
+        Example: tempban @user 1d12h Spamming"""
+        author = ctx.message.author
+        server = author.server
+        seconds = parse_duration(duration)
+
+        if not seconds:
+            await send_cmd_help(ctx)
+            return
+        elif author == user:
+            await self.bot.say("I cannot let you do that. Self-harm is "
+                               "bad \N{PENSIVE FACE}")
+            return
+        elif not self.is_allowed_by_hierarchy(server, author, user):
+            await self.bot.say("I cannot let you do that. You are "
+                               "not higher than the user in the role "
+                               "hierarchy.")
+            return
+
+        try:
+            self.temp_cache.add(user, server, "BAN")
+            await self.bot.ban(user, 0)
+        except discord.errors.Forbidden:
+            await self.bot.say("I'm not allowed to do that.")
+            return
+        logger.info("{}({}) banned {}({}) for {}".format(
+            author.name, author.id, user.name, user.id, strfdelta(timedelta(seconds=seconds))))
+        timers.schedule("Mod", "tempban:{}:{}".format(server.id, user.id),
+                        time.time() + seconds,
+                        {"server": server.id, "user": user.id})
+        await self.new_case(server,
+                            action="BAN",
+                            mod=author,
+                            user=user,
+                            reason=reason,
+                            until=datetime.utcnow() + timedelta(seconds=seconds))
+        await self.bot.say("Done. See you in {}.".format(
+            strfdelta(timedelta(seconds=seconds))))
+
+    async def tempban_expired(self, key, data):
+        """Timer callback, also runs at startup for overdue tempbans"""
+        await self.bot.wait_until_ready()
+        server = self.bot.get_server(data["server"])
+        if server is None:
+            return
+        try:
+            user = await self.bot.get_user_info(data["user"])
+        except discord.HTTPException:
+            user = discord.Object(id=data["user"])
+        try:
+            self.temp_cache.add(user, server, "UNBAN")
+            await self.bot.unban(server, user)
+        except discord.HTTPException:
+            logger.info("Failed to lift the tempban of {} in server {}"
+                        "".format(data["user"], server.id))
+            return
+        await self.new_case(server,
+                            action="UNBAN",
+                            mod=server.me,
+                            user=user,
+                            reason="Tempban expired")
+
     @commands.command(no_pm=True, pass_context=True)
     @checks.admin_or_permissions(ban_members=True)
     async def hackban(self, ctx, user_id: int, *, reason: str = None):
@@ -553,36 +863,50 @@ class Mod:
                                "hierarchy.")
             return
 
-        register = {}
-        for channel in server.channels:
-            if channel.type != discord.ChannelType.text:
-                continue
-            overwrites = channel.overwrites_for(user)
-            if overwrites.send_messages is False:
-                continue
-            register[channel.id] = overwrites.send_messages
-            overwrites.send_messages = False
+        status = None
+        role = self.get_mute_role(server)
+        if role is not None:
+            if role in user.roles:
+                await self.bot.say("That user is already muted.")
+                return
             try:
-                await self.bot.edit_channel_permissions(channel, user,
-                                                        overwrites)
+                await self.bot.add_roles(user, role)
             except discord.Forbidden:
                 await self.bot.say("Failed to mute user. I need the manage roles "
-                                   "permission and the user I'm muting must be "
+                                   "permission and the mute role must be "
                                    "lower than myself in the role hierarchy.")
                 return
-            else:
-                await asyncio.sleep(0.1)
-        if not register:
-            await self.bot.say("That user is already muted in all channels.")
-            return
-        self._perms_cache[user.id] = register
-        dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+        else:
+            register = {}
+            changes = []
+            for channel in server.channels:
+                if channel.type != discord.ChannelType.text:
+                    continue
+                overwrites = channel.overwrites_for(user)
+                if overwrites.send_messages is False:
+                    continue
+                register[channel.id] = overwrites.send_messages
+                overwrites.send_messages = False
+                changes.append((channel, overwrites))
+            if not register:
+                await self.bot.say("That user is already muted in all channels.")
+                return
+            result, status = await self.apply_overwrites(user, changes, "Muting")
+            # Remembers the channels that did get muted, even on failure
+            for channel, _ in result.done:
+                self._perms_cache[user.id][channel.id] = register[channel.id]
+            dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
+            if result.failed:
+                await self.report(status, "Failed to mute user. I need the manage roles "
+                                          "permission and the user I'm muting must be "
+                                          "lower than myself in the role hierarchy.")
+                return
         await self.new_case(server,
                             action="SMUTE",
                             mod=author,
                             user=user,
                             reason=reason)
-        await self.bot.say("User has been muted in this server.")
+        await self.report(status, "User has been muted in this server.")
 
     @commands.group(pass_context=True, no_pm=True, invoke_without_command=True)
     @checks.mod_or_permissions(administrator=True)
@@ -645,6 +969,23 @@ class Mod:
         server = ctx.message.server
         author = ctx.message.author
 
+        role = self.get_mute_role(server)
+        if role is not None and role in user.roles:
+            if not self.is_allowed_by_hierarchy(server, author, user):
+                await self.bot.say("I cannot let you do that. You are "
+                                   "not higher than the user in the role "
+                                   "hierarchy.")
+                return
+            try:
+                await self.bot.remove_roles(user, role)
+            except discord.Forbidden:
+                await self.bot.say("Failed to unmute user. I need the manage roles "
+                                   "permission and the mute role must be "
+                                   "lower than myself in the role hierarchy.")
+            else:
+                await self.bot.say("User has been unmuted in this server.")
+            return
+
         if user.id not in self._perms_cache:
             await self.bot.say("That user doesn't seem to have been muted with {0}mute commands. "
                                "Unmute them in the channels you want with `{0}unmute <user>`"
@@ -656,6 +997,7 @@ class Mod:
                                "hierarchy.")
             return
 
+        changes = []
         for channel in server.channels:
             if channel.type != discord.ChannelType.text:
                 continue
@@ -665,25 +1007,21 @@ class Mod:
             overwrites = channel.overwrites_for(user)
             if overwrites.send_messages is False:
                 overwrites.send_messages = value
-                is_empty = self.are_overwrites_empty(overwrites)
-                try:
-                    if not is_empty:
-                        await self.bot.edit_channel_permissions(channel, user,
-                                                                overwrites)
-                    else:
-                        await self.bot.delete_channel_permissions(channel, user)
-                except discord.Forbidden:
-                    await self.bot.say("Failed to unmute user. I need the manage roles"
-                                       " permission and the user I'm unmuting must be "
-                                       "lower than myself in the role hierarchy.")
-                    return
-                else:
-                    del self._perms_cache[user.id][channel.id]
-                    await asyncio.sleep(0.1)
+                if self.are_overwrites_empty(overwrites):
+                    overwrites = None
+                changes.append((channel, overwrites))
+        result, status = await self.apply_overwrites(user, changes, "Unmuting")
+        for channel, _ in result.done:
+            del self._perms_cache[user.id][channel.id]
         if user.id in self._perms_cache and not self._perms_cache[user.id]:
             del self._perms_cache[user.id]  # cleanup
         dataIO.save_json("data/mod/perms_cache.json", self._perms_cache)
-        await self.bot.say("User has been unmuted in this server.")
+        if result.failed:
+            await self.report(status, "Failed to unmute user. I need the manage roles"
+                                      " permission and the user I'm unmuting must be "
+                                      "lower than myself in the role hierarchy.")
+        else:
+            await self.report(status, "User has been unmuted in this server.")
 
     @commands.group(pass_context=True)
     @checks.mod_or_permissions(manage_messages=True)
@@ -708,38 +1046,20 @@ class Mod:
         has_permissions = channel.permissions_for(server.me).manage_messages
 
         def check(m):
-            if text in m.content:
-                return True
-            elif m == ctx.message:
-                return True
-            else:
-                return False
-
-        to_delete = [ctx.message]
+            return text in m.content
 
         if not has_permissions:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        tries_left = 5
-        tmp = ctx.message
-
-        while tries_left and len(to_delete) - 1 < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) - 1 < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        purger = Purger(self.bot, bulk=is_bot)
+        await purger.add(ctx.message)
+        await self.scan_history(channel, ctx.message, check, number, purger)
+        deleted = await purger.finish()
 
         logger.info("{}({}) deleted {} messages "
                     " containing '{}' in channel {}".format(author.name,
-                    author.id, len(to_delete), text, channel.id))
-
-        if is_bot:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
+                    author.id, deleted, text, channel.id))
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def user(self, ctx, user: discord.Member, number: int):
@@ -755,43 +1075,26 @@ class Mod:
         is_bot = self.bot.user.bot
         has_permissions = channel.permissions_for(server.me).manage_messages
         self_delete = user == self.bot.user
+        user_id = user.id
 
         def check(m):
-            if m.author == user:
-                return True
-            elif m == ctx.message:
-                return True
-            else:
-                return False
-
-        to_delete = [ctx.message]
+            return m.author.id == user_id
 
         if not has_permissions and not self_delete:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        tries_left = 5
-        tmp = ctx.message
-
-        while tries_left and len(to_delete) - 1 < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) - 1 < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        # For whatever reason the purge endpoint requires manage_messages
+        purger = Purger(self.bot, bulk=is_bot and not self_delete)
+        await purger.add(ctx.message)
+        await self.scan_history(channel, ctx.message, check, number, purger)
+        deleted = await purger.finish()
 
         logger.info("{}({}) deleted {} messages "
                     " made by {}({}) in channel {}"
-                    "".format(author.name, author.id, len(to_delete),
+                    "".format(author.name, author.id, deleted,
                               user.name, user.id, channel.name))
 
-        if is_bot and not self_delete:
-            # For whatever reason the purge endpoint requires manage_messages
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
-
     @cleanup.command(pass_context=True, no_pm=True)
     async def after(self, ctx, message_id : int):
         """Deletes all messages after specified message
@@ -814,8 +1117,6 @@ class Mod:
                                "bot accounts.")
             return
 
-        to_delete = []
-
         after = await self.bot.get_message(channel, message_id)
 
         if not has_permissions:
@@ -825,15 +1126,15 @@ class Mod:
             await self.bot.say("Message not found.")
             return
 
+        purger = Purger(self.bot)
         async for message in self.bot.logs_from(channel, limit=2000,
                                                 after=after):
-            to_delete.append(message)
+            await purger.add(message)
+        deleted = await purger.finish()
 
         logger.info("{}({}) deleted {} messages in channel {}"
                     "".format(author.name, author.id,
-                              len(to_delete), channel.name))
-
-        await self.mass_purge(to_delete)
+                              deleted, channel.name))
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def messages(self, ctx, number: int):
@@ -848,24 +1149,19 @@ class Mod:
         is_bot = self.bot.user.bot
         has_permissions = channel.permissions_for(server.me).manage_messages
 
-        to_delete = []
-
         if not has_permissions:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
+        purger = Purger(self.bot, bulk=is_bot)
         async for message in self.bot.logs_from(channel, limit=number+1):
-            to_delete.append(message)
+            await purger.add(message)
+        await purger.finish()
 
         logger.info("{}({}) deleted {} messages in channel {}"
                     "".format(author.name, author.id,
                               number, channel.name))
 
-        if is_bot:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
-
     @cleanup.command(pass_context=True, no_pm=True, name='bot')
     async def cleanup_bot(self, ctx, number: int):
         """Cleans up command messages and messages from the bot"""
@@ -886,46 +1182,35 @@ class Mod:
             prefixes = prefixes(self.bot, ctx.message)
 
         # In case some idiot sets a null prefix
-        if '' in prefixes:
-            prefixes.pop('')
+        prefixes = [p for p in prefixes if p]
+
+        # One expression for every prefix followed by every command
+        command_re = None
+        if prefixes:
+            command_re = re.compile("(?:{})(?:{})".format(
+                "|".join(map(re.escape, prefixes)),
+                "|".join(map(re.escape, self.bot.commands))))
+        bot_id = self.bot.user.id
 
         def check(m):
-            if m.author.id == self.bot.user.id:
-                return True
-            elif m == ctx.message:
+            if m.author.id == bot_id:
                 return True
-            p = discord.utils.find(m.content.startswith, prefixes)
-            if p and len(p) > 0:
-                return m.content[len(p):].startswith(tuple(self.bot.commands))
-            return False
-
-        to_delete = [ctx.message]
+            return command_re is not None and command_re.match(m.content) is not None
 
         if not has_permissions:
             await self.bot.say("I'm not allowed to delete messages.")
             return
 
-        tries_left = 5
-        tmp = ctx.message
-
-        while tries_left and len(to_delete) - 1 < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) - 1 < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        purger = Purger(self.bot, bulk=is_bot)
+        await purger.add(ctx.message)
+        await self.scan_history(channel, ctx.message, check, number, purger)
+        deleted = await purger.finish()
 
         logger.info("{}({}) deleted {} "
                     " command messages in channel {}"
-                    "".format(author.name, author.id, len(to_delete),
+                    "".format(author.name, author.id, deleted,
                               channel.name))
 
-        if is_bot:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
-
     @cleanup.command(pass_context=True, name='self')
     async def cleanup_self(self, ctx, number: int, match_pattern: str = None):
         """Cleans up messages owned by the bot.
@@ -964,29 +1249,22 @@ class Mod:
             def content_match(_):
                 return True
 
+        bot_id = self.bot.user.id
+
         def check(m):
-            if m.author.id != self.bot.user.id:
+            if m.author.id != bot_id:
                 return False
             elif content_match(m.content):
                 return True
             return False
 
-        to_delete = []
+        purger = Purger(self.bot, bulk=is_bot and can_mass_purge)
         # Selfbot convenience, delete trigger message
         if author == self.bot.user:
-            to_delete.append(ctx.message)
-            number += 1
+            await purger.add(ctx.message)
 
-        tries_left = 5
-        tmp = ctx.message
-
-        while tries_left and len(to_delete) < number:
-            async for message in self.bot.logs_from(channel, limit=100,
-                                                    before=tmp):
-                if len(to_delete) < number and check(message):
-                    to_delete.append(message)
-                tmp = message
-            tries_left -= 1
+        await self.scan_history(channel, ctx.message, check, number, purger)
+        deleted = await purger.finish()
 
         if channel.name:
             channel_name = 'channel ' + channel.name
@@ -995,14 +1273,9 @@ class Mod:
 
         logger.info("{}({}) deleted {} messages "
                     "sent by the bot in {}"
-                    "".format(author.name, author.id, len(to_delete),
+                    "".format(author.name, author.id, deleted,
                               channel_name))
 
-        if is_bot and can_mass_purge:
-            await self.mass_purge(to_delete)
-        else:
-            await self.slow_deletion(to_delete)
-
     @commands.command(pass_context=True)
     @checks.mod_or_permissions(manage_messages=True)
     async def reason(self, ctx, case, *, reason : str=""):
@@ -1042,6 +1315,76 @@ class Mod:
         else:
             await self.bot.say("Case #{} updated.".format(case))
 
+    @commands.group(pass_context=True, no_pm=True)
+    @checks.mod_or_permissions(manage_messages=True)
+    async def cases(self, ctx):
+        """Looks up mod-log's cases"""
+        if ctx.invoked_subcommand is None:
+            await send_cmd_help(ctx)
+
+    @cases.command(name="show", pass_context=True)
+    async def cases_show(self, ctx, case: int):
+        """Shows a case"""
+        server = ctx.message.server
+        try:
+            case = self.case_store.get(server.id, case)
+        except KeyError:
+            await self.bot.say("That case doesn't exist.")
+        else:
+            await self.bot.say(self.format_case_msg(case))
+
+    @cases.command(name="recent", pass_context=True)
+    async def cases_recent(self, ctx, number: int=10):
+        """Lists the latest cases"""
+        await self.list_cases(ctx, number)
+
+    @cases.command(name="user", pass_context=True)
+    async def cases_user(self, ctx, user: str, number: int=10):
+        """Lists the latest cases of a user
+
+        Takes a mention or a user id, so it works for banned users too"""
+        await self.list_cases(ctx, number, user_id=self.parse_user_id(user))
+
+    @cases.command(name="mod", pass_context=True)
+    async def cases_mod(self, ctx, moderator: str, number: int=10):
+        """Lists the latest cases opened by a moderator"""
+        await self.list_cases(ctx, number,
+                              moderator_id=self.parse_user_id(moderator))
+
+    @cases.command(name="action", pass_context=True)
+    async def cases_action(self, ctx, action: str, number: int=10):
+        """Lists the latest cases of an action
+
+        Actions: ban, kick, cmute, smute, softban, hackban, unban"""
+        action = action.upper()
+        if action not in ACTIONS_REPR:
+            await send_cmd_help(ctx)
+            return
+        await self.list_cases(ctx, number, action=action)
+
+    def parse_user_id(self, user):
+        match = re.match(r"<@!?([0-9]+)>$", user)
+        return match.group(1) if match else user
+
+    async def list_cases(self, ctx, number, **filters):
+        server = ctx.message.server
+        number = min(max(number, 1), 100)
+        cases = self.case_store.query(server.id, limit=number, **filters)
+        if not cases:
+            await self.bot.say("No cases found.")
+            return
+        lines = []
+        for case in cases:
+            action = ACTIONS_REPR.get(case["action"], (case["action"],))[0]
+            reason = case["reason"] or "No reason"
+            if len(reason) > 50:
+                reason = reason[:47] + "..."
+            lines.append("#{} {} - {} by {}: {}".format(
+                case["case"], action, case["user"],
+                case["moderator"] or "Unknown", reason))
+        for page in pagify("\n".join(lines), delims=["\n"]):
+            await self.bot.say(box(page))
+
     @commands.group(pass_context=True, no_pm=True)
     @checks.admin_or_permissions(manage_channels=True)
     async def ignore(self, ctx):
@@ -1170,6 +1513,7 @@ class Mod:
                 self.filter[server.id].append(w.lower())
                 added += 1
         if added:
+            self._filters.pop(server.id, None)
             dataIO.save_json("data/mod/filter.json", self.filter)
             await self.bot.say("Words added to filter.")
         else:
@@ -1196,11 +1540,43 @@ class Mod:
                 self.filter[server.id].remove(w.lower())
                 removed += 1
         if removed:
+            self._filters.pop(server.id, None)
             dataIO.save_json("data/mod/filter.json", self.filter)
             await self.bot.say("Words removed from filter.")
         else:
             await self.bot.say("Those words weren't in the filter.")
 
+    @_filter.command(name="wholewords", pass_context=True)
+    async def filter_wholewords(self, ctx):
+        """Toggles matching filtered words only as whole words
+
+        When enabled "ass" won't match "class\""""
+        server = ctx.message.server
+        enabled = not self.settings[server.id].get("filter_whole_words", False)
+        self.settings[server.id]["filter_whole_words"] = enabled
+        self._filters.pop(server.id, None)
+        dataIO.save_json("data/mod/settings.json", self.settings)
+        if enabled:
+            await self.bot.say("The filter will only match whole words.")
+        else:
+            await self.bot.say("The filter will match words anywhere.")
+
+    @_filter.command(name="normalize", pass_context=True)
+    async def filter_normalize(self, ctx):
+        """Toggles ignoring accents and lookalike characters
+
+        When enabled "ｂáď" matches "bad\""""
+        server = ctx.message.server
+        enabled = not self.settings[server.id].get("filter_normalize", False)
+        self.settings[server.id]["filter_normalize"] = enabled
+        self._filters.pop(server.id, None)
+        dataIO.save_json("data/mod/settings.json", self.settings)
+        if enabled:
+            await self.bot.say("The filter will ignore accents and lookalike "
+                               "characters.")
+        else:
+            await self.bot.say("The filter will match characters exactly.")
+
     @commands.group(no_pm=True, pass_context=True)
     @checks.admin_or_permissions(manage_roles=True)
     async def editrole(self, ctx):
@@ -1280,22 +1656,89 @@ class Mod:
             await self.bot.say("That user doesn't have any recorded name or "
                                "nickname change.")
 
+    async def scan_history(self, channel, before, check, number, purger,
+                           tries=5):
+        """Hands the purger the last number messages before before that pass
+        check, reading at most tries pages of history. The purger deletes
+        each batch while the next page is being fetched."""
+        found = 0
+        while tries and found < number:
+            page_size = 0
+            async for message in self.bot.logs_from(channel, limit=100,
+                                                    before=before):
+                page_size += 1
+                before = message
+                if found < number and check(message):
+                    found += 1
+                    await purger.add(message)
+            if page_size < 100:  # Reached the start of the channel
+                break
+            tries -= 1
+        return found
+
     async def mass_purge(self, messages):
-        while messages:
-            if len(messages) > 1:
-                await self.bot.delete_messages(messages[:100])
-                messages = messages[100:]
-            else:
-                await self.bot.delete_message(messages[0])
-                messages = []
-            await asyncio.sleep(1.5)
+        purger = Purger(self.bot)
+        for message in messages:
+            await purger.add(message)
+        await purger.finish()
 
     async def slow_deletion(self, messages):
+        purger = Purger(self.bot, bulk=False)
         for message in messages:
+            await purger.add(message)
+        await purger.finish()
+
+    def get_mute_role(self, server):
+        role_id = self.settings.get(server.id, {}).get("mute_role")
+        if role_id is None:
+            return None
+        return discord.utils.get(server.roles, id=role_id)
+
+    async def apply_overwrites(self, target, changes, verb):
+        """Sets target's overwrites in many channels at once
+
+        changes are (channel, overwrites) pairs, None overwrites deleting
+        them. Big batches get a progress message, which is returned along
+        with the BulkResult so the caller can edit the outcome into it."""
+        status = None
+        if len(changes) > 10:
+            status = await self.bot.say("{} in {} channels...".format(
+                verb, len(changes)))
+        last_edit = [time.time()]
+
+        async def progress(result):
+            if status is None or len(result) == result.total:
+                return
+            if time.time() - last_edit[0] < PROGRESS_INTERVAL:
+                return
+            last_edit[0] = time.time()
             try:
-                await self.bot.delete_message(message)
-            except:
+                await self.bot.edit_message(status, "{} in {} channels... {}/{}"
+                                            "".format(verb, result.total,
+                                                      len(result), result.total))
+            except discord.HTTPException:
+                pass
+
+        async def call(change):
+            channel, overwrites = change
+            if overwrites is None:
+                await self.bot.delete_channel_permissions(channel, target)
+            else:
+                await self.bot.edit_channel_permissions(channel, target,
+                                                        overwrites)
+
+        result = await run_bulk(changes, call, progress=progress)
+        return result, status
+
+    async def report(self, status, text):
+        """Edits text into a progress message, or says it if there's none"""
+        if status is not None:
+            try:
+                await self.bot.edit_message(status, text)
+                return
+            except discord.HTTPException:
                 pass
+        await self.bot.say(text)
 
     def is_admin_or_superior(self, obj):
         if isinstance(obj, discord.Message):
@@ -1367,10 +1810,7 @@ class Mod:
         if mod_channel is None:
             return None
 
-        if server.id not in self.cases:
-            self.cases[server.id] = {}
-
-        case_n = len(self.cases[server.id]) + 1
+        case_n = self.case_store.next_number(server.id)
 
         case = {
             "case"         : case_n,
@@ -1397,13 +1837,11 @@ class Mod:
         except:
             pass
 
-        self.cases[server.id][str(case_n)] = case
+        self.case_store.save(server.id, case)
 
         if mod:
             self.last_case[server.id][mod.id] = case_n
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
-
         return case_n
 
     async def update_case(self, server, *, case, mod=None, reason=None,
@@ -1412,8 +1850,7 @@ class Mod:
         if channel is None:
             raise NoModLogChannel()
 
-        case = str(case)
-        case = self.cases[server.id][case]
+        case = self.case_store.get(server.id, case)
 
         if case["moderator_id"] is not None:
             if case["moderator_id"] != mod.id:
@@ -1435,7 +1872,7 @@ class Mod:
 
         case_msg = self.format_case_msg(case)
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        self.case_store.save(server.id, case)
 
         if case["message"] is None:  # The case's message was never sent
             raise CaseMessageNotFound()
@@ -1497,19 +1934,30 @@ class Mod:
 
         return case_msg
 
+    def get_filter(self, server):
+        """The server's filtered words compiled into a single matcher"""
+        matcher = self._filters.get(server.id)
+        if matcher is None:
+            settings = self.settings.get(server.id, {})
+            matcher = WordFilter(self.filter.get(server.id, []),
+                                 whole_words=settings.get("filter_whole_words", False),
+                                 normalized=settings.get("filter_normalize", False))
+            self._filters[server.id] = matcher
+        return matcher
+
     async def check_filter(self, message):
         server = message.server
         if server.id in self.filter.keys():
-            for w in self.filter[server.id]:
-                if w in message.content.lower():
-                    try:
-                        await self.bot.delete_message(message)
-                        logger.info("Message deleted in server {}."
-                                    "Filtered: {}"
-                                    "".format(server.id, w))
-                        return True
-                    except:
-                        pass
+            w = self.get_filter(server).search(message.content)
+            if w is not None:
+                try:
+                    await self.bot.delete_message(message)
+                    logger.info("Message deleted in server {}."
+                                "Filtered: {}"
+                                "".format(server.id, w))
+                    return True
+                except:
+                    pass
         return False
 
     async def check_duplicates(self, message):
@@ -1520,14 +1968,10 @@ class Mod:
         if self.settings[server.id]["delete_repeats"]:
             if not message.content:
                 return False
-            if author.id not in self.cache:
-                self.cache[author.id] = deque(maxlen=3)
-            self.cache.move_to_end(author.id)
-            while len(self.cache) > 100000:
-                self.cache.popitem(last=False) # the oldest gets discarded
-            self.cache[author.id].append(message.content)
-            msgs = self.cache[author.id]
-            if len(msgs) == 3 and msgs[0] == msgs[1] == msgs[2]:
+            settings = self.settings[server.id]
+            if self.repeats.check(server, author, message.content,
+                                  settings.get("repeats_threshold", 3),
+                                  settings.get("repeats_window", 300)):
                 try:
                     await self.bot.delete_message(message)
                     return True
@@ -1559,6 +2003,62 @@ class Mod:
                     return True
         return False
 
+    async def check_floods(self, message):
+        server = message.server
+        author = message.author
+        if server.id not in self.settings:
+            return False
+        floods = self.settings[server.id].get("floods")
+        if not floods:
+            return False
+        for kind, config in floods.items():
+            if kind == "messages":
+                key, amount = author.id, 1
+            elif kind == "mentions":
+                key, amount = author.id, len(message.mentions)
+            elif kind == "attachments":
+                key, amount = author.id, len(message.attachments)
+            elif kind == "duplicates" and message.content:
+                key, amount = hash(message.content), 1
+            else:
+                continue
+            if amount and self.floods[kind].hit((server.id, key), amount,
+                                                config["limit"],
+                                                config["seconds"]):
+                await self.flood_action(message, kind, config["action"])
+                return True
+        return False
+
+    async def flood_action(self, message, kind, action):
+        server = message.server
+        author = message.author
+        try:
+            await self.bot.delete_message(message)
+        except:
+            pass
+        key = (server.id, author.id)
+        if action == "delete" or key in self.flood_punished:
+            return
+        # The rest of the burst is still coming in while the member leaves
+        self.flood_punished.add(key)
+        self.bot.loop.call_later(30, self.flood_punished.discard, key)
+        try:
+            if action == "ban":
+                self.temp_cache.add(author, server, "BAN")
+                await self.bot.ban(author, 1)
+            else:
+                await self.bot.kick(author)
+        except:
+            logger.info("Failed to {} member for {} flood in "
+                        "server {}".format(action, kind, server.id))
+        else:
+            await self.new_case(server,
+                                action=action.upper(),
+                                mod=server.me,
+                                user=author,
+                                reason="{} flood (Auto{})".format(
+                                    kind.capitalize(), action))
+
     async def on_command(self, command, ctx):
         """Currently used for:
             * delete delay"""
@@ -1602,6 +2102,8 @@ class Mod:
             deleted = await self.check_duplicates(message)
         if not deleted:
             deleted = await self.check_mention_spam(message)
+        if not deleted:
+            deleted = await self.check_floods(message)
 
     async def on_message_edit(self, _, message):
         author = message.author
@@ -1623,36 +2125,58 @@ class Mod:
                                 action="BAN")
 
     async def on_member_unban(self, server, user):
+        timers.cancel("Mod", "tempban:{}:{}".format(server.id, user.id))
         if not self.temp_cache.check(user, server, "UNBAN"):
             await self.new_case(server,
                                 user=user,
                                 action="UNBAN")
 
     async def check_names(self, before, after):
+        # Most member updates are roles, status or games
+        if before.name == after.name and before.nick == after.nick:
+            return
+
         if before.name != after.name:
-            if before.id not in self.past_names:
-                self.past_names[before.id] = [after.name]
-            else:
-                if after.name not in self.past_names[before.id]:
-                    names = deque(self.past_names[before.id], maxlen=20)
-                    names.append(after.name)
-                    self.past_names[before.id] = list(names)
-            dataIO.save_json("data/mod/past_names.json", self.past_names)
+            names = self.past_names.setdefault(before.id, [])
+            if self.record_name(names, after.name):
+                self.names_changed("data/mod/past_names.json")
 
         if before.nick != after.nick and after.nick is not None:
             server = before.server
-            if server.id not in self.past_nicknames:
-                self.past_nicknames[server.id] = {}
-            if before.id in self.past_nicknames[server.id]:
-                nicks = deque(self.past_nicknames[server.id][before.id],
-                              maxlen=20)
-            else:
-                nicks = []
-            if after.nick not in nicks:
-                nicks.append(after.nick)
-                self.past_nicknames[server.id][before.id] = list(nicks)
-                dataIO.save_json("data/mod/past_nicknames.json",
-                                 self.past_nicknames)
+            nicks = self.past_nicknames.setdefault(server.id, {})
+            nicks = nicks.setdefault(before.id, [])
+            if self.record_name(nicks, after.nick):
+                self.names_changed("data/mod/past_nicknames.json")
+
+    def record_name(self, history, name):
+        """Appends name to a user's history unless it's already there"""
+        if name in history:
+            return False
+        history.append(name)
+        if len(history) > NAME_HISTORY:
+            del history[0]
+        return True
+
+    def names_changed(self, path):
+        self._names_changed.add(path)
+        if self._names_handle is None:
+            self._names_handle = self.bot.loop.call_later(
+                NAMES_SAVE_DELAY, self.save_names)
+
+    def save_names(self):
+        if self._names_handle is not None:
+            self._names_handle.cancel()
+            self._names_handle = None
+        if "data/mod/past_names.json" in self._names_changed:
+            dataIO.save_json("data/mod/past_names.json", self.past_names)
+        if "data/mod/past_nicknames.json" in self._names_changed:
+            dataIO.save_json("data/mod/past_nicknames.json",
+                             self.past_nicknames)
+        self._names_changed.clear()
+
+    def __unload(self):
+        self.save_names()
+        timers.unregister("Mod")
 
     def are_overwrites_empty(self, overwrites):
         """There is currently no cleaner way to check if a
@@ -1662,6 +2186,14 @@ class Mod:
         return original == empty
 
 
+def parse_duration(text):
+    """Seconds in a duration like 1d12h, or None if it isn't one"""
+    parts = re.findall(r"(\d+)\s*([smhdw])", text.lower())
+    if not parts or re.sub(r"[\d\s]+[smhdw]", "", text.lower()).strip():
+        return None
+    return sum(int(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
 def strfdelta(delta):
     s = []
     if delta.days:
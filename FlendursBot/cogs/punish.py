@@ -4,6 +4,7 @@ from .utils import checks
 from .utils.chat_formatting import pagify, box
 import logging
 from cogs.utils.dataIO import dataIO
+from cogs.utils.timers import timers
 import os
 import time
 import re
@@ -131,7 +132,7 @@ class Punish:
     def __init__(self, bot):
         self.bot = bot
         self.json = compat_load(JSON)
-        self.handles = {}
+        timers.register('Punish', self.punishment_expired, loop=bot.loop)
 
         try:
             self.analytics = CogAnalytics(self)
@@ -144,6 +145,9 @@ class Punish:
     def save(self):
         dataIO.save_json(JSON, self.json)
 
+    def __unload(self):
+        timers.unregister('Punish')
+
     @commands.command(pass_context=True, no_pm=True)
     @checks.mod_or_permissions(manage_messages=True)
     async def cpunish(self, ctx, user: discord.Member, duration: str=None, *, reason: str=None):
@@ -420,38 +424,29 @@ class Punish:
                 continue
 
             me = server.me
-            role = await self.get_role(server, quiet=True, create=True)
-            if not role:
-                log.error("Needed to create punish role in %s, but couldn't."
-                          % server.name)
-                continue
+            role = await self.get_role(server, quiet=True)
 
-            for member_id, data in members.copy().items():
+            for member_id, data in members.items():
                 if not member_id.isdigit():
                     continue
 
                 until = data['until']
-                if until:
-                    duration = until - time.time()
+                # Punishments given before the timers were saved on their own
+                if until and timers.get('Punish', _timer_key(serverid, member_id)) is None:
+                    self._schedule_timer(serverid, member_id, until, data['reason'])
 
+                # Overdue punishments are lifted by their timer instead
+                if until and until <= time.time():
+                    continue
+
+                # The role may have been taken off while the bot was offline
                 member = server.get_member(member_id)
-                if until and duration < 0:
-                    if member:
-                        reason = 'Punishment removal overdue, maybe bot was offline. '
-                        if self.json[server.id][member_id]['reason']:
-                            reason += self.json[server.id][member_id]['reason']
-                        await self._unpunish(member, reason)
-                    else:  # member disappeared
-                        del(self.json[server.id][member_id])
-
-                elif member and role not in member.roles:
+                if role and member and role not in member.roles:
                     if role >= me.top_role:
                         log.error("Needed to re-add punish role to %s in %s, "
                                   "but couldn't." % (member, server.name))
                         continue
                     await self.bot.add_roles(member, role)
-                    if until:
-                        self.schedule_unpunish(duration, member)
 
         self.save()
 
@@ -529,19 +524,28 @@ class Punish:
     # Functions related to unpunishing
 
     def schedule_unpunish(self, delay, member, reason=None):
-        """Schedules role removal, canceling and removing existing tasks if present"""
-        sid = member.server.id
+        """Schedules role removal, replacing the existing timer if present"""
+        self._schedule_timer(member.server.id, member.id, time.time() + delay,
+                             reason)
 
-        if sid not in self.handles:
-            self.handles[sid] = {}
+    def _schedule_timer(self, sid, member_id, until, reason):
+        data = {'server': sid, 'member': member_id, 'reason': reason}
+        timers.schedule('Punish', _timer_key(sid, member_id), until, data)
 
-        if member.id in self.handles[sid]:
-            self.handles[sid][member.id].cancel()
-
-        coro = self._unpunish(member, reason)
+    async def punishment_expired(self, key, data):
+        """Timer callback, also runs at startup for overdue punishments"""
+        await self.bot.wait_until_ready()
+        sid, member_id = data['server'], data['member']
+        server = self.bot.get_server(sid)
+        member = server.get_member(member_id) if server else None
+
+        if member is None:  # member or server disappeared
+            if member_id in self.json.get(sid, {}):
+                del(self.json[sid][member_id])
+                self.save()
+            return
 
-        handle = self.bot.loop.call_later(delay, self.bot.loop.create_task, coro)
-        self.handles[sid][member.id] = handle
+        await self._unpunish(member, data['reason'])
 
     async def _unpunish(self, member, reason=None):
         """Remove punish role, delete record and task handle"""
@@ -582,9 +586,7 @@ class Punish:
             del(self.json[member.server.id][member.id])
             self.save()
 
-        if sid in self.handles and member.id in self.handles[sid]:
-            self.handles[sid][member.id].cancel()
-            del(self.handles[member.server.id][member.id])
+        timers.cancel('Punish', _timer_key(sid, member.id))
 
     # Listeners
 
@@ -645,7 +647,7 @@ class Punish:
             if data['reason']:
                 reason += data['reason']
 
-            if member.id not in self.handles[sid]:
+            if timers.get('Punish', _timer_key(sid, member.id)) is None:
                 self.schedule_unpunish(duration, member, reason)
 
     async def on_voice_state_update(self, before, after):
@@ -669,6 +671,10 @@ class Punish:
             self.analytics.command(ctx)
 
 
+def _timer_key(sid, member_id):
+    return '%s:%s' % (sid, member_id)
+
+
 def compat_load(path):
     data = dataIO.load_json(path)
     for server, punishments in data.items():
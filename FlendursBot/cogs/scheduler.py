@@ -3,10 +3,10 @@ from discord.ext import commands
 from cogs.utils import checks
 from cogs.utils.dataIO import fileIO
 from cogs.utils.chat_formatting import *
+from cogs.utils.timers import timers
 
 import logging
 import os
-import asyncio
 import time
 from random import randint
 from math import ceil
@@ -26,12 +26,21 @@ class Event:
         self.repeat = data.pop('repeat')
         self.starttime = data.pop('starttime', None)
 
-    def __lt__(self, other):
-        my_sig = "{}-{}-{}-{}".format(self.timedelta, self.name,
-                                      self.starttime, self.channel)
-        other_sig = "{}-{}-{}-{}".format(other.timedelta, other.name,
-                                         other.starttime, other.channel)
-        return hash(my_sig) < hash(other_sig)
+    @property
+    def key(self):
+        return "{}:{}".format(self.server, self.name)
+
+    def next_run(self, now=None):
+        """Timestamp of the next run, repeating events skip missed runs"""
+        if now is None:
+            now = time.time()
+        if self.starttime is None:
+            return now + self.timedelta
+        if self.repeat:
+            diff = max(now - self.starttime, 0)
+            return (ceil(diff / self.timedelta) * self.timedelta +
+                    self.starttime)
+        return self.starttime + self.timedelta
 
 
 class Scheduler:
@@ -43,39 +52,55 @@ class Scheduler:
     def __init__(self, bot):
         self.bot = bot
         self.events = fileIO('data/scheduler/events.json', 'load')
-        self.queue = asyncio.PriorityQueue(loop=self.bot.loop)
-        self.queue_lock = asyncio.Lock()
-        self.to_kill = {}
+        timers.register('Scheduler', self.event_due, loop=bot.loop)
         self._load_events()
 
+    def __unload(self):
+        timers.unregister('Scheduler')
+
     def save_events(self):
         fileIO('data/scheduler/events.json', 'save', self.events)
         log.debug('saved events:\n\t{}'.format(self.events))
 
+    def _get_event(self, server, name):
+        data = dict(self.events[server][name])
+        data['server'] = server
+        data['name'] = name
+        return Event(data)
+
     def _load_events(self):
-        # for entry in the self.events make an Event
+        # Timers are saved on their own, this only picks up events that
+        # don't have one yet
         for server in self.events:
-            for name, event in self.events[server].items():
-                ret = {}
-                ret['server'] = server
-                ret.update(event)
-                e = Event(ret)
-                self.bot.loop.create_task(self._put_event(e))
-
-    async def _put_event(self, event, fut=None, offset=None):
+            for name in self.events[server]:
+                e = self._get_event(server, name)
+                if timers.get('Scheduler', e.key) is None:
+                    self._put_event(e)
+
+    def _put_event(self, event, fut=None):
         if fut is None:
-            now = int(time.time())
-            if event.repeat:
-                diff = now - event.starttime
-                fut = ((ceil(diff / event.timedelta) * event.timedelta) +
-                       event.starttime)
-            else:
-                fut = now + event.timedelta
-        if offset:
-            fut += offset
-        await self.queue.put((fut, event))
-        log.debug('Added "{}" to the scheduler queue at {}'.format(event.name,
-                                                                   fut))
+            fut = event.next_run()
+        timers.schedule('Scheduler', event.key, fut,
+                        {'server': event.server, 'name': event.name})
+        log.debug('Scheduled "{}" at {}'.format(event.name, fut))
+
+    async def event_due(self, key, data):
+        """Timer callback, also runs at startup for overdue events"""
+        await self.bot.wait_until_ready()
+        if self.bot.get_cog('Scheduler') is not self:
+            # Unloaded meanwhile, the event gets a new timer on the next load
+            return
+        server, name = data['server'], data['name']
+        if name not in self.events.get(server, {}):
+            return
+        event = self._get_event(server, name)
+        if event.repeat:
+            # Past the current run, so a late wakeup can't run it twice
+            self._put_event(event, event.next_run(time.time() + 1))
+        else:
+            del self.events[server][name]
+            self.save_events()
+        self.run_coro(event)
 
     async def _add_event(self, name, command, dest_server, dest_channel,
                          author, timedelta, repeat=False):
@@ -104,21 +129,12 @@ class Scheduler:
 
         event_dict['server'] = dest_server
         e = Event(event_dict.copy())
-        await self._put_event(e)
+        self._put_event(e)
 
         self.save_events()
 
     async def _remove_event(self, name, server):
-        await self.queue_lock.acquire()
-        events = []
-        while self.queue.qsize() != 0:
-            time, event = await self.queue.get()
-            if not (name == event.name and server.id == event.server):
-                events.append((time, event))
-
-        for event in events:
-            await self.queue.put(event)
-        self.queue_lock.release()
+        timers.cancel('Scheduler', "{}:{}".format(server.id, name))
 
     @commands.group(no_pm=True, pass_context=True)
     @checks.mod_or_permissions(manage_messages=True)
@@ -198,8 +214,7 @@ class Scheduler:
         del self.events[server.id][name]
         await self._remove_event(name, server)
         self.save_events()
-        await self.bot.say('"{}" has successfully been removed but'
-                           ' it may run once more.'.format(name))
+        await self.bot.say('"{}" has successfully been removed.'.format(name))
 
     @scheduler.command(pass_context=True, name="list")
     async def _scheduler_list(self, ctx):
@@ -247,50 +262,6 @@ class Scheduler:
         # self.bot.loop.create_task(coro)
         self.bot.dispatch('message', fake_message)
 
-    async def queue_manager(self):
-        while self == self.bot.get_cog('Scheduler'):
-            await self.queue_lock.acquire()
-            if self.queue.qsize() != 0:
-                curr_time = int(time.time())
-                next_tuple = await self.queue.get()
-                next_time = next_tuple[0]
-                next_event = next_tuple[1]
-                diff = next_time - curr_time
-                diff = diff if diff >= 0 else 0
-                if diff < 30:
-                    log.debug('scheduling call of "{}" in {}s'.format(
-                        next_event.name, diff))
-                    fut = self.bot.loop.call_later(diff, self.run_coro,
-                                                   next_event)
-                    self.to_kill[next_time] = fut
-                    if next_event.repeat:
-                        await self._put_event(next_event, next_time,
-                                              next_event.timedelta)
-                    else:
-                        del self.events[next_event.server][next_event.name]
-                        self.save_events()
-                else:
-                    log.debug('Will run {} "{}" in {}s'.format(
-                        next_event.name, next_event.command, diff))
-                    await self._put_event(next_event, next_time)
-            self.queue_lock.release()
-
-            to_delete = []
-            for start_time, old_command in self.to_kill.items():
-                if time.time() > start_time + 30:
-                    old_command.cancel()
-                    to_delete.append(start_time)
-            for item in to_delete:
-                del self.to_kill[item]
-
-            await asyncio.sleep(5)
-        log.debug('manager dying')
-        while self.queue.qsize() != 0:
-            await self.queue.get()
-        while len(self.to_kill) != 0:
-            curr = self.to_kill.pop()
-            curr.cancel()
-
 
 def check_folder():
     if not os.path.exists('data/scheduler'):
@@ -307,6 +278,4 @@ def setup(bot):
     check_folder()
     check_files()
     n = Scheduler(bot)
-    loop = asyncio.get_event_loop()
-    loop.create_task(n.queue_manager())
     bot.add_cog(n)
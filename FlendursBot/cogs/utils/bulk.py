@@ -0,0 +1,80 @@
+"""Runs the same Discord API call over many items at once.
+
+discord.py already waits out the rate limit of each route, so running a few
+calls at the same time lets calls to different routes (channel overwrites
+are limited per channel) overlap instead of queueing behind each other.
+Calls that still fail with 429 or a server error are retried with an
+exponential backoff. A Forbidden stops the remaining calls since they would
+all fail the same way.
+
+    async def mute(channel):
+        await bot.edit_channel_permissions(channel, member, overwrite)
+    result = await run_bulk(channels, mute, progress=report)
+    if result.forbidden:
+        ...
+"""
+import asyncio
+import random
+
+import discord
+
+CONCURRENCY = 5
+RETRIES = 4
+BACKOFF = 1.0  # seconds before the first retry, doubled after every try
+
+
+class BulkResult:
+
+    def __init__(self, total):
+        self.total = total
+        self.done = []  # items whose call succeeded
+        self.failed = []  # (item, exception)
+        self.forbidden = False
+
+    def __len__(self):
+        return len(self.done) + len(self.failed)
+
+
+def _should_retry(error):
+    status = getattr(getattr(error, "response", None), "status", None)
+    return status == 429 or (status is not None and status >= 500)
+
+
+async def run_bulk(items, call, concurrency=CONCURRENCY, retries=RETRIES,
+                   progress=None):
+    """Awaits call(item) for every item, at most concurrency at a time.
+
+    progress, if given, is a coroutine function awaited with the result after
+    each item. Returns a BulkResult."""
+    items = list(items)
+    result = BulkResult(len(items))
+    pending = iter(items)
+
+    async def worker():
+        for item in pending:
+            if result.forbidden:
+                return
+            delay = BACKOFF
+            for attempt in range(retries + 1):
+                try:
+                    await call(item)
+                except discord.Forbidden as e:
+                    result.failed.append((item, e))
+                    result.forbidden = True
+                    return
+                except discord.HTTPException as e:
+                    if attempt < retries and _should_retry(e):
+                        await asyncio.sleep(delay + random.random() * delay / 2)
+                        delay *= 2
+                        continue
+                    result.failed.append((item, e))
+                else:
+                    result.done.append(item)
+                break
+            if progress is not None:
+                await progress(result)
+
+    workers = [worker() for _ in range(min(concurrency, len(items)))]
+    if workers:
+        await asyncio.gather(*workers)
+    return result
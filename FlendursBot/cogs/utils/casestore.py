@@ -0,0 +1,189 @@
+"""Append-only storage for Mod's modlog cases.
+
+Every server gets its own JSON lines file in ``folder``. Creating or editing
+a case appends the whole case as one line, the latest line for a case number
+being the current version, so nothing ever rewrites the history. A server's
+file is read once, the first time the server is used, to build indexes of
+line offsets by case number, user, moderator and action; afterwards the
+cases themselves stay on disk and queries only read the lines they return.
+Files with too many outdated lines are compacted.
+
+    store = CaseStore("data/mod/cases", legacy_path="data/mod/modlog.json")
+    number = store.next_number(server.id)
+    store.save(server.id, {"case": number, "user_id": user.id, ...})
+    store.query(server.id, user_id=user.id, limit=10)
+"""
+import json
+import os
+
+from .dataIO import dataIO
+
+# Compaction starts once outdated lines outnumber this and the live cases
+COMPACT_MIN_STALE = 1000
+
+
+class _ServerIndex:
+
+    def __init__(self):
+        self.offsets = {}  # case number: offset of its latest line
+        self.cases = {}  # case number: (user id, moderator id, action)
+        self.by_user = {}  # user id: case numbers in ascending order
+        self.by_moderator = {}
+        self.by_action = {}
+        self.last = 0
+        self.stale = 0
+
+    def add(self, case, offset):
+        number = case["case"]
+        keys = (case.get("user_id"), case.get("moderator_id"), case.get("action"))
+        old = self.cases.get(number)
+        if old is not None:
+            self.stale += 1
+        if old != keys:
+            for index, old_key, key in zip(self.indexes(), old or (None,) * 3, keys):
+                if old_key == key:
+                    continue
+                if old_key is not None:
+                    index[old_key].remove(number)
+                    if not index[old_key]:
+                        del index[old_key]
+                if key is not None:
+                    numbers = index.setdefault(key, [])
+                    if numbers and numbers[-1] > number:
+                        numbers.append(number)
+                        numbers.sort()
+                    else:
+                        numbers.append(number)
+            self.cases[number] = keys
+        self.offsets[number] = offset
+        self.last = max(self.last, number)
+
+    def indexes(self):
+        return self.by_user, self.by_moderator, self.by_action
+
+
+class CaseStore:
+
+    def __init__(self, folder, legacy_path=None):
+        self.folder = folder
+        self._indexes = {}  # server id: _ServerIndex
+        os.makedirs(folder, exist_ok=True)
+        if legacy_path is not None:
+            self._migrate(legacy_path)
+
+    def _path(self, server_id):
+        return os.path.join(self.folder, "{}.jsonl".format(server_id))
+
+    def _index(self, server_id):
+        index = self._indexes.get(server_id)
+        if index is None:
+            index = self._indexes[server_id] = _ServerIndex()
+            path = self._path(server_id)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    offset = 0
+                    for line in f:
+                        if line.strip():
+                            index.add(json.loads(line.decode("utf-8")), offset)
+                        offset += len(line)
+        return index
+
+    def _read(self, server_id, offset):
+        with open(self._path(server_id), "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline().decode("utf-8"))
+
+    def _read_many(self, server_id, numbers):
+        if not numbers:
+            return []
+        index = self._index(server_id)
+        with open(self._path(server_id), "rb") as f:
+            cases = []
+            for number in numbers:
+                f.seek(index.offsets[number])
+                cases.append(json.loads(f.readline().decode("utf-8")))
+            return cases
+
+    def next_number(self, server_id):
+        return self._index(server_id).last + 1
+
+    def count(self, server_id):
+        return len(self._index(server_id).offsets)
+
+    def get(self, server_id, number):
+        """The case with that number. Raises KeyError if there's none"""
+        offset = self._index(server_id).offsets[int(number)]
+        return self._read(server_id, offset)
+
+    def save(self, server_id, case):
+        """Stores a new case or a new version of an existing one"""
+        index = self._index(server_id)
+        line = (json.dumps(case, separators=(",", ":")) + "\n").encode("utf-8")
+        with open(self._path(server_id), "ab") as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(line)
+        index.add(case, offset)
+        if index.stale > max(COMPACT_MIN_STALE, len(index.offsets)):
+            self.compact(server_id)
+
+    def query(self, server_id, user_id=None, moderator_id=None, action=None,
+              limit=10):
+        """The newest cases matching every given filter, newest first"""
+        index = self._index(server_id)
+        filters = [(i, key) for i, key in enumerate((user_id, moderator_id, action))
+                   if key is not None]
+        if filters:
+            candidates = min((index.indexes()[i].get(key, []) for i, key in filters),
+                             key=len)
+        else:
+            # Case numbers are handed out one after the other
+            candidates = range(1, index.last + 1)
+        numbers = []
+        for number in reversed(candidates):
+            keys = index.cases.get(number)
+            if keys is None:
+                continue
+            if all(keys[i] == key for i, key in filters):
+                numbers.append(number)
+                if len(numbers) >= limit:
+                    break
+        return self._read_many(server_id, numbers)
+
+    def reset(self, server_id):
+        self._indexes[server_id] = _ServerIndex()
+        try:
+            os.remove(self._path(server_id))
+        except FileNotFoundError:
+            pass
+
+    def compact(self, server_id):
+        """Rewrites the server's file with only the latest version of each case"""
+        index = self._index(server_id)
+        numbers = sorted(index.offsets)
+        cases = self._read_many(server_id, numbers)
+        path = self._path(server_id)
+        tmp_path = path + ".tmp"
+        new_index = _ServerIndex()
+        with open(tmp_path, "wb") as f:
+            for case in cases:
+                offset = f.tell()
+                f.write((json.dumps(case, separators=(",", ":")) + "\n").encode("utf-8"))
+                new_index.add(case, offset)
+        os.replace(tmp_path, path)
+        self._indexes[server_id] = new_index
+
+    def _migrate(self, legacy_path):
+        """Moves the cases out of the old single modlog.json"""
+        if not dataIO.is_valid_json(legacy_path):
+            return
+        legacy = dataIO.load_json(legacy_path)
+        if not legacy:
+            return
+        for server_id, cases in legacy.items():
+            if os.path.isfile(self._path(server_id)):
+                continue
+            for number in sorted(cases, key=int):
+                self.save(server_id, cases[number])
+        os.replace(legacy_path, legacy_path + ".bak")
+        dataIO.save_json(legacy_path, {})
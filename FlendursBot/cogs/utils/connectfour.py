@@ -0,0 +1,264 @@
+"""Bitboard Four in a row engine used by the FourInARow bot player.
+
+Each column of a board ``height`` rows high takes ``height + 1`` bits, the
+extra bit on top keeps alignments from wrapping into the next column. A
+position is two integers: the stones of the player to move and the mask of
+all stones, so playing a move and checking a win are a handful of shifts.
+
+    position = Position.from_rows(board, empty, own_token, width, height)
+    column = best_move(position, depth=8, time_budget=1.0)
+
+Run ``python -m cogs.utils.connectfour`` for a perft-style benchmark.
+"""
+import time
+
+WIN_SCORE = 100000
+
+# Transposition table flags
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def has_won(stones, height):
+    """True if ``stones`` hold four in a row: vertical, horizontal, and both diagonals"""
+    h1 = height + 1
+    for shift in (1, h1, h1 - 1, h1 + 1):
+        pairs = stones & (stones >> shift)
+        if pairs & (pairs >> 2 * shift):
+            return True
+    return False
+
+
+def popcount(bits):
+    return bin(bits).count("1")
+
+
+class Position:
+
+    def __init__(self, width, height, current=0, mask=0, moves=0):
+        self.width = width
+        self.height = height
+        self.current = current  # stones of the player to move
+        self.mask = mask        # every stone on the board
+        self.moves = moves
+        self._h1 = height + 1
+        self._bottom = sum(1 << (col * self._h1) for col in range(width))
+        self._board = self._bottom * ((1 << height) - 1)
+
+    @classmethod
+    def from_rows(cls, rows, empty, own, width, height):
+        """Builds the position from FourInARow's board rows, with ``own`` to move.
+
+        Row 0 is the top of the board. Every other token counts as the opponent.
+        """
+        position = cls(width, height)
+        for x, row in enumerate(rows[:height]):
+            for y, cell in enumerate(row[:width]):
+                if cell == empty:
+                    continue
+                bit = 1 << (y * position._h1 + height - 1 - x)
+                position.mask |= bit
+                position.moves += 1
+                if cell == own:
+                    position.current |= bit
+        return position
+
+    def copy(self):
+        return Position(self.width, self.height, self.current, self.mask, self.moves)
+
+    def key(self):
+        return self.current + self.mask
+
+    def top_bit(self, col):
+        return 1 << (self.height - 1 + col * self._h1)
+
+    def bottom_bit(self, col):
+        return 1 << (col * self._h1)
+
+    def column_bits(self, col):
+        return ((1 << self.height) - 1) << (col * self._h1)
+
+    def can_play(self, col):
+        return not self.mask & self.top_bit(col)
+
+    def is_full(self):
+        return self.moves >= self.width * self.height
+
+    def play(self, col):
+        """Plays a column for the player to move, then hands the turn over"""
+        self.current ^= self.mask
+        self.mask |= self.mask + self.bottom_bit(col)
+        self.moves += 1
+
+    def undo(self, col, previous_current, previous_mask):
+        self.current = previous_current
+        self.mask = previous_mask
+        self.moves -= 1
+
+    def is_winning_move(self, col):
+        move = (self.mask + self.bottom_bit(col)) & self.column_bits(col)
+        return has_won(self.current | move, self.height)
+
+    def opponent_won(self):
+        """True when the player who just moved made four in a row"""
+        return has_won(self.current ^ self.mask, self.height)
+
+    def threats(self, stones):
+        """Empty cells that would complete four in a row for ``stones``"""
+        h1 = self._h1
+        # vertical
+        result = (stones << 1) & (stones << 2) & (stones << 3)
+        for shift in (h1, h1 - 1, h1 + 1):
+            pairs = (stones << shift) & (stones << 2 * shift)
+            result |= pairs & (stones << 3 * shift)
+            result |= pairs & (stones >> shift)
+            pairs = (stones >> shift) & (stones >> 2 * shift)
+            result |= pairs & (stones << shift)
+            result |= pairs & (stones >> 3 * shift)
+        return result & (self._board ^ self.mask)
+
+    def evaluate(self):
+        """Heuristic score for the player to move"""
+        own = popcount(self.threats(self.current))
+        other = popcount(self.threats(self.current ^ self.mask))
+        return own - other
+
+
+class Searcher:
+    """Negamax with alpha-beta pruning, a transposition table and iterative deepening"""
+
+    def __init__(self, time_budget=None, table=None):
+        self.time_budget = time_budget
+        self.table = {} if table is None else table
+        self.nodes = 0
+        self.deadline = None
+
+    def order(self, position):
+        center = (position.width - 1) / 2
+        return sorted(range(position.width), key=lambda col: abs(col - center))
+
+    def negamax(self, position, depth, alpha, beta):
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 1023 and time.time() > self.deadline:
+            raise SearchTimeout()
+        if position.is_full():
+            return 0
+        moves = [col for col in self.order(position) if position.can_play(col)]
+        for col in moves:
+            if position.is_winning_move(col):
+                return WIN_SCORE - position.moves
+        if depth == 0:
+            return position.evaluate()
+
+        original_alpha = alpha
+        key = position.key()
+        entry = self.table.get(key)
+        if entry is not None:
+            entry_depth, value, flag, best = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                elif flag == LOWER:
+                    alpha = max(alpha, value)
+                elif flag == UPPER:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+            if best in moves:
+                moves.remove(best)
+                moves.insert(0, best)
+
+        best_value = -WIN_SCORE * 2
+        best_move = moves[0]
+        for col in moves:
+            current, mask = position.current, position.mask
+            position.play(col)
+            value = -self.negamax(position, depth - 1, -beta, -alpha)
+            position.undo(col, current, mask)
+            if value > best_value:
+                best_value = value
+                best_move = col
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            flag = UPPER
+        elif best_value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table[key] = (depth, best_value, flag, best_move)
+        return best_value
+
+    def search(self, position, max_depth):
+        """Returns (column, score, depth reached), deepening until the time budget runs out"""
+        if self.time_budget is not None:
+            self.deadline = time.time() + self.time_budget
+        moves = [col for col in self.order(position) if position.can_play(col)]
+        if not moves:
+            return None, 0, 0
+        for col in moves:
+            if position.is_winning_move(col):
+                return col, WIN_SCORE, 0
+        best = (moves[0], 0, 0)
+        for depth in range(1, max_depth + 1):
+            try:
+                value = self.negamax(position, depth, -WIN_SCORE * 2, WIN_SCORE * 2)
+            except SearchTimeout:
+                break
+            best = (self.table[position.key()][3], value, depth)
+            if abs(value) >= WIN_SCORE - position.width * position.height:
+                break
+        return best
+
+
+def best_move(position, depth, time_budget=None):
+    """Column the player to move should play, or None when the board is full"""
+    return Searcher(time_budget).search(position.copy(), depth)[0]
+
+
+def search_limits(difficulty):
+    """Search depth and time budget in seconds for a FourInARow bot difficulty"""
+    difficulty = max(int(difficulty), 1)
+    return difficulty * 3, difficulty * 0.5
+
+
+def perft(position, depth):
+    """Number of positions reachable in ``depth`` moves, not expanding finished games"""
+    if depth == 0:
+        return 1
+    nodes = 0
+    for col in range(position.width):
+        if not position.can_play(col):
+            continue
+        if position.is_winning_move(col) or position.moves + 1 >= position.width * position.height:
+            nodes += 1
+            continue
+        current, mask = position.current, position.mask
+        position.play(col)
+        nodes += perft(position, depth - 1)
+        position.undo(col, current, mask)
+    return nodes
+
+
+def benchmark(width=7, height=6, depth=7):
+    start = time.time()
+    nodes = perft(Position(width, height), depth)
+    elapsed = time.time() - start
+    print("perft({}) on {}x{}: {:,} nodes in {:.2f}s ({:,.0f} nodes/s)"
+          "".format(depth, width, height, nodes, elapsed, nodes / max(elapsed, 1e-9)))
+    for difficulty in (1, 2, 4):
+        max_depth, budget = search_limits(difficulty)
+        searcher = Searcher(budget)
+        start = time.time()
+        col, score, reached = searcher.search(Position(width, height), max_depth)
+        print("difficulty {}: column {} score {} depth {} - {:,} nodes in {:.2f}s"
+              "".format(difficulty, col, score, reached, searcher.nodes, time.time() - start))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,140 @@
+"""Shared in-memory cooldown tracking for the game cogs.
+
+Cooldowns are keyed by (namespace, server, user, action), where namespace is
+usually the cog name and server / user are ids (or None for global cooldowns).
+Checks are plain dict lookups. Expired entries are dropped through a min-heap
+of expiry times and the whole table is snapshotted to a small JSON file a while
+after it changes, so cooldowns survive restarts without rewriting the cogs'
+own data files.
+
+    remaining = cooldowns.remaining("Casino", server.id, user.id, "Dice", 5)
+    if not remaining:
+        cooldowns.trigger("Casino", server.id, user.id, "Dice", 5)
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from .dataIO import dataIO
+
+log = logging.getLogger("red.cooldowns")
+
+
+class CooldownService:
+
+    def __init__(self, file_path, snapshot_delay=60):
+        self.file_path = file_path
+        self.snapshot_delay = snapshot_delay
+        self._entries = None  # key -> (start, expiry)
+        self._heap = []       # (expiry, seq, key), may hold stale items
+        self._seq = itertools.count()
+        self._handle = None
+
+    def remaining(self, namespace, server, user, action, duration, now=None):
+        """Seconds left before the action can be used again, 0 when ready.
+
+        duration is the current length of the cooldown, so shortening a
+        cooldown setting applies to cooldowns that are already running. A
+        longer setting doesn't: running cooldowns are still forgotten at the
+        expiry they were triggered with."""
+        start = self.last_used(namespace, server, user, action, now=now)
+        if start is None:
+            return 0
+        if now is None:
+            now = time.time()
+        return max(start + duration - now, 0)
+
+    def last_used(self, namespace, server, user, action, now=None):
+        """Timestamp the running cooldown started at, or None"""
+        self._expire(time.time() if now is None else now)
+        entry = self._entries.get((namespace, server, user, action))
+        return entry[0] if entry else None
+
+    def trigger(self, namespace, server, user, action, duration, now=None):
+        """Starts a cooldown. It is kept for ``duration`` seconds after ``now``"""
+        if now is None:
+            now = time.time()
+        self._expire(now)
+        key = (namespace, server, user, action)
+        expiry = now + duration
+        self._entries[key] = (now, expiry)
+        heapq.heappush(self._heap, (expiry, next(self._seq), key))
+        self._changed()
+
+    def check(self, namespace, server, user, action, duration):
+        """Returns the remaining time, or triggers the cooldown and returns 0"""
+        remaining = self.remaining(namespace, server, user, action, duration)
+        if not remaining:
+            self.trigger(namespace, server, user, action, duration)
+        return remaining
+
+    def clear(self, namespace, server=None, user=None, action=None):
+        """Removes every cooldown matching the given parts of the key"""
+        self._load()
+        wanted = (namespace, server, user, action)
+        stale = [key for key in self._entries
+                 if all(w is None or w == k for w, k in zip(wanted, key))]
+        for key in stale:
+            del self._entries[key]
+        if stale:
+            self._changed()
+        return len(stale)
+
+    def save(self):
+        """Writes the snapshot now"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._entries is None:
+            return
+        self._expire(time.time())
+        data = [list(key) + [start, expiry]
+                for key, (start, expiry) in self._entries.items()]
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        dataIO.save_json(self.file_path, data)
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if not dataIO.is_valid_json(self.file_path):
+            return
+        now = time.time()
+        for namespace, server, user, action, start, expiry in dataIO.load_json(self.file_path):
+            if expiry > now:
+                key = (namespace, server, user, action)
+                self._entries[key] = (start, expiry)
+                self._heap.append((expiry, next(self._seq), key))
+        heapq.heapify(self._heap)
+
+    def _expire(self, now):
+        self._load()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expiry, _, key = heapq.heappop(heap)
+            entry = self._entries.get(key)
+            # Entries triggered again since have a newer heap item
+            if entry is not None and entry[1] == expiry:
+                del self._entries[key]
+
+    def _changed(self):
+        if self._handle is not None:
+            return
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            return
+        self._handle = loop.call_later(self.snapshot_delay, self._snapshot)
+
+    def _snapshot(self):
+        self._handle = None
+        try:
+            self.save()
+        except Exception:
+            log.exception("Could not save the cooldown snapshot")
+
+
+cooldowns = CooldownService("data/red/cooldowns.json")
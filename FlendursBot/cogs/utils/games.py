@@ -0,0 +1,193 @@
+"""Pure game resolution logic shared by the gambling cogs.
+
+Nothing in here talks to Discord or sleeps, so the same rules can be used by
+the cogs themselves and by the bulk simulator in cogs/utils/simulator.py.
+Every function that needs randomness takes an optional ``rng`` which defaults
+to the ``random`` module.
+"""
+import bisect
+import random
+
+# Deck used for blackjack and war, and dictionaries to correspond values of the cards.
+main_deck = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'Jack', 'Queen', 'King', 'Ace'] * 4
+
+bj_values = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9': 9, '10': 10, 'Jack': 10,
+             'Queen': 10, 'King': 10}
+
+war_values = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9': 9, '10': 10, 'Jack': 11,
+              'Queen': 12, 'King': 13, 'Ace': 14}
+
+# Totals of two dice that win the dice game
+DICE_WINNERS = (2, 7, 11, 12)
+
+# Hi-Lo pays a fixed multiplier when the dice land on seven
+HILO_SEVEN_MULTIPLIER = 6
+
+
+def payout(bet, multiplier):
+    """Amount paid back (stake included) for a winning bet"""
+    return int(round(bet * multiplier))
+
+
+def roll_dice(rng=random):
+    return rng.randint(1, 6), rng.randint(1, 6)
+
+
+def hilo_result(total):
+    """Returns "Lo", "7" or "Hi" for a two dice total"""
+    if total < 7:
+        return "Lo"
+    elif total == 7:
+        return "7"
+    else:
+        return "Hi"
+
+
+def hilo_payout(bet, multiplier, result):
+    if result == "7":
+        return bet * HILO_SEVEN_MULTIPLIER
+    return payout(bet, multiplier)
+
+
+def dice_wins(total):
+    return total in DICE_WINNERS
+
+
+def cups_outcome(rng=random):
+    return rng.randint(1, 4)
+
+
+def allin_outcome(multiplier, rng=random):
+    """Allin only wins when this returns 0"""
+    return rng.randint(0, multiplier + 1)
+
+
+# ------------------------------------------ Cards ------------------------------------------------
+
+def war_draw(deck, rng=random):
+    player_card = rng.choice(deck)
+    deck.remove(player_card)
+    dealer_card = rng.choice(deck)
+    pc = war_values[player_card]
+    dc = war_values[dealer_card]
+    return player_card, dealer_card, pc, dc
+
+
+def burn_three(deck, rng=random):
+    burn_cards = rng.sample(deck, 3)
+
+    for x in burn_cards:
+        deck.remove(x)
+
+    return war_draw(deck, rng)
+
+
+def draw_two(deck, rng=random):
+    hand = rng.sample(deck, 2)
+    deck.remove(hand[0])
+    deck.remove(hand[1])
+    return hand
+
+
+def draw_card(hand, deck, rng=random):
+    card = rng.choice(deck)
+    deck.remove(card)
+    hand.append(card)
+    return hand
+
+
+def count_hand(hand):
+    count = sum([bj_values[x] for x in hand if x in bj_values])
+
+    for x in hand:
+        if x == 'Ace' and count + 11 > 21:
+            count += 1
+        elif x == 'Ace':
+            count += 11
+
+    return count
+
+
+def dealer_hand(deck, rng=random):
+    dh = draw_two(deck, rng)
+    count = count_hand(dh)
+
+    # forces hit if ace in first two cards without 21
+    if 'Ace' in dh and count != 21:
+        dh = draw_card(dh, deck, rng)
+        count = count_hand(dh)
+
+    # defines maximum hit score X
+    while count < 17:
+        draw_card(dh, deck, rng)
+        count = count_hand(dh)
+    return dh
+
+
+def blackjack_result(pc, dc):
+    """Returns "Win", "Bust", "Push" or "Loss" for the final player and dealer counts"""
+    if dc > 21 >= pc or dc < pc <= 21:
+        return "Win"
+    elif pc > 21:
+        return "Bust"
+    elif dc == pc <= 21:
+        return "Push"
+    else:
+        return "Loss"
+
+
+# ----------------------------------------- Slot machine ------------------------------------------
+
+def slot_rows(reel, offsets):
+    """Builds the three visible rows of the slot machine.
+
+    ``reel`` is the ordered list of symbols and ``offsets`` the rotation applied
+    to the shared reel before each of the three columns is cut from it, exactly
+    like Economy.slot_machine spinning a single deque three times.
+    """
+    size = len(reel)
+    columns = []
+    total = 0
+    for offset in offsets:
+        total += offset
+        # deque(reel, maxlen=3) keeps the last three positions of the rotated reel
+        columns.append([reel[(pos - total) % size] for pos in range(size - 3, size)])
+    return tuple(tuple(column[row] for column in columns) for row in range(3))
+
+
+def slot_payout_key(line, payouts):
+    """Returns the key of ``payouts`` won by the middle ``line``, or None"""
+    if line in payouts:
+        return line
+    # Checks for two-consecutive-symbols special rewards
+    for pair in ((line[0], line[1]), (line[1], line[2])):
+        if pair in payouts:
+            return pair
+    # Still nothing. Let's check for 3 generic same symbols or 2 consecutive symbols
+    if line[0] == line[1] == line[2]:
+        return "3 symbols"
+    elif line[0] == line[1] or line[1] == line[2]:
+        return "2 symbols"
+    return None
+
+
+# -------------------------------------------- Heist ----------------------------------------------
+
+def heist_bonus(crew, max_crew):
+    percent = int(100 * crew / max_crew)
+    breakpoints = [20, 40, 60, 80, 100]
+    bonus_amounts = [0, 1, 2, 3, 4, 5]
+    return bonus_amounts[bisect.bisect_left(breakpoints, percent)]
+
+
+def heist_success_chance(success_rate, crew, max_crew):
+    return int(success_rate) + heist_bonus(crew, max_crew)
+
+
+def heist_player_succeeds(success_chance, rng=random):
+    return rng.randint(1, 100) <= success_chance
+
+
+def heist_split(vault, survivors):
+    """Credits each surviving crew member takes out of the vault"""
+    return int(int(vault) * 0.75 / survivors)
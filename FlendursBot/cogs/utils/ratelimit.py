@@ -0,0 +1,114 @@
+"""Token bucket rate limiting keyed by anything hashable.
+
+Every key gets a bucket holding up to ``limit`` tokens that refills at
+``limit / seconds`` tokens per second, which lets through bursts of at most
+``limit`` events in any ``seconds`` long window. A bucket is a small list
+updated in place, so steady traffic doesn't allocate, and buckets that have
+refilled completely are swept out every ``sweep_interval`` seconds.
+
+    mentions = RateLimiter()
+    if mentions.hit((server.id, author.id), len(message.mentions), 10, 15):
+        ...  # more than 10 mentions in 15 seconds
+
+Run ``python -m cogs.utils.ratelimit`` for a load benchmark.
+"""
+import random
+import time
+
+# Bucket fields
+TOKENS, UPDATED, LIMIT, RATE = 0, 1, 2, 3
+
+
+class RateLimiter:
+
+    def __init__(self, sweep_interval=60):
+        self.sweep_interval = sweep_interval
+        self._buckets = {}
+        self._swept = time.time()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def hit(self, key, amount, limit, seconds, now=None):
+        """Takes amount tokens from key's bucket. Returns True when the bucket
+        ran dry, meaning more than limit were taken in the last seconds."""
+        if now is None:
+            now = time.time()
+        if now - self._swept >= self.sweep_interval:
+            self.sweep(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [limit, now, limit, limit / seconds]
+        else:
+            tokens = bucket[TOKENS] + (now - bucket[UPDATED]) * bucket[RATE]
+            bucket[TOKENS] = limit if tokens > limit else tokens
+            bucket[UPDATED] = now
+            bucket[LIMIT] = limit
+            bucket[RATE] = limit / seconds
+        bucket[TOKENS] -= amount
+        if bucket[TOKENS] < 0:
+            # Keeps the overflow from piling up, so the key can recover once
+            # it stays under the rate
+            bucket[TOKENS] = 0
+            return True
+        return False
+
+    def reset(self, key):
+        self._buckets.pop(key, None)
+
+    def sweep(self, now=None):
+        """Forgets full buckets, they behave the same as missing ones"""
+        if now is None:
+            now = time.time()
+        self._swept = now
+        full = [key for key, bucket in self._buckets.items()
+                if bucket[TOKENS] + (now - bucket[UPDATED]) * bucket[RATE] >= bucket[LIMIT]]
+        for key in full:
+            del self._buckets[key]
+
+
+def synthetic_stream(messages, users, spammers, duration, rng):
+    """(timestamp, user) pairs, spammers sending half of the messages"""
+    stream = []
+    for i in range(messages):
+        if spammers and i % 2:
+            user = rng.randrange(spammers)
+        else:
+            user = rng.randrange(users)
+        stream.append((duration * i / messages, user))
+    return stream
+
+
+def benchmark(messages=200000, users=20000, spammers=50, duration=60.0):
+    import tracemalloc
+    rng = random.Random(0)
+    stream = synthetic_stream(messages, users, spammers, duration, rng)
+    keys = [("server", user) for user in range(users)]
+    limiter = RateLimiter(sweep_interval=10)
+
+    start = time.perf_counter()
+    flagged = set()
+    for timestamp, user in stream:
+        if limiter.hit(keys[user], 1, 10, 10, now=timestamp):
+            flagged.add(user)
+    elapsed = time.perf_counter() - start
+    print("{:,} messages from {:,} users over {:.0f}s: {:.2f}s, {:,.0f} messages/s"
+          "".format(messages, users, duration, elapsed, messages / elapsed))
+    print("flagged {} users ({} spammers), {} buckets left"
+          "".format(len(flagged), spammers, len(limiter)))
+
+    # Replays the same stream on the warm limiter to see what it allocates
+    offset = duration + 1
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for timestamp, user in stream[:messages // 10]:
+        limiter.hit(keys[user], 1, 10, 10, now=offset + timestamp)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    grown = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print("memory growth over {:,} more messages: {:,} bytes"
+          "".format(messages // 10, grown))
+
+
+if __name__ == "__main__":
+    benchmark()
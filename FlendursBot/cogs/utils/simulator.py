@@ -0,0 +1,341 @@
+"""Vectorized Monte-Carlo simulator for the casino, economy and heist games.
+
+The rules are the ones in cogs/utils/games.py, replayed in bulk with NumPy so
+that operators can see the house edge, variance and credit inflation of a
+multiplier configuration before putting it live. Requires numpy.
+
+    >>> from cogs.utils import simulator
+    >>> simulator.simulate_dice(1000000, bet=50, multiplier=2.2)
+"""
+import math
+from collections import namedtuple
+
+from . import games
+
+try:
+    import numpy as np
+    numpyAvailable = True
+except ImportError:
+    numpyAvailable = False
+
+# Rounds simulated per NumPy batch. Card games keep a whole deck per round,
+# so this keeps the scratch arrays at a few tens of MB.
+CHUNK_SIZE = 1 << 18
+
+SimulationResult = namedtuple("SimulationResult", ["game", "rounds", "wagered", "returned",
+                                                   "house_edge", "std_dev", "win_rate"])
+SimulationResult.__doc__ = """Aggregated outcome of a simulation.
+
+wagered / returned are the total credits bet and paid back (stakes included),
+house_edge the fraction of every wagered credit kept by the house and std_dev
+the standard deviation of the player's net result per round, in credits.
+"""
+SimulationResult.inflation = property(lambda self: self.returned - self.wagered,
+                                      doc="Credits created (negative: destroyed) by all rounds")
+
+
+class SimulatorError(Exception):
+    pass
+
+
+class _Tally:
+    """Running sums so that chunked simulations never hold every round in memory"""
+
+    def __init__(self, game):
+        self.game = game
+        self.rounds = 0
+        self.wagered = 0.0
+        self.returned = 0.0
+        self.net_sq = 0.0
+        self.wins = 0
+
+    def add(self, stakes, returns):
+        stakes = np.broadcast_to(np.asarray(stakes, dtype=np.float64), returns.shape)
+        net = returns - stakes
+        self.rounds += returns.size
+        self.wagered += float(stakes.sum())
+        self.returned += float(returns.sum())
+        self.net_sq += float(np.dot(net, net))
+        self.wins += int(np.count_nonzero(net > 0))
+
+    def result(self):
+        if not self.rounds:
+            raise SimulatorError("No rounds were simulated.")
+        mean = (self.returned - self.wagered) / self.rounds
+        variance = max(self.net_sq / self.rounds - mean * mean, 0.0)
+        edge = (self.wagered - self.returned) / self.wagered if self.wagered else 0.0
+        return SimulationResult(self.game, self.rounds, self.wagered, self.returned, edge,
+                                math.sqrt(variance), self.wins / self.rounds)
+
+
+def _chunks(rounds):
+    while rounds > 0:
+        size = min(rounds, CHUNK_SIZE)
+        rounds -= size
+        yield size
+
+
+def _rng(seed):
+    if not numpyAvailable:
+        raise SimulatorError("The simulator requires numpy. Run 'pip3 install numpy'.")
+    return np.random.default_rng(seed)
+
+
+def _two_dice(rng, size):
+    return rng.integers(1, 7, size) + rng.integers(1, 7, size)
+
+
+# ---------------------------------------- Casino games -------------------------------------------
+
+def simulate_hilo(rounds, bet, multiplier, choice="Hi", seed=None):
+    """choice is "Lo", "Hi" or "7", see games.hilo_result"""
+    if choice not in ("Lo", "Hi", "7"):
+        raise SimulatorError("choice must be one of Lo, Hi or 7.")
+    rng = _rng(seed)
+    tally = _Tally("Hi-Lo")
+    win_amount = games.hilo_payout(bet, multiplier, choice)
+    for size in _chunks(rounds):
+        total = _two_dice(rng, size)
+        if choice == "Lo":
+            won = total < 7
+        elif choice == "7":
+            won = total == 7
+        else:
+            won = total > 7
+        tally.add(bet, np.where(won, win_amount, 0).astype(np.float64))
+    return tally.result()
+
+
+def simulate_cups(rounds, bet, multiplier, seed=None):
+    rng = _rng(seed)
+    tally = _Tally("Cups")
+    win_amount = games.payout(bet, multiplier)
+    for size in _chunks(rounds):
+        # The player's pick does not matter, the cup is uniformly random
+        won = rng.integers(1, 5, size) == 1
+        tally.add(bet, np.where(won, win_amount, 0).astype(np.float64))
+    return tally.result()
+
+
+def simulate_coin(rounds, bet, multiplier, seed=None):
+    rng = _rng(seed)
+    tally = _Tally("Coin")
+    win_amount = games.payout(bet, multiplier)
+    for size in _chunks(rounds):
+        won = rng.integers(0, 2, size) == 0
+        tally.add(bet, np.where(won, win_amount, 0).astype(np.float64))
+    return tally.result()
+
+
+def simulate_dice(rounds, bet, multiplier, seed=None):
+    rng = _rng(seed)
+    tally = _Tally("Dice")
+    win_amount = games.payout(bet, multiplier)
+    winners = np.array(games.DICE_WINNERS)
+    for size in _chunks(rounds):
+        won = np.isin(_two_dice(rng, size), winners)
+        tally.add(bet, np.where(won, win_amount, 0).astype(np.float64))
+    return tally.result()
+
+
+def simulate_allin(rounds, balance, multiplier, seed=None):
+    """multiplier is the integer the player passes to the allin command"""
+    rng = _rng(seed)
+    tally = _Tally("Allin")
+    win_amount = games.payout(balance, multiplier)
+    for size in _chunks(rounds):
+        won = rng.integers(0, multiplier + 2, size) == 0
+        tally.add(balance, np.where(won, win_amount, 0).astype(np.float64))
+    return tally.result()
+
+
+def _deck_values(values):
+    return np.array([values.get(card, 0) for card in games.main_deck], dtype=np.int64)
+
+
+def simulate_war(rounds, bet, multiplier, go_to_war=True, seed=None):
+    """go_to_war picks the player's answer on a tie, otherwise they surrender"""
+    rng = _rng(seed)
+    tally = _Tally("War")
+    values = _deck_values(games.war_values)
+    deck_size = len(games.main_deck)
+    win_amount = int(bet * multiplier)
+    war_amount = int(bet * multiplier + bet)
+    for size in _chunks(rounds):
+        player = rng.integers(0, deck_size, size)
+        # The dealer draws from the remaining cards, but the card stays in the deck
+        dealer = (player + rng.integers(1, deck_size, size)) % deck_size
+        pc = values[player]
+        dc = values[dealer]
+        stakes = np.full(size, bet, dtype=np.float64)
+        returns = np.where(pc > dc, win_amount, 0).astype(np.float64)
+        tie = np.flatnonzero(pc == dc)
+        if tie.size:
+            if go_to_war:
+                # Burn three, then deal from a fresh shuffle of the 51 remaining cards
+                keys = rng.random((tie.size, deck_size))
+                keys[np.arange(tie.size), player[tie]] = np.inf
+                order = np.argsort(keys, axis=1)
+                won = values[order[:, 3]] >= values[order[:, 4]]
+                stakes[tie] = 2 * bet
+                returns[tie] = np.where(won, war_amount, 0)
+            else:
+                returns[tie] = int(bet / 2)
+        tally.add(stakes, returns)
+    return tally.result()
+
+
+def _bj_count(total, aces):
+    """Vectorized games.count_hand from the non-ace total and the number of aces"""
+    count = total.copy()
+    for i in range(4):
+        add = np.where(count + 11 > 21, 1, 11)
+        count = np.where(aces > i, count + add, count)
+    return count
+
+
+def simulate_blackjack(rounds, bet, multiplier, stand_on=17, seed=None):
+    """The simulated player hits until their count reaches stand_on and never doubles"""
+    rng = _rng(seed)
+    tally = _Tally("Blackjack")
+    values = _deck_values(games.bj_values)
+    is_ace = np.array([card == 'Ace' for card in games.main_deck], dtype=np.int64)
+    deck_size = len(games.main_deck)
+    win_amount = games.payout(bet, multiplier)
+    for size in _chunks(rounds):
+        # Shuffled lazily: every draw is one Fisher-Yates step on the rows that draw
+        deck = np.tile(np.arange(deck_size, dtype=np.int8), (size, 1))
+        rows = np.arange(size)
+        top = np.zeros(size, dtype=np.int64)
+
+        def deal(total, aces, mask):
+            pick = rng.integers(top, deck_size)
+            card = deck[rows, pick]
+            deck[rows, pick] = deck[rows, top]
+            deck[rows, top] = card
+            total += np.where(mask, values[card], 0)
+            aces += np.where(mask, is_ace[card], 0)
+            top[mask] += 1
+
+        # The dealer's hand is drawn first, see games.dealer_hand
+        d_total = np.zeros(size, dtype=np.int64)
+        d_aces = np.zeros(size, dtype=np.int64)
+        everyone = np.ones(size, dtype=bool)
+        deal(d_total, d_aces, everyone)
+        deal(d_total, d_aces, everyone)
+        d_count = _bj_count(d_total, d_aces)
+        deal(d_total, d_aces, (d_aces > 0) & (d_count != 21))
+        d_count = _bj_count(d_total, d_aces)
+        hitting = d_count < 17
+        while hitting.any():
+            deal(d_total, d_aces, hitting)
+            d_count = _bj_count(d_total, d_aces)
+            hitting = d_count < 17
+
+        p_total = np.zeros(size, dtype=np.int64)
+        p_aces = np.zeros(size, dtype=np.int64)
+        deal(p_total, p_aces, everyone)
+        deal(p_total, p_aces, everyone)
+        p_count = _bj_count(p_total, p_aces)
+        hitting = (p_count < stand_on) & (p_count < 21)
+        while hitting.any():
+            deal(p_total, p_aces, hitting)
+            p_count = _bj_count(p_total, p_aces)
+            hitting = (p_count < stand_on) & (p_count < 21)
+
+        # Same ordering as games.blackjack_result
+        win = ((d_count > 21) & (p_count <= 21)) | ((d_count < p_count) & (p_count <= 21))
+        push = ~win & (p_count <= 21) & (d_count == p_count)
+        returns = np.where(win, win_amount, np.where(push, bet, 0)).astype(np.float64)
+        tally.add(bet, returns)
+    return tally.result()
+
+
+def simulate_casino(game, settings, rounds, bet=None, seed=None, allin_multiplier=None):
+    """Simulates a casino game using a server's casino settings.
+
+    bet defaults to the game's minimum bet. For Allin it is the player's balance
+    and allin_multiplier, the number passed to the allin command, is required.
+    """
+    config = settings["Games"][game]
+    multiplier = config["Multiplier"]
+    if bet is None:
+        bet = config.get("Min", 100)
+    if game == "Hi-Lo":
+        return simulate_hilo(rounds, bet, multiplier, seed=seed)
+    elif game == "Cups":
+        return simulate_cups(rounds, bet, multiplier, seed=seed)
+    elif game == "Coin":
+        return simulate_coin(rounds, bet, multiplier, seed=seed)
+    elif game == "Dice":
+        return simulate_dice(rounds, bet, multiplier, seed=seed)
+    elif game == "War":
+        return simulate_war(rounds, bet, multiplier, seed=seed)
+    elif game == "Blackjack":
+        return simulate_blackjack(rounds, bet, multiplier, seed=seed)
+    elif game == "Allin":
+        if allin_multiplier is None:
+            raise SimulatorError("Allin needs the multiplier passed to the allin command.")
+        return simulate_allin(rounds, bet, allin_multiplier, seed=seed)
+    raise SimulatorError("There is no simulation for {}.".format(game))
+
+
+# ----------------------------------------- Slot machine ------------------------------------------
+
+def slot_payout_table(reel, payouts, bid):
+    """Credits paid back for every possible middle line, indexed like
+    a * len(reel) ** 2 + b * len(reel) + c"""
+    size = len(reel)
+    table = np.zeros(size ** 3, dtype=np.float64)
+    for index in range(size ** 3):
+        line = (reel[index // (size * size)], reel[index // size % size], reel[index % size])
+        key = games.slot_payout_key(line, payouts)
+        if key is not None:
+            table[index] = payouts[key]["payout"](bid)
+    return table
+
+
+def simulate_slots(rounds, bid, reel, payouts, seed=None):
+    """reel and payouts are Economy's list(SMReel) and PAYOUTS"""
+    rng = _rng(seed)
+    tally = _Tally("Slots")
+    size = len(reel)
+    table = slot_payout_table(reel, payouts, bid)
+    for chunk in _chunks(rounds):
+        offsets = np.cumsum(rng.integers(-999, 1000, (chunk, 3)), axis=1)
+        # Middle row of every column, see games.slot_rows
+        middle = (size - 2 - offsets) % size
+        index = middle[:, 0] * size * size + middle[:, 1] * size + middle[:, 2]
+        tally.add(bid, table[index])
+    return tally.result()
+
+
+# -------------------------------------------- Heist ----------------------------------------------
+
+def simulate_heist(rounds, crew, success_rate, max_crew, vault, cost, bonus=0, seed=None):
+    """Every round is a whole heist of ``crew`` players against a vault holding ``vault``.
+
+    bonus is the average credit bonus of the theme's good outcomes.
+    """
+    rng = _rng(seed)
+    tally = _Tally("Heist")
+    chance = min(games.heist_success_chance(success_rate, crew, max_crew), 100) / 100
+    for size in _chunks(rounds):
+        survivors = rng.binomial(crew, chance, size)
+        split = np.floor(int(vault) * 0.75 / np.maximum(survivors, 1))
+        returns = np.where(survivors > 0, survivors * (split + bonus), 0).astype(np.float64)
+        tally.add(crew * cost, returns)
+    return tally.result()
+
+
+def format_result(result):
+    return ("Game:        {0.game}\n"
+            "Rounds:      {0.rounds:,}\n"
+            "Wagered:     {0.wagered:,.0f}\n"
+            "Returned:    {0.returned:,.0f}\n"
+            "House edge:  {1:.3f}%\n"
+            "Std dev:     {0.std_dev:,.2f} per round\n"
+            "Win rate:    {2:.3f}%\n"
+            "Inflation:   {3:+,.0f} credits ({4:+,.2f} per round)"
+            "".format(result, result.house_edge * 100, result.win_rate * 100,
+                      result.inflation, result.inflation / result.rounds))
@@ -0,0 +1,184 @@
+"""Shared durable timers for the cogs.
+
+Timers are keyed by (namespace, key), where namespace is usually the cog name
+and key a string the cog picks, and carry a small JSON-able dict. All of them
+sit in one min-heap and a single ``loop.call_at`` handle is armed for the
+earliest deadline, so thousands of timers cost one handle. The table is saved
+to a JSON file shortly after it changes; on startup it's loaded and heapified
+once, and overdue timers fire as soon as their cog registers its handler.
+
+    timers.register("Punish", self.punishment_expired)
+    timers.schedule("Punish", key, time.time() + 600, {"reason": reason})
+    timers.cancel("Punish", key)
+
+Handlers are called with (key, data) and may return a coroutine, which gets
+scheduled as a task. Rescheduling a key replaces its timer.
+"""
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import os
+import time
+
+from .dataIO import dataIO
+
+log = logging.getLogger("red.timers")
+
+
+class TimerService:
+
+    def __init__(self, file_path, save_delay=5):
+        self.file_path = file_path
+        self.save_delay = save_delay
+        self._entries = None  # (namespace, key) -> (deadline, seq, data)
+        self._heap = []       # (deadline, seq, namespace, key), may hold stale items
+        self._seq = itertools.count()
+        self._handlers = {}   # namespace -> callable
+        self._parked = {}     # namespace -> keys that came due with no handler
+        self._loop = None
+        self._wakeup = None   # (deadline, handle)
+        self._save_handle = None
+
+    def register(self, namespace, handler, loop=None):
+        """Starts delivering namespace's timers to handler"""
+        self._load()
+        if loop is not None:
+            self._loop = loop
+        self._handlers[namespace] = handler
+        for key in self._parked.pop(namespace, ()):
+            entry = self._entries.get((namespace, key))
+            if entry is not None:
+                heapq.heappush(self._heap, (entry[0], entry[1], namespace, key))
+        self._arm()
+
+    def unregister(self, namespace):
+        """Stops delivering namespace's timers, they stay saved"""
+        self._handlers.pop(namespace, None)
+
+    def schedule(self, namespace, key, deadline, data=None):
+        """Fires the timer at the deadline, a time.time() timestamp"""
+        self._load()
+        seq = next(self._seq)
+        self._entries[(namespace, key)] = (deadline, seq, data or {})
+        heapq.heappush(self._heap, (deadline, seq, namespace, key))
+        self._arm()
+        self._changed()
+
+    def cancel(self, namespace, key):
+        """Returns True if there was a timer to cancel"""
+        self._load()
+        # The heap item goes stale and is skipped when it comes up
+        if self._entries.pop((namespace, key), None) is None:
+            return False
+        self._changed()
+        return True
+
+    def get(self, namespace, key):
+        """(deadline, data) of a pending timer, or None"""
+        self._load()
+        entry = self._entries.get((namespace, key))
+        return None if entry is None else (entry[0], entry[2])
+
+    def pending(self, namespace):
+        """{key: (deadline, data)} of every pending timer in namespace"""
+        self._load()
+        return {key: (deadline, data)
+                for (ns, key), (deadline, _, data) in self._entries.items()
+                if ns == namespace}
+
+    def save(self):
+        """Writes the timers now"""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if self._entries is None:
+            return
+        data = [[namespace, key, deadline, entry_data]
+                for (namespace, key), (deadline, _, entry_data) in self._entries.items()]
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        dataIO.save_json(self.file_path, data)
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if not dataIO.is_valid_json(self.file_path):
+            return
+        for namespace, key, deadline, data in dataIO.load_json(self.file_path):
+            seq = next(self._seq)
+            self._entries[(namespace, key)] = (deadline, seq, data)
+            self._heap.append((deadline, seq, namespace, key))
+        heapq.heapify(self._heap)
+
+    def _get_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        return self._loop
+
+    def _arm(self):
+        """Points the wakeup handle at the earliest live timer"""
+        heap = self._heap
+        while heap and self._is_stale(heap[0]):
+            heapq.heappop(heap)
+        if not heap:
+            return
+        deadline = heap[0][0]
+        if self._wakeup is not None:
+            if self._wakeup[0] <= deadline:
+                return
+            self._wakeup[1].cancel()
+        loop = self._get_loop()
+        when = loop.time() + max(deadline - time.time(), 0)
+        self._wakeup = (deadline, loop.call_at(when, self._fire))
+
+    def _is_stale(self, item):
+        deadline, seq, namespace, key = item
+        entry = self._entries.get((namespace, key))
+        return entry is None or entry[1] != seq
+
+    def _fire(self):
+        self._wakeup = None
+        now = time.time()
+        heap = self._heap
+        fired = False
+        while heap and heap[0][0] <= now:
+            item = heapq.heappop(heap)
+            if self._is_stale(item):
+                continue
+            _, _, namespace, key = item
+            handler = self._handlers.get(namespace)
+            if handler is None:
+                self._parked.setdefault(namespace, []).append(key)
+                continue
+            _, _, data = self._entries.pop((namespace, key))
+            fired = True
+            try:
+                result = handler(key, data)
+                if inspect.isawaitable(result):
+                    self._get_loop().create_task(result)
+            except Exception:
+                log.exception("Timer {} {} failed".format(namespace, key))
+        if fired:
+            self._changed()
+        self._arm()
+
+    def _changed(self):
+        if self._save_handle is not None:
+            return
+        try:
+            loop = self._get_loop()
+        except RuntimeError:
+            return
+        self._save_handle = loop.call_later(self.save_delay, self._snapshot)
+
+    def _snapshot(self):
+        self._save_handle = None
+        try:
+            self.save()
+        except Exception:
+            log.exception("Could not save the timers")
+
+
+timers = TimerService("data/red/timers.json")
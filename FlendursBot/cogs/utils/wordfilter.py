@@ -0,0 +1,69 @@
+"""Compiled matcher for Mod's per server word filter.
+
+The filtered words are merged into a trie and the trie is turned into a
+single regular expression, so a message is scanned once no matter how many
+words the server filters, and the scanning happens inside the re module.
+
+    matcher = WordFilter(["bad", "badger", "worse"], whole_words=True)
+    matcher.search("What a BADGER")  # -> "badger"
+"""
+import re
+import unicodedata
+
+
+def normalize(text):
+    """Folds case, compatibility characters and accents: "Ｂáď" -> "bad"."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.casefold()
+
+
+def _trie_pattern(node):
+    branches = [re.escape(char) + _trie_pattern(child)
+                for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    terminal = "" in node
+    if len(branches) == 1 and not terminal:
+        return branches[0]
+    pattern = "(?:" + "|".join(branches) + ")"
+    if terminal:
+        pattern += "?"
+    return pattern
+
+
+class WordFilter:
+
+    def __init__(self, words, whole_words=False, normalized=False):
+        self.whole_words = whole_words
+        self.normalized = normalized
+        self._fold = normalize if normalized else str.lower
+        self.words = {}  # folded word: word as it was added
+        for word in words:
+            folded = self._fold(word)
+            if folded:
+                self.words.setdefault(folded, word)
+        self._regex = self._compile()
+
+    def _compile(self):
+        if not self.words:
+            return None
+        trie = {}
+        for word in self.words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[""] = True
+        pattern = _trie_pattern(trie)
+        if self.whole_words:
+            pattern = r"(?<!\w)(?:{})(?!\w)".format(pattern)
+        return re.compile(pattern)
+
+    def search(self, text):
+        """Returns the first filtered word found in text, or None"""
+        if self._regex is None:
+            return None
+        match = self._regex.search(self._fold(text))
+        if match is None:
+            return None
+        return self.words.get(match.group(), match.group())
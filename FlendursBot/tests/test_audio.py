@@ -0,0 +1,35 @@
+import __main__
+
+import pytest
+
+pytest.importorskip("discord")
+
+# Cogs import these from red.py, which is __main__ when the bot runs
+for name in ("send_cmd_help", "settings"):
+    if not hasattr(__main__, name):
+        setattr(__main__, name, None)
+
+from cogs.audio import Audio  # noqa: E402
+
+
+@pytest.fixture
+def audio():
+    return Audio.__new__(Audio)
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/playlist?list=PL0123456789",
+    "www.youtube.com/playlist?list=PL0123456789",
+    "youtube.com/playlist?list=PL0123456789",
+])
+def test_playlist_urls(audio, url):
+    assert audio._is_playlist_url(url)
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PL0123456789",
+    "youtube.com/watch?v=dQw4w9WgXcQ&list=PL0123456789",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+])
+def test_song_urls(audio, url):
+    assert not audio._is_playlist_url(url)